@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+"""Benchmark the HyperCube shuffle planning of MyriaHyperCubeAlgebra.
+
+Compiles cycle queries R0(x0,x1), R1(x1,x2), ..., Rn-1(xn-1,x0), which join
+n variables, to a HyperCube shuffle and LeapFrogJoin plan on an increasing
+number of servers. Reports the compile time of the current share optimizer
+and cell partitioning, and of the breadth-first search and cell enumeration
+they replaced, and checks that both find a plan of the same workload.
+
+    python benchmarks/hypercube_shares.py [--servers 16,64,256,512]
+        [--variables 3,4,5,6,7,8] [--baseline-timeout 10]
+"""
+
+import argparse
+import contextlib
+import itertools
+import os
+import sys
+import timeit
+from collections import defaultdict, deque
+from functools import reduce
+from operator import mul
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from raco import RACompiler  # noqa
+from raco.backends import myria as myrialang  # noqa
+from raco.catalog import FakeCatalog  # noqa
+
+HCShuffle = myrialang.HCShuffleBeforeNaryJoin
+
+
+def bfs_dim_size(num_server, child_sizes, conditions, r_index):
+    """The breadth-first search over all dimension sizes"""
+    def product(array):
+        return reduce(mul, array, 1)
+    visited = set()
+    toVisit = deque()
+    toVisit.append(tuple([1 for _ in conditions]))
+    min_work_load = None
+    opt_dim_sizes = [0] * len(conditions)
+    while len(toVisit) > 0:
+        dim_sizes = toVisit.pop()
+        workload = HCShuffle.workload(dim_sizes, child_sizes, r_index)
+        if ((workload < min_work_load) or (
+            workload == min_work_load and max(dim_sizes) < max(
+                opt_dim_sizes)) or (min_work_load is None)):
+            min_work_load = workload
+            opt_dim_sizes = dim_sizes
+        visited.add(dim_sizes)
+        for i, d in enumerate(dim_sizes):
+            new_dim_sizes = (dim_sizes[0:i] +
+                             tuple([dim_sizes[i] + 1]) +
+                             dim_sizes[i + 1:])
+            if (product(new_dim_sizes) <= num_server and
+                    new_dim_sizes not in visited):
+                toVisit.append(new_dim_sizes)
+    return opt_dim_sizes, min_work_load
+
+
+def enumerated_cell_partition(dim_sizes, conditions, child_schemes,
+                              child_idx, hashed_columns):
+    """The cell partition computed from every cell of the hyper cube"""
+    r_index = HCShuffle.reversed_index(child_schemes, conditions)
+    hashed_dims = [r_index[child_idx][col] for col in hashed_columns]
+    cell_partition = defaultdict(list)
+    coor_ranges = [list(range(d)) for d in dim_sizes]
+    for coordinate in itertools.product(*coor_ranges):
+        voxel = [coordinate[dim] for dim in hashed_dims]
+        cell_partition[tuple(voxel)].append(
+            HCShuffle.coord_to_worker_id(coordinate, dim_sizes))
+    return [wid for vox, wid in sorted(cell_partition.items())]
+
+
+@contextlib.contextmanager
+def baseline():
+    """Plan with the breadth-first search and the cell enumeration"""
+    dim_size = HCShuffle.__dict__['get_hyper_cube_dim_size']
+    cell_partition = HCShuffle.__dict__['get_cell_partition']
+    HCShuffle.get_hyper_cube_dim_size = staticmethod(bfs_dim_size)
+    HCShuffle.get_cell_partition = staticmethod(enumerated_cell_partition)
+    try:
+        yield
+    finally:
+        HCShuffle.get_hyper_cube_dim_size = dim_size
+        HCShuffle.get_cell_partition = cell_partition
+
+
+def cycle_query(num_variables):
+    atoms = ['R{i}(x{i},x{j})'.format(i=i, j=(i + 1) % num_variables)
+             for i in range(num_variables)]
+    head = ','.join('x{i}'.format(i=i) for i in range(num_variables))
+    return 'A({h}):-{b}'.format(h=head, b=','.join(atoms))
+
+
+def compile_query(query, num_servers):
+    """Compile a query, return the time and the hyper cube dimensions"""
+    dlog = RACompiler()
+    dlog.fromDatalog(query)
+    start = timeit.default_timer()
+    dlog.optimize(myrialang.MyriaHyperCubeAlgebra(FakeCatalog(num_servers)))
+    elapsed = timeit.default_timer() - start
+    shuffles = [op for op in dlog.physicalplan.walk()
+                if isinstance(op, myrialang.MyriaHyperCubeShuffleProducer)]
+    return elapsed, shuffles
+
+
+def workload(shuffles):
+    """The workload of the plan, from the hyper cube of its shuffles"""
+    dim_sizes = shuffles[0].hyper_cube_dimensions
+    load = 0.0
+    for op in shuffles:
+        scale = reduce(mul, [dim_sizes[d] for d in op.mapped_hc_dimensions],
+                       1)
+        load += float(op.input.num_tuples()) / scale
+    return load
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--servers', default='16,64,256,512',
+                        help='comma-separated numbers of servers')
+    parser.add_argument('--variables', default='3,4,5,6,7,8',
+                        help='comma-separated numbers of join variables')
+    parser.add_argument('--baseline-timeout', type=float, default=10,
+                        help='skip the baseline on more servers once it '
+                             'takes longer than this many seconds')
+    opts = parser.parse_args(args)
+    servers = [int(s) for s in opts.servers.split(',')]
+    variables = [int(v) for v in opts.variables.split(',')]
+
+    print '{:>9} {:>8} {:>12} {:>12} {:>8}  {}'.format(
+        'variables', 'servers', 'current (s)', 'baseline (s)', 'speedup',
+        'dimensions')
+    for num_variables in variables:
+        query = cycle_query(num_variables)
+        baseline_time = 0
+        for num_servers in servers:
+            elapsed, shuffles = compile_query(query, num_servers)
+            if baseline_time <= opts.baseline_timeout:
+                with baseline():
+                    baseline_time, baseline_shuffles = compile_query(
+                        query, num_servers)
+                assert (abs(workload(shuffles) - workload(baseline_shuffles))
+                        <= 1e-9 * workload(shuffles)), query
+                base, speedup = ('{:.4f}'.format(baseline_time),
+                                 '{:.1f}x'.format(baseline_time / elapsed))
+            else:
+                base, speedup = 'skipped', ''
+            print '{:>9} {:>8} {:>12.4f} {:>12} {:>8}  {}'.format(
+                num_variables, num_servers, elapsed, base, speedup,
+                shuffles[0].hyper_cube_dimensions)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+"""Benchmark the startup time of the raco package and the myrial script.
+
+Runs each target in a new interpreter, as batch scripts run myrial, and
+reports the median wall time of several runs and the heavy dependencies it
+loaded. Exits with status 1 if a target exceeds its time budget or loads a
+dependency it should only load on first use, so that it can guard against
+regressions.
+
+    python benchmarks/import_time.py [--runs 5] [--budget-scale 1.0]
+        [--profile TARGET] [--top 20]
+
+--profile lists the slowest imports of a target, including the time of the
+modules they import, in the manner of python3 -X importtime.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import timeit
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+MYRIAL = os.path.join(ROOT, 'scripts', 'myrial')
+PROGRAM = os.path.join(ROOT, 'examples', 'join.myl')
+
+# Dependencies that are slow to import
+HEAVY = ['networkx', 'numpy', 'pyparsing', 'requests', 'sqlalchemy']
+
+# name: (Python code, budget in seconds, heavy dependencies it may load)
+TARGETS = [
+    ('import raco', ('import raco', 0.3, [])),
+    ('import raco.myrial.interpreter',
+     ('import raco.myrial.interpreter', 0.6, ['networkx', 'numpy'])),
+    ('myrial -p',
+     ('import imp; imp.load_source("myrial", {!r}).main(["-p", {!r}])'
+      .format(MYRIAL, PROGRAM), 0.6, ['networkx', 'numpy'])),
+    ('myrial -l',
+     ('import imp; imp.load_source("myrial", {!r}).main(["-l", {!r}])'
+      .format(MYRIAL, PROGRAM), 0.7, ['networkx', 'numpy'])),
+]
+
+# Print the heavy dependencies loaded by the target
+REPORT = """
+import sys
+heavy = {heavy!r}
+sys.stderr.write('\\nloaded: ' + ','.join(
+    m for m in heavy if sys.modules.get(m) is not None) + '\\n')
+"""
+
+# Time each import, including the modules it imports
+PROFILE = """
+import __builtin__, sys, timeit
+original = __builtin__.__import__
+times = {}
+def timed_import(name, globals=None, locals=None, fromlist=None, level=-1):
+    loaded = len(sys.modules)
+    start = timeit.default_timer()
+    try:
+        return original(name, globals, locals, fromlist, level)
+    finally:
+        if len(sys.modules) > loaded:
+            importer = (globals or {}).get('__name__', '?')
+            key = '{} -> {}'.format(importer, name)
+            times[key] = (times.get(key, 0) +
+                          timeit.default_timer() - start)
+__builtin__.__import__ = timed_import
+exec compile(%r, '<target>', 'exec')
+__builtin__.__import__ = original
+sys.stderr.write('\\nprofile: ' + json.dumps(times) + '\\n')
+"""
+
+
+def run(code):
+    """Run code in a new interpreter, return its wall time and stderr"""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    start = timeit.default_timer()
+    proc = subprocess.Popen([sys.executable, '-c', code], env=env,
+                            stdout=open(os.devnull, 'w'),
+                            stderr=subprocess.PIPE)
+    _, err = proc.communicate()
+    elapsed = timeit.default_timer() - start
+    if proc.returncode != 0:
+        raise RuntimeError(err)
+    return elapsed, err
+
+
+def last_line(err, prefix):
+    lines = [l for l in err.splitlines() if l.startswith(prefix)]
+    return lines[-1][len(prefix):]
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def profile(code, top):
+    _, err = run('import json\n' + PROFILE % code)
+    times = json.loads(last_line(err, 'profile: '))
+    for key, elapsed in sorted(times.items(), key=lambda kv: -kv[1])[:top]:
+        print '{:>9.4f}  {}'.format(elapsed, key)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--runs', type=int, default=5,
+                        help='runs of each target')
+    parser.add_argument('--budget-scale', type=float, default=1.0,
+                        help='multiply the budgets, e.g., on slow machines')
+    parser.add_argument('--profile', choices=[name for name, _ in TARGETS],
+                        help='list the slowest imports of a target instead')
+    parser.add_argument('--top', type=int, default=20,
+                        help='number of imports listed by --profile')
+    opts = parser.parse_args(args)
+
+    if opts.profile:
+        profile(dict(TARGETS)[opts.profile][0], opts.top)
+        return 0
+
+    print '{:<32} {:>10} {:>10}  {}'.format(
+        'target', 'median (s)', 'budget (s)', 'heavy dependencies')
+    failed = False
+    for name, (code, budget, allowed) in TARGETS:
+        budget *= opts.budget_scale
+        code = code + '\n' + REPORT.format(heavy=HEAVY)
+        times, loaded = [], None
+        for _ in range(opts.runs):
+            elapsed, err = run(code)
+            times.append(elapsed)
+            loaded = [m for m in last_line(err, 'loaded: ').split(',') if m]
+        elapsed = median(times)
+        unexpected = sorted(set(loaded) - set(allowed))
+        status = ''
+        if elapsed > budget:
+            status += '  OVER BUDGET'
+        if unexpected:
+            status += '  UNEXPECTED: ' + ','.join(unexpected)
+        failed = failed or bool(status)
+        print '{:<32} {:>10.3f} {:>10.3f}  {}{}'.format(
+            name, elapsed, budget, ','.join(loaded) or '-', status)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+"""Benchmark compiling a long synthetic MyriaL program.
+
+The program repeats a block of five statements, as generated analytics
+scripts do: a wide intermediate relation computed by a join, three reports
+that each reference it (one of them twice), and a store. Reports the time of
+each compilation stage with the current compiler, and with what it replaced:
+deep copies in symbol lookups and inlining, a liveness analysis that
+propagated one node per pass, and a dead code elimination that recomputed
+liveness after deleting each node.
+
+    python benchmarks/myrial_compile.py [--statements 100,250,500]
+        [--no-physical] [--baseline-timeout 30]
+"""
+
+import argparse
+import collections
+import contextlib
+import copy
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import raco.algebra  # noqa
+from raco.fakedb import FakeDatabase  # noqa
+from raco.myrial.cfg import ControlFlowGraph  # noqa
+from raco.myrial.interpreter import StatementProcessor  # noqa
+from raco.myrial.parser import Parser  # noqa
+import raco.scheme as scheme  # noqa
+from raco import types  # noqa
+
+COLUMNS = 'abcdefgh'
+
+
+def program(num_statements):
+    columns = ', '.join('x.' + c for c in COLUMNS)
+    block = [
+        't{k} = [from scan(public:adhoc:X) as x, scan(public:adhoc:Y) as y'
+        ' where x.a = y.a and x.b > {k} emit {cols}, y.b as yb];',
+        'r{k} = [from t{k} where c > 1 emit a, sum(d), count(*)];',
+        's{k} = [from t{k} as p, t{k} as q where p.a = q.b emit p.a, q.e];',
+        'u{k} = [from t{k} where e < f emit a, max(g), min(h)];',
+        'store(s{k}, OUT{k});']
+    lines = []
+    k = 0
+    while len(lines) < num_statements - 1:
+        lines += [line.format(k=k, cols=columns) for line in block]
+        k += 1
+    # the first intermediate is live until the end
+    return '\n'.join(lines[:num_statements - 1] + ['store(t0, OUT);'])
+
+
+def legacy_compute_liveness(self):
+    """Propagate liveness one node per pass"""
+    live_in = {i: copy.copy(self.graph.node[i]['uses']) for i in self.graph}
+    live_out = {i: set() for i in self.graph}
+    while True:
+        live_in_prev = {i: frozenset(s) for i, s in live_in.items()}
+        live_out_prev = {i: frozenset(s) for i, s in live_out.items()}
+        for i in self.graph:
+            def_var = self.graph.node[i]['def_var']
+            def_set = set()
+            if def_var is not None:
+                def_set.add(def_var)
+            live_in[i].update(live_out_prev[i] - def_set)
+            for successor in self.graph.successors(i):
+                live_out[i].update(live_in_prev[successor])
+        if live_in == live_in_prev and live_out == live_out_prev:
+            return live_in, live_out
+
+
+def legacy_dead_code_elimination(self):
+    """Delete one dead node, then recompute liveness"""
+    _continue = True
+    while _continue:
+        _continue = False
+        live_in, live_out = self.compute_liveness()
+        for node in self.graph:
+            def_var = self.graph.node[node]['def_var']
+            if def_var and def_var not in live_out[node]:
+                self._ControlFlowGraph__delete_node(node)
+                _continue = True
+                break
+
+
+@contextlib.contextmanager
+def baseline():
+    """Compile with deep copies and the legacy control flow analyses"""
+    clone = raco.algebra.clone_operator
+    compute_liveness = ControlFlowGraph.compute_liveness
+    dead_code_elimination = ControlFlowGraph.dead_code_elimination
+    raco.algebra.clone_operator = copy.deepcopy
+    ControlFlowGraph.compute_liveness = legacy_compute_liveness
+    ControlFlowGraph.dead_code_elimination = legacy_dead_code_elimination
+    try:
+        yield
+    finally:
+        raco.algebra.clone_operator = clone
+        ControlFlowGraph.compute_liveness = compute_liveness
+        ControlFlowGraph.dead_code_elimination = dead_code_elimination
+
+
+def compile_program(text, db, physical):
+    """Return the time of each stage of compiling a program"""
+    times = collections.OrderedDict()
+    start = timeit.default_timer()
+    statements = Parser().parse(text)
+    times['parse'] = timeit.default_timer() - start
+
+    processor = StatementProcessor(db)
+    start = timeit.default_timer()
+    processor.evaluate(statements)
+    times['evaluate'] = timeit.default_timer() - start
+
+    start = timeit.default_timer()
+    processor.get_logical_plan()
+    times['logical'] = timeit.default_timer() - start
+
+    if physical:
+        start = timeit.default_timer()
+        processor.get_physical_plan()
+        times['physical'] = timeit.default_timer() - start
+    return times
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--statements', default='100,250,500',
+                        help='comma-separated numbers of statements')
+    parser.add_argument('--no-physical', dest='physical',
+                        action='store_false',
+                        help='skip the optimization into a physical plan')
+    parser.add_argument('--baseline-timeout', type=float, default=30,
+                        help='skip the baseline on longer programs once it '
+                             'takes longer than this many seconds')
+    opts = parser.parse_args(args)
+
+    # generate the parse tables before timing the parser
+    Parser.get_lr_parser()
+    db = FakeDatabase()
+    sch = scheme.Scheme([(c, types.LONG_TYPE) for c in COLUMNS])
+    for name in 'XY':
+        db.ingest('public:adhoc:' + name,
+                  collections.Counter([tuple(range(len(COLUMNS)))]), sch)
+
+    print '{:>10} {:>9} {:>12} {:>12} {:>8}'.format(
+        'statements', 'stage', 'current (s)', 'baseline (s)', 'speedup')
+    legacy_total = 0
+    for num_statements in [int(n) for n in opts.statements.split(',')]:
+        text = program(num_statements)
+        current = compile_program(text, db, opts.physical)
+        current['total'] = sum(current.values())
+        legacy = None
+        if legacy_total <= opts.baseline_timeout:
+            with baseline():
+                legacy = compile_program(text, db, opts.physical)
+            legacy['total'] = legacy_total = sum(legacy.values())
+        for stage, elapsed in current.items():
+            if legacy is None:
+                base, speedup = 'skipped', ''
+            else:
+                base = '{:.4f}'.format(legacy[stage])
+                speedup = '{:.1f}x'.format(legacy[stage] / elapsed)
+            print '{:>10} {:>9} {:>12.4f} {:>12} {:>8}'.format(
+                num_statements, stage, elapsed, base, speedup)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
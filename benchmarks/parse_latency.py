@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+"""Benchmark the latency of parsing the MyriaL examples.
+
+Parses each examples/*.myl program with a new Parser, as the interpreter and
+the Myria connection do, and reports the mean latency with the shared parse
+tables and with the tables generated by yacc on every parse, as the parser
+did before. The baseline does not read the parse tables from disk, i.e., it
+measures a process that has not written raco.myrial.parsetab.
+
+    python benchmarks/parse_latency.py [--repeat 5] [--baseline-repeat 1]
+"""
+
+import argparse
+import glob
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ply import yacc  # noqa
+from raco.myrial.exceptions import MyrialCompileException  # noqa
+from raco.myrial.parser import Parser  # noqa
+import raco.myrial.scanner as scanner  # noqa
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), '..', 'examples')
+
+
+def baseline_parse(program):
+    """Parse a program after generating the parse tables"""
+    parser = Parser()
+    Parser.udf_functions = {}
+    Parser.decomposable_aggs = {}
+    scanner.lexer.lineno = 1
+    lr_parser = yacc.yacc(module=parser, debug=False, optimize=False,
+                          write_tables=False, tabmodule='unwritten_parsetab')
+    return lr_parser.parse(program, lexer=scanner.lexer, tracking=True)
+
+
+def current_parse(program):
+    return Parser().parse(program)
+
+
+def mean_latency(parse, program, repeat):
+    return timeit.timeit(lambda: parse(program), number=repeat) / repeat
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='parses of each program with the shared tables')
+    parser.add_argument('--baseline-repeat', type=int, default=1,
+                        help='parses of each program with the baseline')
+    opts = parser.parse_args(args)
+
+    start = timeit.default_timer()
+    Parser.get_lr_parser()
+    print 'generated the parse tables in {:.4f} s'.format(
+        timeit.default_timer() - start)
+
+    print '{:<28} {:>12} {:>13} {:>8}'.format(
+        'program', 'current (ms)', 'baseline (ms)', 'speedup')
+    total, baseline_total = 0.0, 0.0
+    for path in sorted(glob.glob(os.path.join(EXAMPLES, '*.myl'))):
+        name = os.path.basename(path)
+        with open(path) as f:
+            program = f.read()
+        try:
+            current_parse(program)
+        except MyrialCompileException:
+            # e.g., programs that use functions defined elsewhere
+            print '{:<28} {:>12}'.format(name, 'skipped')
+            continue
+        elapsed = mean_latency(current_parse, program, opts.repeat)
+        baseline = mean_latency(baseline_parse, program, opts.baseline_repeat)
+        total += elapsed
+        baseline_total += baseline
+        print '{:<28} {:>12.3f} {:>13.3f} {:>7.1f}x'.format(
+            name, elapsed * 1000, baseline * 1000, baseline / elapsed)
+    print '{:<28} {:>12.3f} {:>13.3f} {:>7.1f}x'.format(
+        'total', total * 1000, baseline_total * 1000, baseline_total / total)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
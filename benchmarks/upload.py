@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+"""Benchmark uploading a large CSV file to a stand-in Myria REST server.
+
+Starts an HTTP server on localhost that accepts dataset uploads and queries
+as Myria does, reading each request body at a limited bandwidth per
+connection, like a server that parses and stores what it receives. Uploads a
+generated CSV file with the schema of a FromFileCatalog using upload_fp,
+which reads the whole file and base64-encodes it in one request, and using
+upload_path, which streams chunks of the file concurrently. Each upload runs
+in a new process, whose peak memory use is reported.
+
+    python benchmarks/upload.py [--size 64] [--chunk-size 4] [--threads 1,8]
+        [--bandwidth 32] [--latency 0.02]
+"""
+
+import argparse
+import BaseHTTPServer
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import SocketServer
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from raco.backends.myria.connection import MyriaConnection  # noqa
+from raco.catalog import FromFileCatalog  # noqa
+
+MB = 1024 * 1024
+KEY = {'userName': 'public', 'programName': 'adhoc',
+       'relationName': 'points'}
+CATALOG = FromFileCatalog(
+    {'public:adhoc:points': [('id', 'LONG_TYPE'), ('cell', 'LONG_TYPE'),
+                             ('value', 'DOUBLE_TYPE'),
+                             ('label', 'STRING_TYPE')]}, None)
+
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, bandwidth, latency):
+        BaseHTTPServer.HTTPServer.__init__(self, ('localhost', 0), Handler)
+        self.bandwidth = float(bandwidth)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.received = 0
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # write each response at once, rather than a segment per header
+    wbufsize = -1
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, code, body, location=None):
+        data = json.dumps(body)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if location is not None:
+            self.send_header('Location', location)
+        self.end_headers()
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def consume(self):
+        """Read the body at the bandwidth of the server"""
+        server = self.server
+        left = int(self.headers.get('Content-Length', 0))
+        received = 0
+        start = timeit.default_timer()
+        while left > 0:
+            block = self.rfile.read(min(left, 256 * 1024))
+            if not block:
+                break
+            left -= len(block)
+            received += len(block)
+            if server.bandwidth:
+                wait = (start + received / (server.bandwidth * MB) -
+                        timeit.default_timer())
+                if wait > 0:
+                    time.sleep(wait)
+        time.sleep(server.latency)
+        with server.lock:
+            server.received += received
+
+    def do_POST(self):
+        self.consume()
+        if self.path == '/query':
+            url = 'http://localhost:{}/query/query-1'.format(
+                self.server.server_port)
+            self.reply(202, {'queryId': 1, 'status': 'ACCEPTED'}, url)
+        else:
+            self.reply(201, {'relationKey': KEY})
+
+    def do_GET(self):
+        self.reply(200, {'queryId': 1, 'status': 'SUCCESS'})
+
+    def do_DELETE(self):
+        self.reply(200, {})
+
+
+def generate(path, size):
+    """Write a CSV file of about size bytes with the schema of CATALOG"""
+    with open(path, 'w') as f:
+        written, i = 0, 0
+        while written < size:
+            lines = ''.join('{},{},{:.3f},label{}\n'.format(
+                            j, j % 1000, j * 0.25, j % 97)
+                            for j in range(i, i + 10000))
+            f.write(lines)
+            written += len(lines)
+            i += 10000
+
+
+def run_upload(method, path, port, threads, chunk_size, results):
+    """Upload the file in this process, and send back the elapsed time and
+    the peak memory use"""
+    connection = MyriaConnection(hostname='localhost', port=port,
+                                 pool_size=threads)
+    start = timeit.default_timer()
+    if method == 'upload_fp':
+        schema = CATALOG.get_scheme('public:adhoc:points')
+        with open(path, 'rb') as fp:
+            connection.upload_fp(KEY, {'columnNames': schema.get_names(),
+                                       'columnTypes': schema.get_types()},
+                                 fp)
+    else:
+        connection.upload_path(KEY, path, CATALOG, chunk_size=chunk_size,
+                               overwrite=True)
+    elapsed = timeit.default_timer() - start
+    # kilobytes on Linux
+    results.send((elapsed, resource.getrusage(
+        resource.RUSAGE_SELF).ru_maxrss / 1024.0))
+
+
+def measure(method, path, port, threads, chunk_size):
+    receive, send = multiprocessing.Pipe(False)
+    process = multiprocessing.Process(
+        target=run_upload,
+        args=(method, path, port, threads, chunk_size, send))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError('{} failed'.format(method))
+    return receive.recv()
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--size', type=float, default=64,
+                        help='size of the CSV file in MB')
+    parser.add_argument('--chunk-size', type=float, default=4,
+                        help='size of a chunk of upload_path in MB')
+    parser.add_argument('--threads', default='1,8',
+                        help='comma-separated numbers of upload threads')
+    parser.add_argument('--bandwidth', type=float, default=32.0,
+                        help='MB/s the server reads from each connection '
+                             '(0: unlimited)')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='seconds the server takes for each request')
+    opts = parser.parse_args(args)
+
+    directory = tempfile.mkdtemp()
+    server = StandInServer(opts.bandwidth, opts.latency)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        path = os.path.join(directory, 'points.csv')
+        generate(path, opts.size * MB)
+        size = os.path.getsize(path) / float(MB)
+        print 'uploading {:.1f} MB to localhost:{}'.format(
+            size, server.server_port)
+
+        runs = [('upload_fp', 1)] + [
+            ('upload_path', int(n)) for n in opts.threads.split(',')]
+        print '{:<12} {:>7} {:>9} {:>8} {:>10} {:>14}'.format(
+            'method', 'threads', 'time (s)', 'MB/s', 'sent (MB)',
+            'peak RSS (MB)')
+        for method, threads in runs:
+            server.received = 0
+            elapsed, peak = measure(method, path, server.server_port,
+                                    threads, int(opts.chunk_size * MB))
+            print '{:<12} {:>7} {:>9.2f} {:>8.1f} {:>10.1f} {:>14.1f}'.format(
+                method, threads, elapsed, size / elapsed,
+                server.received / float(MB), peak)
+    finally:
+        server.shutdown()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
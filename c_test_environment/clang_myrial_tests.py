@@ -44,6 +44,10 @@ class MyriaLClangTest(MyriaLPlatformTestHarness, MyriaLPlatformTests):
             if need_generate():
                 generate_default()
 
+    def test_topk(self):
+        q = self.myrial_from_sql(["R2"], "topk")
+        self.check(q, "topk")
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1 @@
+select r.a, s.a, t.a from R2 r, T2 t, S2 s where r.b=s.a and s.b=t.a;
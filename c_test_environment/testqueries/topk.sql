@@ -0,0 +1 @@
+select a, b from R2 order by b desc, a asc limit 7;
@@ -0,0 +1,18 @@
+#pragma once
+#include <vector>
+#include <algorithm>
+
+// Keep the k tuples that come first according to before.
+// heap is a max-heap with respect to before, so its front
+// is the last of the tuples kept so far.
+template <typename T, typename Compare>
+void topk_insert(std::vector<T>& heap, size_t k, const T& val, Compare before) {
+  if (heap.size() < k) {
+    heap.push_back(val);
+    std::push_heap(heap.begin(), heap.end(), before);
+  } else if (k > 0 && before(val, heap.front())) {
+    std::pop_heap(heap.begin(), heap.end(), before);
+    heap.back() = val;
+    std::push_heap(heap.begin(), heap.end(), before);
+  }
+}
@@ -1,10 +1,16 @@
-from raco.datalog.grammar import parse
 from raco.compile import optimize
 
 import logging
 LOG = logging.getLogger(__name__)
 
 
+def parse(program):
+    """Parse a datalog program. The datalog grammar and its dependencies
+    are only loaded on first use."""
+    from raco.datalog.grammar import parse as parse_datalog
+    return parse_datalog(program)
+
+
 class RACompiler(object):
 
     """Thin wrapper interface for lower level functions parse, optimize,
@@ -9,6 +9,9 @@ import math
 from raco.expression import StateVar
 from functools import reduce
 from raco.representation import RepresentationProperties
+from raco.relation_key import RelationKey
+from raco.statistics import (agm_bound, column_position, selectivity,
+                             ColumnStatistics)
 
 
 # BEGIN Code to generate variables names
@@ -79,6 +82,11 @@ class Operator(Printable):
     def num_tuples(self):
         """Return the expected number of tuples output by this operator."""
 
+    def column_statistics(self, position):
+        """Return the ColumnStatistics of an output column of this operator,
+        or None if they are unknown."""
+        return None
+
     @abstractmethod
     def partitioning(self):
         """Return the partitioning of the tuples output by this operator.
@@ -356,8 +364,56 @@ class NaryJoin(NaryOperator):
                 and self.conditions == other.conditions)
 
     def num_tuples(self):
-        # TODO: use AGM bound (P10 in http://arxiv.org/pdf/1310.3314v2.pdf)
-        return DEFAULT_CARDINALITY
+        """The AGM bound of the join (P10 in
+        http://arxiv.org/pdf/1310.3314v2.pdf), or a smaller estimate from the
+        distinct counts of the join columns when they are known."""
+        try:
+            sizes = [child.num_tuples() for child in self.children()]
+        except NotImplementedError:
+            return DEFAULT_CARDINALITY
+        # the join variable of each column: its join condition, if any
+        variables = {}
+        for i, condition in enumerate(self.conditions):
+            for attr in condition:
+                variables[attr.position] = ('condition', i)
+        relations = []
+        offset = 0
+        for child in self.children():
+            width = len(child.scheme())
+            relations.append(set(variables.get(pos, ('column', pos))
+                                 for pos in range(offset, offset + width)))
+            offset += width
+        bound = agm_bound(sizes, relations)
+
+        # assuming containment of the values of the join columns, each
+        # condition over k columns keeps 1 / (the product of the k - 1
+        # largest distinct counts) of the cross product
+        estimate = float(reduce(operator.mul, sizes, 1))
+        for condition in self.conditions:
+            stats = [self.input_column_statistics(attr.position)
+                     for attr in condition]
+            if any(s is None for s in stats):
+                return int(bound)
+            distinct = sorted(max(s.num_distinct, 1) for s in stats)
+            estimate /= reduce(operator.mul, distinct[1:], 1)
+        return int(min(bound, estimate))
+
+    def input_column_statistics(self, position):
+        """Return the ColumnStatistics of a column of the concatenated
+        inputs"""
+        for child in self.children():
+            width = len(child.scheme())
+            if position < width:
+                return child.column_statistics(position)
+            position -= width
+        return None
+
+    def column_statistics(self, position):
+        if self.output_columns:
+            combined = reduce(operator.add,
+                              [c.scheme() for c in self.children()])
+            position = self.output_columns[position].get_position(combined)
+        return self.input_column_statistics(position)
 
     def partitioning(self):
         """ The schemas are mutually exclusive
@@ -454,7 +510,7 @@ class IDBController(NaryOperator):
             return {
                 "type": "CountFilter",
                 "keyColIndices": group_list,
-                "threshold": expr.threshold
+                "threshold": getattr(expr, "threshold", None)
             }
 
     def get_group_agg(self):
@@ -691,6 +747,17 @@ class CompositeBinaryOperator(BinaryOperator):
         """Return the scheme of the result."""
         return self.left.scheme() + self.right.scheme()
 
+    def input_column_statistics(self, position):
+        """Return the ColumnStatistics of a column of the concatenated
+        inputs"""
+        left_len = len(self.left.scheme())
+        if position < left_len:
+            return self.left.column_statistics(position)
+        return self.right.column_statistics(position - left_len)
+
+    def column_statistics(self, position):
+        return self.input_column_statistics(position)
+
 
 class CrossProduct(CompositeBinaryOperator):
 
@@ -728,8 +795,13 @@ class Join(CompositeBinaryOperator):
                 and self.condition == other.condition)
 
     def num_tuples(self):
-        # this is black magic
-        return int(self.left.num_tuples() * self.right.num_tuples() / 10)
+        sel = selectivity(self.condition,
+                          self.left.scheme() + self.right.scheme(),
+                          self.input_column_statistics)
+        if sel is None:
+            # this is black magic
+            return int(self.left.num_tuples() * self.right.num_tuples() / 10)
+        return int(self.left.num_tuples() * self.right.num_tuples() * sel)
 
     def copy(self, other):
         """deep copy"""
@@ -842,6 +914,13 @@ class Apply(UnaryOperator):
     def num_tuples(self):
         return self.input.num_tuples()
 
+    def column_statistics(self, position):
+        pos = column_position(self.emitters[position][1],
+                              self.input.scheme())
+        if pos is None:
+            return None
+        return self.input.column_statistics(pos)
+
     def copy(self, other):
         """deep copy"""
         self.emitters = other.emitters
@@ -1033,7 +1112,17 @@ class Select(UnaryOperator):
                 and self.condition == other.condition)
 
     def num_tuples(self):
-        return int(self.input.num_tuples() * 0.5)
+        condition = self.condition
+        if isinstance(condition, dict):
+            condition = condition["condition"]
+        sel = selectivity(condition, self.input.scheme(),
+                          self.input.column_statistics)
+        if sel is None:
+            sel = 0.5
+        return int(self.input.num_tuples() * sel)
+
+    def column_statistics(self, position):
+        return self.input.column_statistics(position)
 
     def shortStr(self):
         if isinstance(self.condition, dict):
@@ -1264,6 +1353,58 @@ class OrderBy(UnaryOperator):
         return self.input.scheme()
 
 
+class TopK(UnaryOperator):
+
+    """Logical TopK operator: the first count tuples of the input in the
+    order given by sort_columns, i.e., Limit(count, OrderBy(input)) without
+    sorting the whole input."""
+
+    def __init__(self, input=None, count=None, sort_columns=None,
+                 ascending=None):
+        UnaryOperator.__init__(self, input)
+        self.count = count
+        self.sort_columns = sort_columns
+        self.ascending = ascending
+
+    def __eq__(self, other):
+        return UnaryOperator.__eq__(self, other) and \
+            self.count == other.count and \
+            self.sort_columns == other.sort_columns and \
+            self.ascending == other.ascending
+
+    def __repr__(self):
+        return "{op}({inp!r}, {cnt!r}, {scol!r}, {asc!r})".format(
+            op=self.opname(),
+            inp=self.input,
+            cnt=self.count,
+            scol=self.sort_columns,
+            asc=self.ascending)
+
+    def num_tuples(self):
+        return min(self.count, self.input.num_tuples())
+
+    def partitioning(self):
+        # TODO set sorted
+        return RepresentationProperties()
+
+    def shortStr(self):
+        ascend_string = ['+' if a else '-' for a in self.ascending]
+        sort_string = ','.join('{col}{asc}'.format(col=c, asc=a)
+                               for c, a in zip(self.sort_columns,
+                                               ascend_string))
+        return "%s(%s; %s)" % (self.opname(), self.count, sort_string)
+
+    def copy(self, other):
+        """deep copy"""
+        self.count = other.count
+        self.sort_columns = other.sort_columns
+        self.ascending = other.ascending
+        UnaryOperator.copy(self, other)
+
+    def scheme(self):
+        return self.input.scheme()
+
+
 class ProjectingJoin(Join):
 
     """Logical Projecting Join operator"""
@@ -1295,6 +1436,13 @@ class ProjectingJoin(Join):
         self.output_columns = other.output_columns
         Join.copy(self, other)
 
+    def column_statistics(self, position):
+        if self.output_columns is None:
+            return self.input_column_statistics(position)
+        combined = self.left.scheme() + self.right.scheme()
+        return self.input_column_statistics(
+            self.output_columns[position].get_position(combined))
+
     def partitioning(self):
         """Partitioning of a Join followed by a Project"""
         joinp = super(ProjectingJoin, self).partitioning()
@@ -1342,6 +1490,9 @@ class Shuffle(UnaryOperator):
     def num_tuples(self):
         return self.input.num_tuples()
 
+    def column_statistics(self, position):
+        return self.input.column_statistics(position)
+
     def shortStr(self):
         if self.shuffle_type == self.ShuffleType.Hash:
             return "%s(%s(%s))" % (self.opname(), self.shuffle_type,
@@ -1398,6 +1549,9 @@ class HyperCubeShuffle(UnaryOperator):
     def num_tuples(self):
         return self.input.num_tuples()
 
+    def column_statistics(self, position):
+        return self.input.column_statistics(position)
+
     def shortStr(self):
         return "%s(%s)" % (self.opname(), real_str(self.hashed_columns,
                                                    skip_out=True))
@@ -1421,6 +1575,9 @@ class Collect(UnaryOperator):
     def num_tuples(self):
         return self.input.num_tuples()
 
+    def column_statistics(self, position):
+        return self.input.column_statistics(position)
+
     def partitioning(self):
         # TODO: implement one-partition partitioning?
         return RepresentationProperties()
@@ -1440,6 +1597,9 @@ class Broadcast(UnaryOperator):
     def num_tuples(self):
         return self.input.num_tuples()
 
+    def column_statistics(self, position):
+        return self.input.column_statistics(position)
+
     def shortStr(self):
         return self.opname()
 
@@ -1702,17 +1862,20 @@ class Scan(ZeroaryOperator):
     def __init__(self, relation_key=None, _scheme=None,
                  cardinality=DEFAULT_CARDINALITY,
                  partitioning=RepresentationProperties(),
-                 debroadcast=False):
+                 debroadcast=False, statistics=None):
         """Initialize a scan operator.
 
         relation_key is a string of the form "user:program:relation"
         scheme is the schema of the relation.
+        statistics is an optional list of the ColumnStatistics (or None)
+        of each column of the relation.
         """
         self.relation_key = relation_key
         self._scheme = _scheme
         self._cardinality = cardinality
         self._partitioning = partitioning
         self._debroadcast = debroadcast
+        self._statistics = statistics
 
         ZeroaryOperator.__init__(self)
 
@@ -1736,6 +1899,11 @@ class Scan(ZeroaryOperator):
     def num_tuples(self):
         return self._cardinality
 
+    def column_statistics(self, position):
+        if not self._statistics:
+            return None
+        return self._statistics[position]
+
     def partitioning(self):
         if self._debroadcast:
             assert self._partitioning.broadcasted
@@ -1758,6 +1926,7 @@ class Scan(ZeroaryOperator):
         self._cardinality = other._cardinality
         self._partitioning = other._partitioning
         self._debroadcast = other._debroadcast
+        self._statistics = other._statistics
 
         # TODO: need a cleaner and more general way of tracing information
         # through the compilation process for debugging purposes
@@ -2038,6 +2207,29 @@ class UntilConvergence(NaryOperator):
         return None
 
 
+# Values that operators hold but never modify in place, which clones share
+shared_values = (scheme.Scheme, RelationKey, ColumnStatistics)
+
+
+def clone_operator(op):
+    """Copy an operator tree, sharing the schemes, relation keys and column
+    statistics of its operators.
+
+    The operators and their expressions are copied, as in copy.deepcopy,
+    because optimization rules rewrite them in place.
+    """
+    memo = {}
+    for node in op.walk():
+        for value in node.__dict__.itervalues():
+            if isinstance(value, (list, tuple)):
+                for v in value:
+                    if isinstance(v, shared_values):
+                        memo[id(v)] = v
+            elif isinstance(value, shared_values):
+                memo[id(value)] = value
+    return copy.deepcopy(op, memo)
+
+
 def inline_operator(dest_op, var, target_op):
     """Convert two operator trees into one by inlining.
 
@@ -2052,7 +2244,7 @@ def inline_operator(dest_op, var, target_op):
     def rewrite_node(node):
         if isinstance(node, ScanTemp) and node.name == var:
             if has_inlined[0]:
-                return copy.deepcopy(target_op)
+                return clone_operator(target_op)
             has_inlined[0] = True
             return target_op
         else:
@@ -39,6 +39,7 @@ typedef uint64_t uint64;
 
 #include "io_util.h"
 #include "hash.h"
+#include "topk.h"
 #include "radish_utils.h"
 #include "strings.h"
 #include "timing.h"
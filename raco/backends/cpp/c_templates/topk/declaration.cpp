@@ -0,0 +1,7 @@
+std::vector<{{tuple_type}}> {{heapname}};
+bool {{cmpname}}(const {{tuple_type}}& a, const {{tuple_type}}& b) {
+    {% for col, asc in sort_keys %}
+    if (a.f{{col}} != b.f{{col}}) return a.f{{col}} {{ '<' if asc else '>' }} b.f{{col}};
+    {% endfor %}
+    return false;
+}
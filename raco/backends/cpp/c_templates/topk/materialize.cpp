@@ -0,0 +1 @@
+topk_insert({{heapname}}, {{count}}, {{tuple_name}}, {{cmpname}});
@@ -0,0 +1,4 @@
+std::sort_heap({{heapname}}.begin(), {{heapname}}.end(), {{cmpname}});
+for (auto {{tuple_name}} : {{heapname}}) {
+    {{inner_code}}
+} // end scan over {{heapname}}
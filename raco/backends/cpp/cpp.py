@@ -287,6 +287,59 @@ class CGroupBy(cppcommon.BaseCGroupby, CCOperator):
         return code
 
 
+class CTopK(algebra.TopK, CCOperator):
+    _i = 0
+
+    def __init__(self, *args):
+        super(CTopK, self).__init__(*args)
+        self._cgenv = cppcommon.prepend_template_relpath(
+            self.language().cgenv(), '{0}/topk'.format(CC._template_path))
+
+    @staticmethod
+    def __genHeapName__():
+        name = "topk_heap_%03d" % CTopK._i
+        CTopK._i += 1
+        return name
+
+    def produce(self, state):
+        self.heapname = CTopK.__genHeapName__()
+        self.cmpname = "%s_before" % self.heapname
+
+        self.input.produce(state)
+
+        # now that the first count tuples are kept, produce them in order
+        produce_template = self._cgenv.get_template('scan.cpp')
+
+        heapname = self.heapname
+        cmpname = self.cmpname
+        tuple_name = self.inputTuple.name
+
+        inner_code = self.parent().consume(self.inputTuple, self, state)
+        code = produce_template.render(locals())
+        state.setPipelineProperty("type", "in_memory")
+        state.addPipeline(code)
+
+    def consume(self, inputTuple, fromOp, state):
+        declr_template = self._cgenv.get_template('declaration.cpp')
+        materialize_template = self._cgenv.get_template('materialize.cpp')
+
+        # the kept tuples are produced with the type of the input tuples
+        self.inputTuple = inputTuple
+
+        heapname = self.heapname
+        cmpname = self.cmpname
+        count = self.count
+        tuple_name = inputTuple.name
+        tuple_type = inputTuple.getTupleTypename()
+        sort_keys = zip(self.sort_columns, self.ascending)
+
+        heap_declr = declr_template.render(locals())
+        state.addDeclarations([heap_declr])
+
+        code = materialize_template.render(locals())
+        return code
+
+
 class CHashJoin(algebra.Join, CCOperator):
     _i = 0
 
@@ -545,6 +598,7 @@ def clangify(emit_print):
         rules.OneToOne(algebra.Apply, CApply),
         rules.OneToOne(algebra.Join, CHashJoin),
         rules.OneToOne(algebra.GroupBy, CGroupBy),
+        rules.OneToOne(algebra.TopK, CTopK),
         rules.OneToOne(algebra.Project, CProject),
         rules.OneToOne(algebra.UnionAll, CUnionAll),
         cppcommon.StoreToBaseCStore(emit_print, CStore),
@@ -577,11 +631,17 @@ class CCAlgebra(Algebra):
         # rules.FreeMemory()
         # ]
 
+        join_order = []
+        if kwargs.get('reorder_joins', False):
+            join_order.append(rules.CostBasedJoinOrder())
+
         # sequence that works for myrial
         rule_grps_sequence = [
             rules.remove_trivial_sequences,
             rules.simple_group_by,
+            [rules.LimitOrderByToTopK()],
             cppcommon.clang_push_select,
+            join_order,
             [rules.ProjectToDistinctColumnSelect(),
              rules.JoinToProjectingJoin()],
             rules.push_apply,
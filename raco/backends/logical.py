@@ -8,14 +8,12 @@ class OptLogicalAlgebra(Algebra):
     def opt_rules(**kwargs):
         return [rules.RemoveTrivialSequences(),
                 rules.SimpleGroupBy(),
+                rules.LimitOrderByToTopK(),
                 rules.SplitSelects(),
                 rules.PushSelects(),
                 rules.MergeSelects(),
                 rules.ProjectToDistinctColumnSelect(),
                 rules.JoinToProjectingJoin(),
-                rules.PushApply(),
-                rules.RemoveUnusedColumns(),
-                rules.PushApply(),
-                rules.RemoveUnusedColumns(),
-                rules.PushApply(),
+                rules.FixpointGroup([rules.PushApply(),
+                                     rules.RemoveUnusedColumns()]),
                 rules.DeDupBroadcastInputs()]
@@ -1,3 +1,7 @@
+import hashlib
+import json
+import time
+
 from raco.catalog import Catalog
 import raco.scheme as scheme
 from raco.representation import RepresentationProperties
@@ -6,27 +10,190 @@ from raco.catalog import DEFAULT_CARDINALITY
 from .errors import MyriaError
 
 
+class DatasetCache(object):
+
+    """The descriptors of Myria datasets, as returned by
+    MyriaConnection.dataset(), kept for ttl seconds. A ttl of None keeps
+    them until they are invalidated."""
+
+    def __init__(self, ttl=60, clock=time.time):
+        self.ttl = ttl
+        self.clock = clock
+        # (user, program, relation) -> (expiration time, descriptor)
+        self._entries = {}
+
+    @staticmethod
+    def key(relation_key):
+        """The key of a relation key dictionary, as in Myria's JSON"""
+        return (relation_key['userName'], relation_key['programName'],
+                relation_key['relationName'])
+
+    def get(self, key):
+        """The descriptor of a dataset, or None if it is not cached or it
+        expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, descriptor = entry
+        if expires is not None and self.clock() >= expires:
+            del self._entries[key]
+            return None
+        return descriptor
+
+    def put(self, key, descriptor):
+        expires = None if self.ttl is None else self.clock() + self.ttl
+        self._entries[key] = (expires, descriptor)
+
+    def invalidate(self, key=None):
+        """Forget the descriptor of a dataset, or of all datasets"""
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FunctionRegistry(object):
+
+    """The user-defined functions registered in Myria.
+
+    The functions are fetched when first needed. After ttl seconds, or after
+    invalidate(), the list of functions is requested again, with the ETag
+    of the previous list if the server sent one. If the list did not
+    change, only the functions invalidated since are fetched; otherwise all
+    of them are, since a function may have been redefined under the same
+    name. A ttl of None keeps the list until it is invalidated."""
+
+    def __init__(self, connection, ttl=60, clock=time.time):
+        self.connection = connection
+        self.ttl = ttl
+        self.clock = clock
+        self._names = []
+        # name -> descriptor
+        self._functions = {}
+        self._etag = None
+        # when the list must be requested again; None: on next use
+        self._expires = None
+
+    def refresh(self):
+        """Request the list of functions, and fetch them again if it
+        changed, or else the unknown ones"""
+        names, etag = self.connection.list_functions(self._etag)
+        if names is not None:
+            self._names = names
+            self._etag = etag
+            self._functions = {}
+        self._functions = {
+            name: (self._functions.get(name) or
+                   self.connection.get_function(name))
+            for name in self._names}
+        self._expires = (float('inf') if self.ttl is None
+                         else self.clock() + self.ttl)
+
+    def functions(self):
+        """The descriptors of the functions, in the order Myria lists them
+        """
+        if self._expires is None or self.clock() >= self._expires:
+            self.refresh()
+        return [self._functions[name] for name in self._names]
+
+    def get(self, name):
+        """The descriptor of a function. Raises MyriaError if there is no
+        such function."""
+        self.functions()
+        if name in self._functions:
+            return self._functions[name]
+        return self.connection.get_function(name)
+
+    def invalidate(self, name=None):
+        """Request the list again on next use, and fetch the descriptor of a
+        function, or of all functions, again. Invalidating one function
+        keeps the ETag of the list, so that only that function is fetched
+        if the list did not change otherwise."""
+        if name is None:
+            self._names = []
+            self._functions = {}
+            self._etag = None
+        else:
+            self._functions.pop(name, None)
+        self._expires = None
+
+
 class MyriaCatalog(Catalog):
 
     def __init__(self, connection):
         self.connection = connection
 
+    def dataset(self, rel_key):
+        """Return the descriptor of a relation, from the dataset cache of
+        the connection if it has a fresh one"""
+        key = (rel_key.user, rel_key.program, rel_key.relation)
+        cache = self.connection.dataset_cache
+        dataset_info = cache.get(key)
+        if dataset_info is None:
+            dataset_info = self.connection.dataset({
+                'userName': rel_key.user,
+                'programName': rel_key.program,
+                'relationName': rel_key.relation
+            })
+            cache.put(key, dataset_info)
+        return dataset_info
+
+    def prefetch(self):
+        """Fetch the descriptors of all the relations in Myria with one
+        request, e.g., before compiling a program that reads many of them.
+        Returns the descriptors."""
+        if not self.connection:
+            raise RuntimeError("no connection.")
+        cache = self.connection.dataset_cache
+        datasets = self.connection.datasets()
+        for dataset_info in datasets:
+            # the descriptors of the list may lack fields in old versions
+            if all(field in dataset_info for field in
+                   ('schema', 'numTuples', 'howDistributed')):
+                cache.put(DatasetCache.key(dataset_info['relationKey']),
+                          dataset_info)
+        return datasets
+
     def get_scheme(self, rel_key):
-        relation_args = {
-            'userName': rel_key.user,
-            'programName': rel_key.program,
-            'relationName': rel_key.relation
-        }
         if not self.connection:
             raise RuntimeError(
                 "no schema for relation %s because no connection" % rel_key)
         try:
-            dataset_info = self.connection.dataset(relation_args)
+            dataset_info = self.dataset(rel_key)
         except MyriaError:
             raise ValueError('No relation {} in the catalog'.format(rel_key))
         schema = dataset_info['schema']
         return scheme.Scheme(zip(schema['columnNames'], schema['columnTypes']))
 
+    def fingerprint(self):
+        """ A digest of the relations and functions in Myria, listed again
+        when the connection changes the catalog, or when
+        MyriaConnection.invalidate_catalog() records a change made
+        elsewhere. It depends only on the contents of the catalog, so plans
+        cached on disk are reused after a restart only if it is the same """
+        if not self.connection:
+            return None
+        connection = self.connection
+        version = connection.catalog_version
+        if connection.catalog_fingerprint is not None and \
+                connection.catalog_fingerprint[0] == version:
+            return connection.catalog_fingerprint[1]
+        datasets = sorted(
+            json.dumps([d['relationKey'], d.get('schema'),
+                        d.get('numTuples'), d.get('howDistributed')],
+                       sort_keys=True)
+            for d in self.prefetch())
+        functions = json.dumps(connection.functions.functions(),
+                               sort_keys=True)
+        digest = hashlib.sha1(
+            json.dumps([datasets, functions])).hexdigest()
+        fingerprint = (connection._url_start, digest)
+        connection.catalog_fingerprint = (version, fingerprint)
+        return fingerprint
+
     def get_num_servers(self):
         if not self.connection:
             raise RuntimeError("no connection.")
@@ -38,23 +205,18 @@ class MyriaCatalog(Catalog):
             raise RuntimeError("no connection.")
 
         try:
-            function_info = self.connection.get_function(name)
+            function_info = self.connection.functions.get(name)
         except MyriaError:
             raise ValueError("Function does not exist.")
 
         return function_info
 
     def num_tuples(self, rel_key):
-        relation_args = {
-            'userName': rel_key.user,
-            'programName': rel_key.program,
-            'relationName': rel_key.relation
-        }
         if not self.connection:
             raise RuntimeError(
                 "no cardinality of %s because no connection" % rel_key)
         try:
-            dataset_info = self.connection.dataset(relation_args)
+            dataset_info = self.dataset(rel_key)
         except MyriaError:
             raise ValueError(rel_key)
         num_tuples = dataset_info['numTuples']
@@ -66,16 +228,11 @@ class MyriaCatalog(Catalog):
         return DEFAULT_CARDINALITY
 
     def partitioning(self, rel_key):
-        relation_args = {
-            'userName': rel_key.user,
-            'programName': rel_key.program,
-            'relationName': rel_key.relation
-        }
         if not self.connection:
             raise RuntimeError(
                 "no schema for relation %s because no connection" % rel_key)
         try:
-            dataset_info = self.connection.dataset(relation_args)
+            dataset_info = self.dataset(rel_key)
         except MyriaError:
             raise ValueError('No relation {} in the catalog'.format(rel_key))
         distribute_function = dataset_info['howDistributed']['df']
@@ -1,32 +1,43 @@
 import base64
+import collections
 import ConfigParser
 import json
 import csv
+from multiprocessing.pool import ThreadPool
 from time import sleep
 import logging
+import timeit
 from urlparse import urlparse, ParseResult
 
-from raco.backends.logical import OptLogicalAlgebra
+from raco.algebra import Scan, Store, UnionAll, clone_operator
 from raco.backends.myria import MyriaHyperCubeAlgebra, MyriaLeftDeepTreeAlgebra, \
     compile_to_json
-from raco.backends.myria.catalog import MyriaCatalog
+from raco.backends.myria.catalog import (DatasetCache, FunctionRegistry,
+                                         MyriaCatalog)
 from raco.myrial import interpreter
 from raco.myrial.parser import Parser
+from raco.myrial.plan_cache import CompiledPlan, PlanCache, normalize_program
+from raco.relation_key import RelationKey
+from raco.scheme import Scheme
 
 from .errors import MyriaError
+from .upload import (FileSlice, UploadManifest, binary_record_size,
+                     record_chunks)
 
 import requests
 
-from raco import compile, RACompiler
+from raco import compile, optimize, parse
 
 __all__ = ['MyriaConnection']
 
 # String constants used in forming requests
 JSON = 'application/json'
 CSV = 'text/plain'
+FORM = 'application/x-www-form-urlencoded'
 GET = 'GET'
 PUT = 'PUT'
 POST = 'POST'
+DELETE = 'DELETE'
 
 # Enable or configure logging
 logging.basicConfig(level=logging.WARN)
@@ -45,6 +56,11 @@ class MyriaConnection(object):
         'Content-Type': JSON
     }
 
+    # seconds before the first poll of the status of a running query
+    _POLL_INITIAL = 0.05
+    # the statuses of a query that finished
+    _FINISHED_STATUSES = ('SUCCESS', 'ERROR', 'KILLED')
+
     @staticmethod
     def _parse_deployment(deployment):
         "Extract the REST server hostname and port from a deployment.cfg file"
@@ -64,7 +80,12 @@ class MyriaConnection(object):
                  ssl=False,
                  rest_url=None,
                  execution_url=None,
-                 timeout=None):
+                 timeout=None,
+                 plan_cache=None,
+                 dataset_ttl=60,
+                 function_ttl=60,
+                 pool_size=10,
+                 max_poll_interval=2.0):
         """Initializes a connection to the Myria REST server.
            (And optionally a Myria program execution URI.)
 
@@ -81,6 +102,20 @@ class MyriaConnection(object):
             rest_url: a URL pointing to a Myria REST endpoint
             execution_url: a URL pointing to a Myria webserver for program
                 execution
+            plan_cache: an optional raco.myrial.plan_cache.PlanCache of the
+                programs compiled by compile_program
+            dataset_ttl: the number of seconds for which the catalog reuses
+                the descriptor of a relation (None: until this connection
+                changes the catalog; 0: never)
+            function_ttl: the number of seconds after which the list of user
+                defined functions is requested again (None: until this
+                connection registers a function)
+            pool_size: the number of HTTP connections kept open to each
+                server, and of the threads that send the requests of
+                execute_queries
+            max_poll_interval: the maximum number of seconds between two
+                polls of the status of a running query; the interval starts
+                short and doubles after each poll
         """
         # Parse the deployment file and, if present, override the hostname and
         # port with any provided values from deployment.
@@ -108,13 +143,50 @@ class MyriaConnection(object):
         self._url_start = '{}://{}:{}'.format(uri_scheme, hostname, port)
         self._session = requests.Session()
         self._session.headers.update(self._DEFAULT_HEADERS)
+        # keep a connection open for each thread of execute_queries
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self.pool_size = pool_size
+        self.max_poll_interval = max_poll_interval
         self.execution_url = execution_url
-        self._udfs = None
+        # the user defined functions, shared by the compiler and the catalog
+        self.functions = FunctionRegistry(self, function_ttl)
+        self.plan_cache = plan_cache
+        # incremented whenever this connection changes the catalog
+        self.catalog_version = 0
+        # the catalog_version and MyriaCatalog.fingerprint() computed at it
+        self.catalog_fingerprint = None
+        # the ids of the queries submitted by submit_query that may still
+        # be running
+        self._running_queries = set()
+        # the descriptors of the relations read by MyriaCatalog
+        self.dataset_cache = DatasetCache(dataset_ttl)
+
+    def _poll_intervals(self):
+        """The seconds to wait before each poll of a running query"""
+        interval = self._POLL_INITIAL
+        while True:
+            yield interval
+            interval = min(interval * 2, self.max_poll_interval)
+
+    def _poll(self, url):
+        """Request the status of a query submitted by this connection.
+        Returns whether it finished, and its status if it did."""
+        r = self._session.get(url)
+        if r.status_code in [200, 201]:
+            # the descriptors read while it ran may predate its output
+            self._catalog_changed()
+            return True, r.json()
+        elif r.status_code == 202:
+            return False, None
+        raise MyriaError(r)
 
     def _finish_async_request(self, method, url, body=None, accept=JSON):
         headers = {
             'Accept': accept
         }
+        intervals = self._poll_intervals()
         try:
             while True:
                 if '://' not in url:
@@ -135,8 +207,7 @@ class MyriaConnection(object):
                     body = None
                     # Read and ignore the body
                     # response.read()
-                    # Sleep 100 ms before re-issuing the request
-                    sleep(0.1)
+                    sleep(next(intervals))
                 else:
                     raise MyriaError('Error %d: %s'
                                      % (r.status_code, r.text))
@@ -236,6 +307,19 @@ class MyriaConnection(object):
             relation_key['programName'],
             relation_key['relationName']))
 
+    def _dataset_exists(self, relation_key):
+        """Return whether the specified relation exists"""
+        r = self._session.get(
+            self._url_start + '/dataset/user-{}/program-{}/relation-{}'.format(
+                relation_key['userName'],
+                relation_key['programName'],
+                relation_key['relationName']))
+        if r.status_code == 404:
+            return False
+        if r.status_code != 200:
+            raise MyriaError(r)
+        return True
+
     def download_dataset(self, relation_key):
         """Download the data in the dataset as json"""
         return self._wrap_get('/dataset/user-{}/program-{}/relation-{}/data'
@@ -244,6 +328,25 @@ class MyriaConnection(object):
                                       relation_key['relationName']),
                               params={'format': 'json'})
 
+    def delete_dataset(self, relation_key, ignore_missing=False):
+        """Delete the specified relation
+
+        Args:
+            relation_key: A dictionary containing the relation key.
+            ignore_missing: if True, a relation that does not exist is not
+                an error.
+        """
+        r = self._session.delete(
+            self._url_start + '/dataset/user-{}/program-{}/relation-{}'.format(
+                relation_key['userName'],
+                relation_key['programName'],
+                relation_key['relationName']))
+        if r.status_code == 404 and ignore_missing:
+            return
+        if r.status_code not in (200, 204):
+            raise MyriaError(r)
+        self._catalog_changed(relation_key)
+
     @staticmethod
     def _ensure_schema(schema):
         return {'columnTypes': schema['columnTypes'],
@@ -278,6 +381,7 @@ class MyriaConnection(object):
                 'schema': self._ensure_schema(schema),
                 'source': source}
 
+        self._catalog_changed(relation_key)
         return self._make_request(POST, '/dataset', json.dumps(body))
 
     def execute_program(self, program, language="MyriaL", server=None):
@@ -292,37 +396,94 @@ class MyriaConnection(object):
         """
 
         body = {"query": program, "language": language}
-        r = requests.post((server or self.execution_url) + '/execute',
-                          data=body)
+        self._catalog_changed()
+        r = self._session.post((server or self.execution_url) + '/execute',
+                               data=body, headers={'Content-Type': FORM})
         if r.status_code != 201:
             raise MyriaError(r)
 
         query_uri = r.json()['url']
-        while True:
-            r = requests.get(query_uri)
-            if r.status_code == 200:
-                return r.json()
-            elif r.status_code == 202:
-                # Sleep 100 ms before re-checking the status
-                sleep(0.1)
-                continue
-            raise MyriaError(r)
+        for interval in self._poll_intervals():
+            finished, status = self._poll(query_uri)
+            if finished:
+                return status
+            sleep(interval)
 
     def compile_program(self, program, language="MyriaL", **kwargs):
         """Get a compiled plan for a given program.
 
+        If the connection has a plan_cache, the plan is taken from it when
+        the same program, up to whitespace and comments, was compiled with
+        the same arguments since the catalog last changed.
+
         Args:
             program: a Myria program as a string.
             language: the language in which the program is written
                       (default: MyriaL).
         """
-        logical = self._get_plan(program, language, 'logical', **kwargs)
-        physical = self._get_plan(program, language, 'physical', **kwargs)
-        compiled = compile_to_json(program, logical, physical, language)
+        key = self._plan_cache_key(program, language, **kwargs)
+        compiled = self.plan_cache.get(key) if key is not None else None
+        if compiled is None:
+            stages = self.compile_stages(program, language, **kwargs)
+            compiled = CompiledPlan(stages.physical_plan, stages.json)
+            if key is not None:
+                self.plan_cache.put(key, compiled)
+        compiled = compiled.json
+        compiled['rawQuery'] = program
         compiled['profilingMode'] = ["QUERY", "RESOURCE"] \
             if kwargs.get('profile', False) else []
         return compiled
 
+    def _plan_cache_key(self, program, language, **kwargs):
+        """Return the key of a program in the plan cache, or None"""
+        if self.plan_cache is None:
+            return None
+        fingerprint = MyriaCatalog(self).fingerprint()
+        if language.lower() == "datalog":
+            normalized = program.strip()
+        else:
+            udas = [(udf['name'], udf['outputType'])
+                    for udf in self._get_udfs()]
+            source = (program, language.lower(), repr(udas))
+            normalized = self.plan_cache.get_normalized(source)
+            if normalized is None:
+                normalized = normalize_program(
+                    Parser().parse(program, udas=udas))
+                if normalized is not None:
+                    self.plan_cache.put_normalized(source, normalized)
+        return PlanCache.make_key(normalized, 'myria:' + language.lower(),
+                                  kwargs, fingerprint)
+
+    def invalidate_catalog(self):
+        """Record that the relations or functions in Myria changed, e.g., by
+        another client, so that plans compiled before are not reused."""
+        self._catalog_changed()
+        self.functions.invalidate()
+
+    def _query_status_seen(self, status, submitted=False):
+        """Record the status of a query. A query submitted by submit_query
+        changes the catalog again when it finishes, since the descriptors
+        read while it ran may predate its output."""
+        if not isinstance(status, dict):
+            return
+        query_id = status.get('queryId')
+        if status.get('status') in self._FINISHED_STATUSES:
+            if submitted or query_id in self._running_queries:
+                self._running_queries.discard(query_id)
+                self._catalog_changed()
+        elif submitted:
+            self._running_queries.add(query_id)
+
+    def _catalog_changed(self, relation_key=None):
+        """Record that this connection changed a relation, or any relation
+        if relation_key is None, so that its descriptor is fetched again and
+        plans compiled before are not reused."""
+        self.catalog_version += 1
+        if isinstance(relation_key, dict):
+            self.dataset_cache.invalidate(DatasetCache.key(relation_key))
+        else:
+            self.dataset_cache.invalidate()
+
     def submit_query(self, query):
         """Submit the query to Myria, and return the status including the URL
         to be polled.
@@ -332,7 +493,10 @@ class MyriaConnection(object):
         """
 
         body = json.dumps(query)
-        return self._wrap_post('/query', data=body)
+        self._catalog_changed()
+        status = self._wrap_post('/query', data=body)
+        self._query_status_seen(status, submitted=True)
+        return status
 
     def execute_query(self, query):
         """Submit the query to Myria, and poll its status until it finishes.
@@ -342,7 +506,65 @@ class MyriaConnection(object):
         """
 
         body = json.dumps(query)
-        return self._finish_async_request(POST, '/query', body)
+        self._catalog_changed()
+        try:
+            return self._finish_async_request(POST, '/query', body)
+        finally:
+            # the descriptors read while it ran may predate its output
+            self._catalog_changed()
+
+    def execute_queries(self, queries):
+        """Submit queries to Myria concurrently, and poll their status until
+        they all finish. Returns their statuses, in the order of the queries.
+
+        A pool of pool_size threads sends the requests. The queries are
+        polled as by execute_query, but no thread waits for a query between
+        two polls.
+
+        Args:
+            queries: Myria physical plans as Python objects.
+        """
+
+        def submit(query):
+            r = self._session.post(self._url_start + '/query',
+                                   data=json.dumps(query))
+            if r.status_code not in [200, 201, 202]:
+                raise MyriaError(r)
+            return r.headers.get('Location') or \
+                '{}/query/query-{}'.format(self._url_start,
+                                           r.json()['queryId'])
+
+        self._catalog_changed()
+        clock = timeit.default_timer
+        statuses = [None] * len(queries)
+        pool = ThreadPool(self.pool_size)
+        try:
+            urls = pool.map(submit, queries)
+            # [time of the next poll, index, URL, poll intervals]
+            pending = []
+            for i, url in enumerate(urls):
+                intervals = self._poll_intervals()
+                pending.append((clock() + next(intervals), i, url, intervals))
+            while pending:
+                pending.sort()
+                wait = pending[0][0] - clock()
+                if wait > 0:
+                    sleep(wait)
+                now = clock()
+                due = [p for p in pending if p[0] <= now]
+                pending = [p for p in pending if p[0] > now]
+                polls = pool.map(self._poll, [url for _, _, url, _ in due])
+                for (_, i, url, intervals), (finished, status) in zip(due,
+                                                                      polls):
+                    if finished:
+                        statuses[i] = status
+                    else:
+                        pending.append(
+                            (clock() + next(intervals), i, url, intervals))
+        finally:
+            pool.close()
+            pool.join()
+        return statuses
 
     def validate_query(self, query):
         """Submit the query to Myria for validation only.
@@ -362,7 +584,9 @@ class MyriaConnection(object):
         """
 
         resource_path = '/query/query-%d' % int(query_id)
-        return self._make_request(GET, resource_path)
+        status = self._make_request(GET, resource_path)
+        self._query_status_seen(status)
+        return status
 
     def get_query_plan(self, query_id, subquery_id):
         """Get the saved execution plan for a submitted query.
@@ -454,7 +678,10 @@ class MyriaConnection(object):
         resource_path = '/query'
         r = self._make_request(GET, resource_path, params=params,
                                get_request=True)
-        return r.json()
+        result = r.json()
+        for status in result.get('results', []):
+            self._query_status_seen(status)
+        return result
 
     def upload_file(self, relation_key, schema, data, overwrite=None,
                     delimiter=None, binary=None, is_little_endian=None):
@@ -489,6 +716,7 @@ class MyriaConnection(object):
         fields.append(('data', ('data', data, data_type)))
 
         m = MultipartEncoder(fields=fields)
+        self._catalog_changed(relation_key)
         r = self._session.post(self._url_start + '/dataset', data=m,
                                headers={'Content-Type': m.content_type})
         if r.status_code not in (200, 201):
@@ -496,6 +724,111 @@ class MyriaConnection(object):
                              % (r.status_code, r.text))
         return r.json()
 
+    def upload_path(self, relation_key, path, catalog=None, schema=None,
+                    binary=False, delimiter=None, is_little_endian=None,
+                    chunk_size=64 * 1024 * 1024, manifest=None,
+                    overwrite=None):
+        """Upload a delimited text file or a packed binary file to Myria,
+        streaming it from disk in chunks that end on record boundaries.
+
+        A file of a single chunk is uploaded to the relation. Otherwise
+        pool_size threads upload the chunks concurrently, each to a part
+        relation <relation>__part<i> that Myria spreads over its workers; a
+        query then stores the union of the parts in the relation, replacing
+        it if it exists, and the parts are deleted. The manifest is removed
+        before the parts, so that a rerun after a failed deletion uploads
+        the file again rather than union parts that no longer exist.
+
+        Args:
+            relation_key: A dictionary containing the destination relation key.
+            path: the file to be uploaded. A text file has a record per line.
+            catalog: a raco catalog, e.g., a raco.catalog.FromFileCatalog,
+                that has the schema of the relation. Used if schema is None.
+            schema: A dictionary containing the schema.
+            binary: optional boolean indicating that the file is a packed
+                binary; every column must have a fixed size.
+            delimiter: as for upload_file.
+            is_little_endian: as for upload_file.
+            chunk_size: the target size of a chunk in bytes.
+            manifest: an optional file in which to record the chunks that
+                were uploaded. After a failure, calling upload_path again
+                with the same manifest uploads only the missing chunks.
+            overwrite: optional boolean indicating that an existing relation
+                should be overwritten. Otherwise a file of several chunks is
+                not uploaded if the relation exists, and MyriaError is
+                raised, as Myria does for a single chunk.
+        """
+        relation_key = self._ensure_relation_key(relation_key)
+        if schema is None:
+            if catalog is None:
+                raise ValueError("upload_path needs a schema or a catalog")
+            scheme = catalog.get_scheme(self._raco_key(relation_key))
+            schema = {'columnNames': scheme.get_names(),
+                      'columnTypes': scheme.get_types()}
+        schema = self._ensure_schema(schema)
+        record_size = binary_record_size(schema) if binary else None
+        chunks = record_chunks(path, chunk_size, record_size)
+
+        def upload(key, chunk, overwrite):
+            with FileSlice(path, *chunk) as data:
+                return self.upload_file(key, schema, data,
+                                        overwrite=overwrite,
+                                        delimiter=delimiter, binary=binary,
+                                        is_little_endian=is_little_endian)
+
+        if len(chunks) == 1:
+            return upload(relation_key, chunks[0], overwrite)
+        # the union of the parts replaces the relation
+        if not overwrite and self._dataset_exists(relation_key):
+            raise MyriaError(
+                'relation {} exists; upload it with overwrite=True to '
+                'replace it'.format(self._raco_key(relation_key)))
+
+        progress = UploadManifest(manifest, UploadManifest.describe(
+            path, relation_key, chunk_size, binary))
+        parts = [dict(relation_key, relationName='{}__part{}'.format(
+                      relation_key['relationName'], i))
+                 for i in range(len(chunks))]
+
+        def upload_part(i):
+            if i not in progress.done:
+                # a part may remain from an interrupted upload
+                upload(parts[i], chunks[i], True)
+                progress.mark_done(i)
+
+        pool = ThreadPool(self.pool_size)
+        try:
+            pool.map(upload_part, range(len(chunks)))
+        finally:
+            pool.close()
+            pool.join()
+
+        status = self.execute_query(
+            self._union_query(relation_key, parts, schema))
+        # The relation is complete: a rerun must not union the parts again,
+        # whether or not they are all deleted
+        progress.remove()
+        for part in parts:
+            self.delete_dataset(part, ignore_missing=True)
+        return status
+
+    @staticmethod
+    def _raco_key(relation_key):
+        return RelationKey(relation_key['userName'],
+                           relation_key['programName'],
+                           relation_key['relationName'])
+
+    def _union_query(self, relation_key, parts, schema):
+        """The Myria query that stores the union of the parts in the
+        relation"""
+        scheme = Scheme(zip(schema['columnNames'], schema['columnTypes']))
+        logical = Store(self._raco_key(relation_key),
+                        UnionAll([Scan(self._raco_key(part), scheme)
+                                  for part in parts]))
+        physical = optimize(clone_operator(logical),
+                            target=MyriaLeftDeepTreeAlgebra())
+        return compile_to_json(str(logical), logical, physical, 'upload')
+
     def get_function(self, name):
         """ Get user defined function metadata """
         return self._wrap_get('/function/{}'.format(name))
@@ -503,6 +836,9 @@ class MyriaConnection(object):
     def create_function(self, d, overwrite_if_exists=False):
         """Register a User Defined Function with Myria """
         result = self._make_request(POST, '/function', json.dumps(d))
+        # plans compiled before do not know the function
+        self.catalog_version += 1
+        self.functions.invalidate(d['name'])
         Parser.add_python_udf(d.pop('name'), d.pop('outputType'),
                               overwrite_if_exists=overwrite_if_exists, **d)
         return result
@@ -511,56 +847,78 @@ class MyriaConnection(object):
         """ List all the user defined functions in Myria """
         return self._wrap_get('/function')
 
-    def _get_plan(self, query, language, plan_type, **kwargs):
+    def list_functions(self, etag=None):
+        """List the user defined functions in Myria, unless the list still
+        has the given ETag. Returns the names, or None if the list did not
+        change, and the ETag of the list, or None if the server sent none.
+        """
+        headers = {'If-None-Match': etag} if etag else None
+        r = self._session.get(self._url_start + '/function', headers=headers)
+        if r.status_code == 304:
+            return None, etag
+        elif r.status_code == 200:
+            return r.json(), r.headers.get('ETag')
+        else:
+            raise MyriaError(r)
+
+    def compile_stages(self, program, language="MyriaL", **kwargs):
+        """Compile a program once, and return every stage of the compilation
+        with its time, as a raco.myrial.interpreter.CompilationStages.
+
+        Datalog programs have no optimized logical plan, and their
+        statements are the parsed Datalog program.
+
+        Args:
+            program: a Myria program as a string.
+            language: the language in which the program is written
+                      (default: MyriaL).
+        """
         catalog = MyriaCatalog(self)
         algebra = MyriaHyperCubeAlgebra(catalog) \
-            if kwargs.get('multiway_jon', False) \
+            if kwargs.get('multiway_join', False) \
             else MyriaLeftDeepTreeAlgebra()
+        push_sql = kwargs.get('push_sql', True)
 
         if language.lower() == "datalog":
-            return self._get_datalog_plan(query, plan_type, algebra, **kwargs)
+            return self._compile_datalog(program, language, algebra,
+                                         push_sql)
         elif language.lower() in ["myrial", "sql"]:
-            return self._get_myrial_or_sql_plan(query, plan_type,
-                                                catalog, algebra, **kwargs)
-        else:
-            raise NotImplementedError('Language %s not supported' % language)
-
-    def _get_myrial_or_sql_plan(self, query, plan_type, catalog, algebra,
-                                **kwargs):
-        parsed = Parser().parse(query, udas=[(udf['name'], udf['outputType'])
-                                             for udf in self._get_udfs()])
-        processor = interpreter.StatementProcessor(catalog)
-        processor.evaluate(parsed)
-
-        if plan_type == 'logical':
-            return processor.get_physical_plan(
-                target_alg=OptLogicalAlgebra())
-        elif plan_type == 'physical':
-            return processor.get_physical_plan(
+            udas = [(udf['name'], udf['outputType'])
+                    for udf in self._get_udfs()]
+            return interpreter.compile_stages(
+                program, catalog, udas=udas, language=language,
                 target_alg=algebra,
                 multiway_join=kwargs.get('multiway_join', False),
-                push_sql=kwargs.get('push_sql', True))
+                push_sql=push_sql)
         else:
-            raise NotImplementedError('Myria plan type %s' % plan_type)
+            raise NotImplementedError('Language %s not supported' % language)
 
     @staticmethod
-    def _get_datalog_plan(query, plan_type, algebra, **kwargs):
-        datalog = RACompiler()
-        datalog.fromDatalog(query)
-
-        if not datalog.logicalplan:
+    def _compile_datalog(program, language, algebra, push_sql):
+        clock = timeit.default_timer
+        timings = collections.OrderedDict()
+
+        start = clock()
+        parsed = parse(program)
+        timings['parse'] = clock() - start
+
+        start = clock()
+        logical = parsed.toRA()
+        timings['logical'] = clock() - start
+        if not logical:
             raise SyntaxError("Unable to parse Datalog")
-        elif plan_type == 'logical':
-            return datalog.logicalplan
-        elif plan_type == 'physical':
-            datalog.optimize(target=algebra,
-                             push_sql=kwargs.get('push_sql', True))
-            return datalog.physicalplan
-        else:
-            raise NotImplementedError('Datalog plan type %s' % plan_type)
+
+        start = clock()
+        # the optimizer modifies the plan it is given
+        physical = optimize(clone_operator(logical), target=algebra,
+                            push_sql=push_sql)
+        timings['physical'] = clock() - start
+
+        start = clock()
+        json = compile_to_json(program, logical, physical, language)
+        timings['json'] = clock() - start
+        return interpreter.CompilationStages(parsed, logical, None, physical,
+                                             json, timings)
 
     def _get_udfs(self):
-        if not self._udfs:
-            self._udfs = [self.get_function(name)
-                          for name in self.get_functions()]
-        return self._udfs
\ No newline at end of file
+        return self.functions.functions()
\ No newline at end of file
@@ -1,24 +1,23 @@
 import itertools
 import logging
 import base64
-from collections import defaultdict, deque
+import math
+from collections import defaultdict
 from functools import reduce
 from operator import mul
 
-from sqlalchemy.dialects import postgresql
-
 from raco import algebra, expression, rules, scheme
 from raco import types
 from raco.algebra import Shuffle
 from raco.algebra import convertcondition
 from raco.backends import Language, Algebra
-from raco.backends.sql.catalog import SQLCatalog, PostgresSQLFunctionProvider
 from raco.catalog import Catalog
 from raco.datastructure.UnionFind import UnionFind
 from raco.expression import AttributeRef, UnnamedAttributeRef
 from raco.expression import WORKERID, COUNTALL
 from raco.representation import RepresentationProperties
 from raco.rules import distributed_group_by, check_partition_equality
+from raco.statistics import agm_bound
 from urlparse import urlparse
 
 LOGGER = logging.getLogger(__name__)
@@ -1396,46 +1395,157 @@ class HCShuffleBeforeNaryJoin(rules.Rule):
             load += float(child_sizes[i]) / float(scale)
         return load
 
+    @staticmethod
+    def local_join_bound(dim_sizes, child_sizes, r_index):
+        """Compute the AGM bound of the join in one hyper cube cell, given
+        a hyper cube size assignment"""
+        sizes = []
+        relations = []
+        for i, size in enumerate(child_sizes):
+            scale = 1
+            for index in r_index[i]:
+                if index != -1:
+                    scale = scale * dim_sizes[index]
+            sizes.append(float(size) / float(scale))
+            # the hyper cube dimension of each joined column is its join
+            # variable, the other columns are variables of their own
+            relations.append(set(('dim', index) if index != -1
+                                 else ('column', i, col)
+                                 for col, index in enumerate(r_index[i])))
+        return agm_bound(sizes, relations)
+
     @staticmethod
     def get_hyper_cube_dim_size(num_server, child_sizes,
                                 conditions, r_index):
-        """Find the optimal hyper cube dimension sizes using BFS.
+        """Find the optimal hyper cube dimension sizes.
+
+        The optimum minimizes the workload, i.e., the tuples each server
+        receives, over the dimension sizes whose product is at most
+        num_server. Ties are broken by the AGM bound of the join in a cell,
+        then by the largest dimension size, then by the smallest sizes.
+
+        A depth-first branch and bound assigns the dimensions one at a time,
+        those of the largest children first. The workload strictly decreases
+        with the size of a dimension of a non-empty child, so among the sizes
+        that leave the same number of servers to the other dimensions, only
+        the largest one can be optimal; the size of a dimension of empty
+        children only is 1. The search also prunes the partial assignments
+        whose workload cannot reach the best one found, even if each
+        remaining dimension got all the servers left.
 
         Keyword arguments:
         num_server -- number of servers, this sets upper bound of HC cells.
         child_sizes -- cardinality of each child.
-        child_schemes -- schemes of children.
         conditions -- join conditions.
         r_index -- reversed index of join conditions.
         """
-        # Helper function: compute the product.
-        def product(array):
-            return reduce(mul, array, 1)
-        # Use BFS to find the best possible assignment.
         this = HCShuffleBeforeNaryJoin
-        visited = set()
-        toVisit = deque()
-        toVisit.append(tuple([1 for _ in conditions]))
-        min_work_load = None
-        opt_dim_sizes = [0] * len(conditions)
-        while len(toVisit) > 0:
-            dim_sizes = toVisit.pop()
-            workload = this.workload(dim_sizes, child_sizes, r_index)
-            if ((workload < min_work_load) or (
-                workload == min_work_load and max(dim_sizes) < max(
-                    opt_dim_sizes)) or (min_work_load is None)):
-                min_work_load = this.workload(
-                    dim_sizes, child_sizes, r_index)
-                opt_dim_sizes = dim_sizes
-            visited.add(dim_sizes)
-            for i, d in enumerate(dim_sizes):
-                new_dim_sizes = (dim_sizes[0:i] +
-                                 tuple([dim_sizes[i] + 1]) +
-                                 dim_sizes[i + 1:])
-                if (product(new_dim_sizes) <= num_server and
-                        new_dim_sizes not in visited):
-                    toVisit.append(new_dim_sizes)
-        return opt_dim_sizes, min_work_load
+        num_dims = len(conditions)
+        # assign the dimensions of the largest children first
+        dim_weights = [0.0] * num_dims
+        for i, size in enumerate(child_sizes):
+            for index in r_index[i]:
+                if index != -1:
+                    dim_weights[index] += size
+        order = sorted(range(num_dims), key=lambda d: -dim_weights[d])
+        # the step of the search at which each dimension is assigned
+        step = [0] * num_dims
+        for k, d in enumerate(order):
+            step[d] = k
+
+        dim_sizes = [1] * num_dims
+        # [workload, local bound (computed lazily), dimension sizes]
+        best = [None, None, None]
+
+        # the hyper cube dimensions of each child, with their number of
+        # columns
+        child_dims = [[(index, r_index[i].count(index))
+                       for index in set(r_index[i]) if index != -1]
+                      for i in range(len(child_sizes))]
+
+        def lower_bound(k, servers):
+            """The least workload of the assignments that extend the first
+            k dimensions, with at most servers cells for the others"""
+            load = 0.0
+            # the loads of the children that the other dimensions divide
+            loads = []
+            # the number of times the other dimensions divide the loads
+            degrees = defaultdict(int)
+            for i, size in enumerate(child_sizes):
+                scale = 1
+                remaining = 0
+                for index, count in child_dims[i]:
+                    if step[index] < k:
+                        scale *= dim_sizes[index] ** count
+                    else:
+                        remaining = max(remaining, count)
+                        degrees[index] += count
+                if remaining and size > 0:
+                    loads.append((float(size) / scale, remaining))
+                else:
+                    load += float(size) / scale
+            if not loads:
+                return load
+            # the product of the other dimensions is at most servers, so
+            # each load is divided by at most servers ** remaining, and
+            # their product by at most servers ** max(degrees)
+            independent = sum(l / servers ** r for l, r in loads)
+            # which, by the AM-GM inequality, bounds their sum
+            log_product = (sum(math.log(l) for l, _ in loads) -
+                           max(degrees.values()) * math.log(servers))
+            am_gm = len(loads) * math.exp(log_product / len(loads))
+            return load + max(independent, am_gm)
+
+        def consider():
+            candidate = tuple(dim_sizes)
+            workload = this.workload(candidate, child_sizes, r_index)
+            if best[0] is not None and workload > best[0]:
+                return
+            if best[0] is None or workload < best[0]:
+                best[:] = [workload, None, candidate]
+                return
+            # a tie
+            if best[1] is None:
+                best[1] = this.local_join_bound(best[2], child_sizes,
+                                                r_index)
+            local_bound = this.local_join_bound(candidate, child_sizes,
+                                                r_index)
+            if ((local_bound, max(candidate), candidate) <
+                    (best[1], max(best[2]), best[2])):
+                best[:] = [workload, local_bound, candidate]
+
+        def candidate_sizes(k, servers):
+            """The sizes of the k-th dimension that can be optimal, largest
+            first"""
+            if dim_weights[order[k]] == 0:
+                return [1]
+            if k == num_dims - 1:
+                return [servers]
+            # the largest size that leaves each number of servers
+            sizes = []
+            size = 1
+            while size <= servers:
+                size = servers // (servers // size)
+                sizes.append(size)
+                size += 1
+            return reversed(sizes)
+
+        def search(k, servers):
+            if k == num_dims:
+                consider()
+                return
+            # allow for rounding in the comparison of the workloads
+            if (best[0] is not None and
+                    lower_bound(k, servers) > best[0] * (1 + 1e-9)):
+                return
+            # large sizes first, to find a small workload early
+            for size in candidate_sizes(k, servers):
+                dim_sizes[order[k]] = size
+                search(k + 1, servers // size)
+            dim_sizes[order[k]] = 1
+
+        search(0, num_server)
+        return best[2], best[0]
 
     @staticmethod
     def coord_to_worker_id(coordinate, dim_sizes):
@@ -1456,6 +1566,10 @@ class HCShuffleBeforeNaryJoin(rules.Rule):
                            child_schemes, child_idx, hashed_columns):
         """Generate the cell_partition for a specific child.
 
+        The cells of a voxel, i.e., a projection of the hyper cube to the
+        dimensions of the child, are a base worker id, given by the voxel,
+        plus the same offsets, given by the other dimensions.
+
         Keyword arguments:
         dim_sizes -- size of each dimension of the hypercube.
         conditions -- each element is an array of (child_idx, column).
@@ -1471,15 +1585,24 @@ class HCShuffleBeforeNaryJoin(rules.Rule):
         # find which dims in hyper cube this relation is involved
         hashed_dims = [r_index[child_idx][col] for col in hashed_columns]
         assert -1 not in hashed_dims
-        # group by cell according to their projection on subcube voxel
-        cell_partition = defaultdict(list)
-        coor_ranges = [list(range(d)) for d in dim_sizes]
-        for coordinate in itertools.product(*coor_ranges):
-            # project a hypercube cell to a subcube voxel
-            voxel = [coordinate[dim] for dim in hashed_dims]
-            cell_partition[tuple(voxel)].append(
-                this.coord_to_worker_id(coordinate, dim_sizes))
-        return [wid for vox, wid in sorted(cell_partition.items())]
+        # the worker id of a cell is sum(coordinate[k] * strides[k])
+        strides = [reduce(mul, dim_sizes[k + 1:], 1)
+                   for k in range(len(dim_sizes))]
+        voxel_dims = sorted(set(hashed_dims))
+        free_dims = [k for k in range(len(dim_sizes))
+                     if k not in voxel_dims]
+        offsets = sorted(
+            sum(c * strides[k] for c, k in zip(coordinate, free_dims))
+            for coordinate in itertools.product(
+                *[range(dim_sizes[k]) for k in free_dims]))
+        cell_partition = []
+        for coordinate in itertools.product(
+                *[range(dim_sizes[k]) for k in voxel_dims]):
+            coordinate = dict(zip(voxel_dims, coordinate))
+            voxel = tuple(coordinate[dim] for dim in hashed_dims)
+            base = sum(c * strides[k] for k, c in coordinate.items())
+            cell_partition.append((voxel, [base + o for o in offsets]))
+        return [wid for vox, wid in sorted(cell_partition)]
 
     def fire(self, expr):
         def add_hyper_shuffle():
@@ -1690,6 +1813,8 @@ class AddAppendTemp(rules.Rule):
 class PushIntoSQL(rules.Rule):
 
     def __init__(self, dialect=None, push_grouping=False):
+        # SQLAlchemy is slow to import, and only needed to push into SQL
+        from sqlalchemy.dialects import postgresql
         self.dialect = dialect or postgresql.dialect()
         self.push_grouping = push_grouping
         super(PushIntoSQL, self).__init__()
@@ -1697,6 +1822,8 @@ class PushIntoSQL(rules.Rule):
     def fire(self, expr):
         if isinstance(expr, (algebra.Scan, algebra.ScanTemp)):
             return expr
+        from raco.backends.sql.catalog import (SQLCatalog,
+                                               PostgresSQLFunctionProvider)
         cat = SQLCatalog(provider=PostgresSQLFunctionProvider(),
                          push_grouping=self.push_grouping)
         try:
@@ -1817,7 +1944,8 @@ class MergeToNaryJoin(rules.Rule):
 
 class GetCardinalities(rules.Rule):
 
-    """ get cardinalities information of Zeroary operators.
+    """ get cardinalities information and column statistics of Zeroary
+    operators.
     """
 
     def __init__(self, catalog):
@@ -1833,6 +1961,10 @@ class GetCardinalities(rules.Rule):
         if issubclass(type(expr), algebra.Scan):
             rel = expr.relation_key
             expr._cardinality = self.catalog.num_tuples(rel)
+            if isinstance(expr.scheme(), scheme.Scheme):
+                expr._statistics = [
+                    self.catalog.column_statistics(rel, name)
+                    for name in expr.scheme().get_names()]
             return expr
         expr._cardinality = algebra.DEFAULT_CARDINALITY
         return expr
@@ -2156,8 +2288,19 @@ class MyriaLeftDeepTreeAlgebra(MyriaAlgebra):
     """Myria physical algebra using left deep tree pipeline and 1-D shuffle"""
 
     def opt_rules(self, **kwargs):
+        join_order = []
+        if kwargs.get('reorder_joins', False):
+            join_order.append(rules.CostBasedJoinOrder())
+
+        share_subplans = []
+        if kwargs.get('share_subplans', False):
+            # needs the Sequence of statements: trivial sequences are
+            # removed after it instead
+            share_subplans = [rules.ShareCommonSubplans(),
+                              rules.RemoveTrivialSequences()]
+
         opt_grps_sequence = [
-            rules.remove_trivial_sequences,
+            [] if share_subplans else rules.remove_trivial_sequences,
             [
                 rules.SimpleGroupBy(),
                 rules.CountToCountall(),  # TODO revisit when we have NULLs
@@ -2166,6 +2309,8 @@ class MyriaLeftDeepTreeAlgebra(MyriaAlgebra):
                 rules.DedupGroupBy(),
             ],
             rules.push_select,
+            join_order,
+            share_subplans,
             rules.push_project,
             rules.push_apply,
             left_deep_tree_shuffle_logic,
@@ -2225,8 +2370,13 @@ class MyriaHyperCubeAlgebra(MyriaAlgebra):
             OrderByBeforeNaryJoin(),
         ]
 
+        share_subplans = []
+        if kwargs.get('share_subplans', False):
+            share_subplans = [rules.ShareCommonSubplans(),
+                              rules.RemoveTrivialSequences()]
+
         opt_grps_sequence = [
-            rules.remove_trivial_sequences,
+            [] if share_subplans else rules.remove_trivial_sequences,
             [
                 rules.SimpleGroupBy(),
                 # TODO revisit when we have NULL support.
@@ -2235,6 +2385,7 @@ class MyriaHyperCubeAlgebra(MyriaAlgebra):
                 rules.DedupGroupBy(),
             ],
             rules.push_select,
+            share_subplans,
             rules.push_project,
             merge_to_nary_join,
             rules.push_apply,
@@ -1,9 +1,15 @@
 from httmock import urlmatch, HTTMock
+from requests_toolbelt.multipart.decoder import MultipartDecoder
 import unittest
 import json
+import shutil
+import tempfile
 
 from raco.backends.myria.connection import MyriaConnection
 from raco.backends.myria.catalog import MyriaCatalog
+from raco.backends.myria.errors import MyriaError
+from raco.catalog import FromFileCatalog
+from raco.myrial.plan_cache import PlanCache
 from raco.relation_key import RelationKey
 from raco.representation import RepresentationProperties
 
@@ -83,12 +89,53 @@ query_counter = 0
 # A real server would have the query info;
 # here we cheat with a global
 query_request = None
+# the number of GET requests of dataset descriptors
+dataset_requests = 0
+# the functions registered in the server, and the ETag of their list
+function_names = []
+functions_etag = None
+# the number of GET requests of the list of functions, and of functions
+function_requests = {'list': 0, 'function': 0}
+# the data uploaded to each relation, and the paths of deleted relations
+uploads = {}
+deleted = []
+
+dataset_info = {
+    'relationKey': {
+        'userName': 'Brandon',
+        'programName': 'Demo',
+        'relationName': 'MoreBooks'
+    },
+    'schema': {
+        'columnNames': [u'name', u'pages'],
+        'columnTypes': ['STRING_TYPE', 'LONG_TYPE']
+    },
+    'howDistributed': {
+        'df': None,
+        'workers': None
+    },
+    'numTuples': 50
+}
+
+
+def uploaded(request):
+    """The relation name and the data of a file upload"""
+    if not hasattr(request.body, 'to_string'):
+        return None, None
+    parts = MultipartDecoder(request.body.to_string(),
+                             request.headers['Content-Type']).parts
+    # the relation key is the first field, the data the last
+    key = json.loads(parts[0].text)
+    if not isinstance(key, dict):
+        return None, None
+    return key['relationName'], parts[-1].content
 
 
 @urlmatch(netloc=r'localhost:12345')
 def local_mock(url, request):
     global query_counter
     global query_request
+    global dataset_requests
 
     if url.path == '/query' and request.method == 'POST':
         # raise ValueError(type(request.body))
@@ -96,18 +143,20 @@ def local_mock(url, request):
         headers = {'Location': 'http://localhost:12345/query/query-17'}
         query_counter = 2
         return {'status_code': 202, 'content': body, 'headers': headers}
+    elif url.path == '/dataset' and request.method == 'GET':
+        dataset_requests += 1
+        return {'status_code': 200, 'content': [dataset_info]}
+    elif url.path == '/dataset' and request.method == 'POST':
+        name, data = uploaded(request)
+        if name is not None:
+            uploads[name] = data
+        return {'status_code': 200, 'content': dataset_info}
+    elif '/dataset' in url.path and request.method == 'DELETE':
+        deleted.append(url.path)
+        return {'status_code': 200, 'content': ''}
     elif '/dataset' in url.path:
-        dataset_info = {
-            'schema': {
-                'columnNames': [u'name', u'pages'],
-                'columnTypes': ['STRING_TYPE', 'LONG_TYPE']
-            },
-            'howDistributed': {
-                'df': None,
-                'workers': None
-            },
-            'numTuples': 50
-        }
+        if request.method == 'GET':
+            dataset_requests += 1
         return {'status_code': 200, 'content': dataset_info}
     elif url.path == '/query/query-17':
         if query_counter == 0:
@@ -150,6 +199,22 @@ def local_mock(url, request):
     elif url.path == '/function/test' and request.method == 'GET':
         return {'status_code': 200, 'content': json.dumps(['test'])}
 
+    elif url.path == '/function' and request.method == 'GET':
+        function_requests['list'] += 1
+        if not functions_etag:
+            return {'status_code': 200, 'content': json.dumps(function_names)}
+        if request.headers.get('If-None-Match') == functions_etag:
+            return {'status_code': 304, 'content': ''}
+        return {'status_code': 200, 'content': json.dumps(function_names),
+                'headers': {'ETag': functions_etag}}
+
+    elif url.path.startswith('/function/') and request.method == 'GET':
+        function_requests['function'] += 1
+        name = url.path[len('/function/'):]
+        return {'status_code': 200,
+                'content': {'name': name, 'outputType': 'LONG_TYPE',
+                            'lang': FunctionTypes.PYTHON}}
+
     elif url.path == '/execute' and request.method == 'POST':
         return {'status_code': 200, 'content': request.body or ""}
 
@@ -173,6 +238,172 @@ class TestQuery(unittest.TestCase):
             self.assertEqual(i[1].hash_partitioned,
                              RepresentationProperties().hash_partitioned)
 
+    def test_dataset_cache(self):
+        global dataset_requests
+        with HTTMock(local_mock):
+            connection = get_connection()
+            key = RelationKey('Brandon', 'Demo', 'MoreBooks')
+            dataset_requests = 0
+            catalog = MyriaCatalog(connection)
+            catalog.get_scheme(key)
+            catalog.num_tuples(key)
+            catalog.partitioning(key)
+            self.assertEqual(dataset_requests, 1)
+
+            # the catalogs of a connection share its descriptors
+            rel_info(connection)
+            self.assertEqual(dataset_requests, 1)
+
+            connection.create_empty(dataset_info['relationKey'],
+                                    dataset_info['schema'])
+            rel_info(connection)
+            self.assertEqual(dataset_requests, 2)
+
+            connection.invalidate_catalog()
+            rel_info(connection)
+            self.assertEqual(dataset_requests, 3)
+
+    def test_dataset_cache_ttl(self):
+        global dataset_requests
+        with HTTMock(local_mock):
+            connection = get_connection()
+            now = [0]
+            connection.dataset_cache.clock = lambda: now[0]
+            dataset_requests = 0
+            rel_info(connection)
+            now[0] = 59
+            rel_info(connection)
+            self.assertEqual(dataset_requests, 1)
+            now[0] = 60
+            rel_info(connection)
+            self.assertEqual(dataset_requests, 2)
+
+    def test_dataset_prefetch(self):
+        global dataset_requests
+        with HTTMock(local_mock):
+            connection = get_connection()
+            dataset_requests = 0
+            MyriaCatalog(connection).prefetch()
+            self.assertEqual(len(connection.dataset_cache), 1)
+            self.assertEqual(rel_info(connection)[0], 50)
+            self.assertEqual(dataset_requests, 1)
+
+    def test_function_registry(self):
+        global function_names, functions_etag
+        with HTTMock(local_mock):
+            connection = get_connection()
+            now = [0]
+            connection.functions.clock = lambda: now[0]
+            function_names = ['udf0', 'udf1']
+            functions_etag = '"1"'
+            function_requests.update(list=0, function=0)
+            self.assertEqual([f['name'] for f in connection._get_udfs()],
+                             ['udf0', 'udf1'])
+            self.assertEqual(function_requests, {'list': 1, 'function': 2})
+
+            # the compiler and the catalog share the functions
+            connection._get_udfs()
+            udf = MyriaCatalog(connection).get_function('udf1')
+            self.assertEqual(udf['outputType'], 'LONG_TYPE')
+            self.assertEqual(function_requests, {'list': 1, 'function': 2})
+
+            # an unchanged list is not fetched again
+            now[0] = 60
+            connection._get_udfs()
+            self.assertEqual(function_requests, {'list': 2, 'function': 2})
+
+            # a changed list fetches every function again, since one may
+            # have been redefined under the same name
+            function_names = ['udf0', 'udf1', 'udf2']
+            functions_etag = '"2"'
+            now[0] = 120
+            self.assertEqual(len(connection._get_udfs()), 3)
+            self.assertEqual(function_requests, {'list': 3, 'function': 5})
+            functions_etag = '"3"'
+            now[0] = 180
+            connection._get_udfs()
+            self.assertEqual(function_requests, {'list': 4, 'function': 8})
+
+            # a function registered through the connection is fetched again,
+            # alone if the list did not change
+            connection.create_function({'name': 'udf1',
+                                        'outputType': 'LONG_TYPE'},
+                                       overwrite_if_exists=True)
+            connection._get_udfs()
+            self.assertEqual(function_requests, {'list': 5, 'function': 9})
+
+            # all functions are fetched again after invalidate_catalog
+            connection.invalidate_catalog()
+            connection._get_udfs()
+            self.assertEqual(function_requests, {'list': 6, 'function': 12})
+
+    def test_compile_stages(self):
+        global dataset_requests, function_names, functions_etag
+        with HTTMock(local_mock):
+            connection = get_connection()
+            function_names = []
+            functions_etag = None
+            dataset_requests = 0
+            function_requests.update(list=0, function=0)
+            program = query(connection)['rawQuery']
+            stages = connection.compile_stages(program)
+            self.assertEqual(list(stages.timings),
+                             ['parse', 'evaluate', 'logical',
+                              'optimized_logical', 'physical', 'json'])
+            self.assertEqual(stages.json['rawQuery'], program)
+            self.assertEqual(stages.json['logicalRa'],
+                             str(stages.optimized_logical_plan))
+            self.assertEqual(dataset_requests, 1)
+            self.assertEqual(function_requests['list'], 1)
+
+            compiled = connection.compile_program(program)
+            self.assertEqual(compiled['plan'], stages.json['plan'])
+
+    def test_plan_cache_restart(self):
+        global function_names, functions_etag
+        with HTTMock(local_mock):
+            program = query(self.connection)['rawQuery']
+        directory = tempfile.mkdtemp()
+        try:
+            function_names = []
+            functions_etag = None
+
+            def compile_in_new_process():
+                cache = PlanCache(directory=directory)
+                connection = MyriaConnection(hostname='localhost',
+                                             port=12345, plan_cache=cache)
+                connection.compile_program(program)
+                return cache
+
+            with HTTMock(local_mock):
+                cache = compile_in_new_process()
+                self.assertEqual((cache.hits, cache.misses), (0, 1))
+                # the catalog did not change
+                cache = compile_in_new_process()
+                self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+                # the cardinality of the relation changed
+                dataset_info['numTuples'] = 60
+                try:
+                    cache = compile_in_new_process()
+                finally:
+                    dataset_info['numTuples'] = 50
+                self.assertEqual((cache.hits, cache.misses), (0, 1))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_compile_datalog(self):
+        with HTTMock(local_mock):
+            connection = get_connection()
+            stages = connection.compile_stages(
+                'A(name) :- Brandon:Demo:MoreBooks(name, pages), pages > 300',
+                language='Datalog')
+            self.assertIsNone(stages.optimized_logical_plan)
+            self.assertEqual(list(stages.timings),
+                             ['parse', 'logical', 'physical', 'json'])
+            self.assertEqual(stages.json['logicalRa'],
+                             str(stages.logical_plan))
+
     def test_submit(self):
         global query_request
         with HTTMock(local_mock):
@@ -180,6 +411,37 @@ class TestQuery(unittest.TestCase):
             status = self.connection.submit_query(query_request["fragments"])
             self.assertNotEqual(status, None)
 
+    def test_catalog_changed_when_query_finishes(self):
+        global query_request, dataset_requests
+        with HTTMock(local_mock):
+            connection = get_connection()
+            query_request = query(connection)
+            status = connection.submit_query(query_request["fragments"])
+            self.assertEqual(status['status'], 'ACCEPTED')
+            # a descriptor read while the query runs
+            dataset_requests = 0
+            rel_info(connection)
+            self.assertEqual(
+                connection.get_query_status(17)['status'], 'ACCEPTED')
+            rel_info(connection)
+            self.assertEqual(dataset_requests, 1)
+
+            version = connection.catalog_version
+            self.assertEqual(
+                connection.get_query_status(17)['status'], 'SUCCESS')
+            self.assertEqual(connection.catalog_version, version + 1)
+            rel_info(connection)
+            self.assertEqual(dataset_requests, 2)
+
+            # the statuses of finished queries do not change the catalog
+            connection.get_query_status(17)
+            connection.queries()
+            self.assertEqual(connection.catalog_version, version + 1)
+
+            # before the query is submitted, and after it finishes
+            connection.execute_query(query_request["fragments"])
+            self.assertEqual(connection.catalog_version, version + 3)
+
     def test_execute(self):
         global query_request
         with HTTMock(local_mock):
@@ -187,6 +449,22 @@ class TestQuery(unittest.TestCase):
             status = self.connection.execute_query(query_request["fragments"])
             self.assertNotEqual(status, None)
 
+    def test_execute_queries(self):
+        global query_request
+        with HTTMock(local_mock):
+            query_request = query(self.connection)
+            statuses = self.connection.execute_queries(
+                [query_request["fragments"]] * 3)
+            self.assertEqual([status['status'] for status in statuses],
+                             ['SUCCESS'] * 3)
+
+    def test_poll_intervals(self):
+        connection = MyriaConnection(hostname='localhost', port=12345,
+                                     max_poll_interval=0.3)
+        intervals = connection._poll_intervals()
+        self.assertEqual([next(intervals) for _ in range(5)],
+                         [0.05, 0.1, 0.2, 0.3, 0.3])
+
     # TODO: fix these POST tests
     # def test_execute_program(self):
     #     global query_request
@@ -245,6 +523,166 @@ class TestQuery(unittest.TestCase):
             status = self.connection.upload_file("", [], "Hello")
             self.assertNotEquals(status, None)
 
+    def test_upload_path(self):
+        global query_request
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'edges.csv')
+            lines = ['{},{}\n'.format(i, i + 1) for i in range(40)]
+            with open(path, 'w') as f:
+                f.write(''.join(lines))
+            catalog = FromFileCatalog(
+                {'public:adhoc:edges': [('src', 'LONG_TYPE'),
+                                        ('dst', 'LONG_TYPE')]}, None)
+            key = {'userName': 'public', 'programName': 'adhoc',
+                   'relationName': 'edges'}
+            query_request = {'rawQuery': 'upload'}
+            uploads.clear()
+            del deleted[:]
+            with HTTMock(local_mock):
+                status = self.connection.upload_path(key, path, catalog,
+                                                     chunk_size=100,
+                                                     overwrite=True)
+            self.assertEqual(status['status'], 'SUCCESS')
+            parts = ['edges__part{}'.format(i) for i in range(len(uploads))]
+            self.assertGreater(len(parts), 1)
+            self.assertEqual(sorted(uploads), sorted(parts))
+            self.assertEqual(''.join(uploads[p] for p in parts),
+                             ''.join(lines))
+            self.assertEqual(len(deleted), len(parts))
+
+            # a single chunk is uploaded to the relation
+            uploads.clear()
+            with HTTMock(local_mock):
+                self.connection.upload_path(key, path, catalog)
+            self.assertEqual(uploads, {'edges': ''.join(lines)})
+        finally:
+            shutil.rmtree(directory)
+
+    def test_upload_path_resume(self):
+        global query_request
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'data.csv')
+            with open(path, 'w') as f:
+                f.write(''.join('{}\n'.format(i) for i in range(100)))
+            manifest = os.path.join(directory, 'manifest')
+            key = {'userName': 'public', 'programName': 'adhoc',
+                   'relationName': 'data'}
+            schema = {'columnNames': ['x'], 'columnTypes': ['LONG_TYPE']}
+            query_request = {'rawQuery': 'upload'}
+
+            @urlmatch(netloc=r'localhost:12345', path=r'/dataset',
+                      method='POST')
+            def fail_part3(url, request):
+                name, data = uploaded(request)
+                if name == 'data__part3':
+                    return {'status_code': 500, 'content': 'failed'}
+                uploads[name] = data
+                return {'status_code': 200, 'content': dataset_info}
+
+            uploads.clear()
+            with HTTMock(fail_part3, local_mock):
+                with self.assertRaises(MyriaError):
+                    self.connection.upload_path(key, path, schema=schema,
+                                                chunk_size=40,
+                                                manifest=manifest,
+                                                overwrite=True)
+            self.assertTrue(os.path.exists(manifest))
+            self.assertNotIn('data__part3', uploads)
+
+            uploads.clear()
+            with HTTMock(local_mock):
+                self.connection.upload_path(key, path, schema=schema,
+                                            chunk_size=40, manifest=manifest,
+                                            overwrite=True)
+            # only the chunk that failed is uploaded again
+            self.assertEqual(sorted(uploads), ['data__part3'])
+            self.assertFalse(os.path.exists(manifest))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_upload_path_no_overwrite(self):
+        global query_request
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'data.csv')
+            with open(path, 'w') as f:
+                f.write(''.join('{}\n'.format(i) for i in range(100)))
+            key = {'userName': 'public', 'programName': 'adhoc',
+                   'relationName': 'data'}
+            schema = {'columnNames': ['x'], 'columnTypes': ['LONG_TYPE']}
+            query_request = {'rawQuery': 'upload'}
+
+            # the relation exists
+            uploads.clear()
+            with HTTMock(local_mock):
+                with self.assertRaises(MyriaError):
+                    self.connection.upload_path(key, path, schema=schema,
+                                                chunk_size=40,
+                                                overwrite=False)
+            self.assertEqual(uploads, {})
+
+            @urlmatch(netloc=r'localhost:12345',
+                      path=r'/dataset/user-public/program-adhoc/'
+                           r'relation-data$', method='GET')
+            def missing(url, request):
+                return {'status_code': 404, 'content': 'not found'}
+
+            with HTTMock(missing, local_mock):
+                status = self.connection.upload_path(key, path,
+                                                     schema=schema,
+                                                     chunk_size=40)
+            self.assertEqual(status['status'], 'SUCCESS')
+            self.assertGreater(len(uploads), 1)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_upload_path_cleanup(self):
+        global query_request
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'data.csv')
+            with open(path, 'w') as f:
+                f.write(''.join('{}\n'.format(i) for i in range(100)))
+            manifest = os.path.join(directory, 'manifest')
+            key = {'userName': 'public', 'programName': 'adhoc',
+                   'relationName': 'data'}
+            schema = {'columnNames': ['x'], 'columnTypes': ['LONG_TYPE']}
+            query_request = {'rawQuery': 'upload'}
+
+            @urlmatch(netloc=r'localhost:12345', method='DELETE')
+            def fail_delete(url, request):
+                deleted.append(url.path)
+                if url.path.endswith('data__part1'):
+                    return {'status_code': 500, 'content': 'failed'}
+                # a part deleted by an earlier attempt
+                return {'status_code': 404, 'content': 'not found'}
+
+            uploads.clear()
+            del deleted[:]
+            with HTTMock(fail_delete, local_mock):
+                with self.assertRaises(MyriaError):
+                    self.connection.upload_path(key, path, schema=schema,
+                                                chunk_size=40,
+                                                manifest=manifest,
+                                                overwrite=True)
+            # the union was stored before the parts were deleted
+            self.assertFalse(os.path.exists(manifest))
+            self.assertEqual(len(deleted), 2)
+
+            # a rerun uploads the file again
+            uploads.clear()
+            del deleted[:]
+            with HTTMock(local_mock):
+                self.connection.upload_path(key, path, schema=schema,
+                                            chunk_size=40, manifest=manifest,
+                                            overwrite=True)
+            self.assertEqual(len(uploads), len(deleted))
+            self.assertIn('data__part1', uploads)
+        finally:
+            shutil.rmtree(directory)
+
     def test_validate(self):
         global query_request
         with HTTMock(local_mock):
@@ -0,0 +1,91 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from raco.backends.myria.upload import (FileSlice, UploadManifest,
+                                        binary_record_size, record_chunks)
+
+
+class TestUpload(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, data):
+        path = os.path.join(self.directory, 'data')
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def read_chunks(self, path, chunks):
+        data = []
+        for start, end in chunks:
+            with FileSlice(path, start, end) as f:
+                self.assertEqual(len(f), end - start)
+                data.append(f.read(3) + f.read())
+        return data
+
+    def test_text_chunks(self):
+        lines = ['{},{}\n'.format(i, 'x' * (i % 7)) for i in range(100)]
+        path = self.write(''.join(lines))
+        for chunk_size in [1, 5, 64, 1000, 10000]:
+            data = self.read_chunks(path, record_chunks(path, chunk_size))
+            self.assertEqual(''.join(data), ''.join(lines))
+            for chunk in data:
+                self.assertTrue(chunk.endswith('\n'))
+            for chunk in data[:-1]:
+                self.assertGreaterEqual(len(chunk), chunk_size)
+
+    def test_text_without_final_newline(self):
+        path = self.write('1,2\n3,4\n5,6')
+        data = self.read_chunks(path, record_chunks(path, 5))
+        self.assertEqual(data, ['1,2\n3,4\n', '5,6'])
+
+    def test_empty_file(self):
+        path = self.write('')
+        self.assertEqual(record_chunks(path, 10), [(0, 0)])
+        self.assertEqual(record_chunks(path, 10, 8), [(0, 0)])
+
+    def test_binary_chunks(self):
+        schema = {'columnNames': ['a', 'b'],
+                  'columnTypes': ['LONG_TYPE', 'INT_TYPE']}
+        size = binary_record_size(schema)
+        self.assertEqual(size, 12)
+        records = [struct.pack('<qi', i, -i) for i in range(10)]
+        path = self.write(''.join(records))
+        chunks = record_chunks(path, 30, size)
+        self.assertEqual(chunks, [(0, 24), (24, 48), (48, 72), (72, 96),
+                                  (96, 120)])
+        self.assertEqual(''.join(self.read_chunks(path, chunks)),
+                         ''.join(records))
+
+        with self.assertRaises(ValueError):
+            record_chunks(path, 30, 7)
+        with self.assertRaises(ValueError):
+            binary_record_size({'columnNames': ['s'],
+                                'columnTypes': ['STRING_TYPE']})
+
+    def test_manifest(self):
+        path = self.write('1\n2\n')
+        manifest = os.path.join(self.directory, 'manifest')
+        upload = UploadManifest.describe(path, {'relationName': 'R'}, 2,
+                                         False)
+        progress = UploadManifest(manifest, upload)
+        progress.mark_done(1)
+        self.assertEqual(UploadManifest(manifest, upload).done, {1})
+
+        # another upload of the file starts over
+        other = dict(upload, chunkSize=3)
+        self.assertEqual(UploadManifest(manifest, other).done, set())
+
+        progress.remove()
+        self.assertFalse(os.path.exists(manifest))
+        self.assertEqual(UploadManifest(manifest, upload).done, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+"""Streaming uploads of large files to Myria.
+
+A file is split into chunks that end on record boundaries: after a newline
+in a delimited text file, after a whole number of records in a packed binary
+file. MyriaConnection.upload_path streams each chunk from disk, without
+reading the file into memory, and records the chunks it uploaded in an
+UploadManifest so that an interrupted upload can be resumed.
+"""
+
+import json
+import os
+import threading
+
+from raco import types
+
+# The size in bytes of the types in a packed binary file
+BINARY_TYPE_SIZES = {
+    types.LONG_TYPE: 8,
+    types.INT_TYPE: 4,
+    types.DOUBLE_TYPE: 8,
+    types.FLOAT_TYPE: 4,
+    types.BOOLEAN_TYPE: 1,
+}
+
+# The bytes read at a time while looking for the end of a record
+_SCAN_SIZE = 64 * 1024
+
+
+def binary_record_size(schema):
+    """The size in bytes of a record of the Myria schema in a packed binary
+    file. Raises ValueError if a column has no fixed size."""
+    size = 0
+    for name, _type in zip(schema['columnNames'], schema['columnTypes']):
+        if _type not in BINARY_TYPE_SIZES:
+            raise ValueError(
+                "column {} of type {} has no fixed size in a binary file"
+                .format(name, _type))
+        size += BINARY_TYPE_SIZES[_type]
+    return size
+
+
+def record_chunks(path, chunk_size, record_size=None):
+    """Split a file into chunks of about chunk_size bytes that end on record
+    boundaries. Returns a list of (start, end) byte offsets.
+
+    Args:
+        path: the file to split.
+        chunk_size: the target size of a chunk in bytes. A chunk of a text
+            file extends to the end of the line that crosses it.
+        record_size: the size of a record in a binary file, or None for a
+            text file with one record per line.
+    """
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive")
+    size = os.path.getsize(path)
+    if record_size is not None:
+        if size % record_size:
+            raise ValueError(
+                "{} is not a whole number of {}-byte records".format(
+                    path, record_size))
+        step = max(chunk_size // record_size, 1) * record_size
+        return [(start, min(start + step, size))
+                for start in range(0, size, step)] or [(0, 0)]
+
+    chunks = []
+    start = 0
+    with open(path, 'rb') as f:
+        while start < size:
+            end = start + chunk_size
+            if end >= size:
+                end = size
+            else:
+                # extend the chunk to the first newline at or after end - 1
+                f.seek(end - 1)
+                while True:
+                    block = f.read(_SCAN_SIZE)
+                    if not block:
+                        end = size
+                        break
+                    newline = block.find('\n')
+                    if newline >= 0:
+                        end = f.tell() - len(block) + newline + 1
+                        break
+            chunks.append((start, end))
+            start = end
+    return chunks or [(0, 0)]
+
+
+class FileSlice(object):
+    """A file-like object that reads the bytes [start, end) of a file.
+
+    Its length is the number of bytes left to read, as requests_toolbelt's
+    MultipartEncoder expects of the data it streams."""
+
+    def __init__(self, path, start, end):
+        self._file = open(path, 'rb')
+        self._file.seek(start)
+        self._remaining = end - start
+
+    def __len__(self):
+        return self._remaining
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class UploadManifest(object):
+    """The chunks of a file that were uploaded to a relation, saved in a JSON
+    file after each chunk.
+
+    A manifest only resumes the upload that wrote it: if the file, the
+    relation or the chunk size changed, it starts over."""
+
+    def __init__(self, path, upload):
+        """Args:
+            path: the manifest file, or None to keep it in memory only.
+            upload: a dictionary that identifies the upload; load keeps the
+                saved chunks only if they were saved with an equal one.
+        """
+        self.path = path
+        self.upload = upload
+        self.done = set()
+        self._lock = threading.Lock()
+        self.load()
+
+    @staticmethod
+    def describe(path, relation_key, chunk_size, binary):
+        """The dictionary that identifies an upload of a file"""
+        stat = os.stat(path)
+        return {'path': os.path.abspath(path),
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'relationKey': relation_key,
+                'chunkSize': chunk_size,
+                'binary': bool(binary)}
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            try:
+                saved = json.load(f)
+            except ValueError:
+                return
+        if saved.get('upload') == self.upload:
+            self.done = set(saved['done'])
+
+    def _save(self):
+        if self.path is None:
+            return
+        # write a new file, then rename it, so that an interrupted write
+        # leaves the previous manifest
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'upload': self.upload, 'done': sorted(self.done)}, f)
+        os.rename(tmp, self.path)
+
+    def mark_done(self, index):
+        with self._lock:
+            self.done.add(index)
+            self._save()
+
+    def remove(self):
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
@@ -2530,12 +2530,17 @@ class GrappaAlgebra(Algebra):
             grappify_rules = iteratorfy(self.emit_print, scan_array_repr,
                                         groupby_class)
 
+        join_order = []
+        if kwargs.get('reorder_joins', False):
+            join_order.append(rules.CostBasedJoinOrder())
+
         # sequence that works for myrial
         rule_grps_sequence = [
             rules.remove_trivial_sequences,
             [GrappaWhileCondition()],
             rules.simple_group_by,
             cppcommon.clang_push_select,
+            join_order,
             rules.push_project,
             rules.push_apply,
             groupby_rules,
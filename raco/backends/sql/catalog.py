@@ -12,6 +12,7 @@ import raco.expression as expression
 import raco.scheme as scheme
 import raco.types as types
 from raco.representation import RepresentationProperties
+from raco.statistics import ColumnStatistics
 import abc
 
 
@@ -74,6 +75,9 @@ class SQLCatalog(Catalog):
         self.push_grouping = push_grouping
         self.provider = provider
         self.metadata = MetaData()
+        # the ColumnStatistics of each (table, column), until add_tuples
+        # changes the table
+        self.statistics = {}
 
     @staticmethod
     def get_num_servers():
@@ -88,6 +92,49 @@ class SQLCatalog(Catalog):
     def partitioning(self, rel_key):
         return RepresentationProperties()
 
+    def column_statistics(self, rel_key, column):
+        """ Return the statistics of a column, computed on first use """
+        key = (str(rel_key), column)
+        stats = self.statistics.get(key)
+        if stats is None:
+            stats = self._compute_column_statistics(rel_key, column)
+            if stats is not None:
+                self.statistics[key] = stats
+        return stats
+
+    def _compute_column_statistics(self, rel_key, column, num_buckets=10,
+                                   num_most_common=5):
+        """ Compute the statistics of a column with SQL queries """
+        table = self.metadata.tables.get(str(rel_key))
+        if table is None or column not in table.columns:
+            return None
+        col = table.columns[column]
+
+        num_tuples, num_distinct, min_value, max_value = self.engine.execute(
+            select([func.count(), func.count(col.distinct()),
+                    func.min(col), func.max(col)])).first()
+        if not num_tuples:
+            return ColumnStatistics(0)
+
+        most_common = [
+            (v, float(c) / num_tuples)
+            for v, c in self.engine.execute(
+                select([col, func.count()]).group_by(col)
+                .order_by(func.count().desc()).limit(num_most_common))
+            if c > 1]
+
+        # the bounds of an equi-depth histogram
+        num_buckets = min(num_buckets, num_tuples)
+        histogram = [
+            self.engine.execute(
+                select([col]).order_by(col)
+                .offset((num_tuples - 1) * i // num_buckets)
+                .limit(1)).scalar()
+            for i in range(num_buckets + 1)]
+
+        return ColumnStatistics(num_distinct, min_value, max_value,
+                                histogram, most_common)
+
     def get_scheme(self, rel_key):
         table = self.metadata.tables[str(rel_key)]
         return scheme.Scheme((c.name, type_to_raco[type(c.type)])
@@ -102,6 +149,9 @@ class SQLCatalog(Catalog):
     def add_tuples(self, name, schema, tuples=None):
         table = self.metadata.tables[name]
         table.create(self.engine)
+        self.statistics = {key: stats
+                           for key, stats in self.statistics.iteritems()
+                           if key[0] != name}
         if tuples:
             tuples = [{n: v for n, v in zip(schema.get_names(), tup)}
                       for tup in tuples]
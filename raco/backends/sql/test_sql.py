@@ -3,6 +3,7 @@ from raco.backends.sql.test_case import SQLTestCase
 
 import raco.scheme as scheme
 import raco.types as types
+from raco.statistics import ColumnStatistics
 
 
 class TestScheme(SQLTestCase):
@@ -26,6 +27,22 @@ class TestQuery(SQLTestCase):
         self.assertEquals(len(self.emp_table),
                           self.db.num_tuples(self.emp_key))
 
+    def test_column_statistics(self):
+        for position, column in enumerate(['dept_id', 'name', 'salary']):
+            stats = self.db.column_statistics(self.emp_key, column)
+            expected = ColumnStatistics.from_values(
+                t[position + 1] for t in self.emp_table)
+            self.assertEquals(stats.num_distinct, expected.num_distinct)
+            self.assertEquals(stats.min_value, expected.min_value)
+            self.assertEquals(stats.max_value, expected.max_value)
+            self.assertEquals(stats.histogram, expected.histogram)
+            self.assertEquals(sorted(stats.most_common),
+                              sorted(expected.most_common))
+            # computed once
+            self.assertIs(self.db.column_statistics(self.emp_key, column),
+                          stats)
+        self.assertIsNone(self.db.column_statistics(self.emp_key, 'foo'))
+
     def test_simple_scan(self):
         query = """x = scan({emp});
         store(x, OUTPUT);""".format(emp=self.emp_key)
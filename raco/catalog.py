@@ -7,6 +7,7 @@ from raco.algebra import DEFAULT_CARDINALITY
 from raco.representation import RepresentationProperties
 from raco.relation_key import RelationKey
 from raco.scheme import Scheme
+from raco.statistics import ColumnStatistics
 
 
 class Relation(object):
@@ -57,13 +58,27 @@ class Catalog(object):
         # default is to return no information
         return RepresentationProperties()
 
+    def column_statistics(self, rel_key, column):
+        """ Return the ColumnStatistics of the column (by name) of rel_key,
+        or None if there are no statistics """
+        # default is to return no information
+        return None
+
+    def fingerprint(self):
+        """ Return a value that changes whenever the relations or functions
+        of the catalog change, or None if there is no such value. Compiled
+        plans are only cached for catalogs with a fingerprint """
+        # default is to return no information
+        return None
+
 
 # Some useful Catalog implementations
 class FakeCatalog(Catalog):
     """ fake catalog, should only be used in test """
 
     def __init__(self, num_servers, child_sizes=None,
-                 child_partitionings=None, child_functions=None):
+                 child_partitionings=None, child_functions=None,
+                 child_statistics=None):
         self.num_servers = num_servers
         # default sizes
         self.sizes = {}
@@ -71,6 +86,8 @@ class FakeCatalog(Catalog):
         self.partitionings = {}
         # overwrite default sizes if necessary
         self.functions = {}
+        # column statistics, by relation and column name
+        self.statistics = {}
 
         if child_sizes:
             for child, size in child_sizes.items():
@@ -81,6 +98,9 @@ class FakeCatalog(Catalog):
         if child_functions:
             for child, typ in child_functions.items():
                 self.functions[child] = funcObj
+        if child_statistics:
+            for child, stats in child_statistics.items():
+                self.statistics[RelationKey(child)] = stats
 
     def get_num_servers(self):
         return self.num_servers
@@ -96,6 +116,16 @@ class FakeCatalog(Catalog):
                 hash_partitioned=self.partitionings[rel_key])
         return RepresentationProperties()
 
+    def column_statistics(self, rel_key, column):
+        return self.statistics.get(rel_key, {}).get(column)
+
+    def fingerprint(self):
+        def items(d):
+            return sorted((str(k), v) for k, v in d.items())
+        return repr((self.num_servers, items(self.sizes),
+                     items(self.partitionings), sorted(self.functions),
+                     items(self.statistics)))
+
     def get_scheme(self, rel_key):
         raise NotImplementedError()
 
@@ -117,6 +147,13 @@ class FromFileCatalog(Catalog):
     {'relation1' : ([('a', 'LONG_TYPE'), ('b', 'STRING_TYPE')], 10),
      'relation2' : [('y', 'STRING_TYPE'), ('z', 'DATETIME_TYPE')]}
 
+     The cardinality can be followed by optional statistics of the columns,
+     in the format of raco.statistics.ColumnStatistics.to_dict()
+    {'relation1' : ([('a', 'LONG_TYPE'), ('b', 'STRING_TYPE')], 10,
+                    {'a': {'distinct': 5, 'min': 0, 'max': 9,
+                           'histogram': [0, 2, 9],
+                           'most_common': [[3, 0.4]]}})}
+
      Or it can be a single relation, using filename as basename
      [('a', 'LONG_TYPE'), ('b', 'STRING_TYPE')]
 
@@ -132,7 +169,12 @@ class FromFileCatalog(Catalog):
 
         if isinstance(cat, dict):
             def parse(v):
-                if isinstance(v, tuple):
+                if isinstance(v, tuple) and len(v) == 3:
+                    sch, card, stats = v
+                    return sch, card, {
+                        col: ColumnStatistics.from_dict(s)
+                        for col, s in stats.iteritems()}
+                elif isinstance(v, tuple):
                     return v
                 elif isinstance(v, list):
                     return v, DEFAULT_CARDINALITY
@@ -212,6 +254,15 @@ class FromFileCatalog(Catalog):
     def num_tuples(self, rel_key):
         return self.__get_catalog_entry__(rel_key)[1]
 
+    def column_statistics(self, rel_key, column):
+        entry = self.__get_catalog_entry__(rel_key)
+        if len(entry) < 3:
+            return None
+        return entry[2].get(column)
+
     def partitioning(self, rel_key):
         # TODO allow specifying an optional list of attributes
         return RepresentationProperties()
+
+    def fingerprint(self):
+        return repr(sorted(self.catalog.items()))
@@ -0,0 +1,6 @@
+{'A': ([('a', 'LONG_TYPE'), ('b', 'STRING_TYPE')], 10,
+       {'a': {'distinct': 5, 'min': 0, 'max': 9,
+              'histogram': [0, 2, 9],
+              'most_common': [[3, 0.4]]}}),
+ 'B': ([('x', 'LONG_TYPE')], 12)
+ }
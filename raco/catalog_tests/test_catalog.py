@@ -2,6 +2,7 @@ import unittest
 
 from raco.catalog import FromFileCatalog
 from raco.catalog import DEFAULT_CARDINALITY
+from raco.statistics import ColumnStatistics
 import os
 
 test_file_path = "raco/catalog_tests"
@@ -30,6 +31,17 @@ class TestFromFileCatalog(unittest.TestCase):
         self.assertEqual(cut.num_tuples('B'), DEFAULT_CARDINALITY)
         self.assertEqual(cut.num_tuples('C'), 12)
 
+    def test_column_statistics_relation(self):
+        cut = FromFileCatalog.load_from_file(
+            "{p}/statistics_relation.py".format(p=test_file_path))
+
+        self.assertEqual(cut.get_scheme('A').get_names(), ['a', 'b'])
+        self.assertEqual(cut.num_tuples('A'), 10)
+        self.assertEqual(cut.column_statistics('A', 'a'),
+                         ColumnStatistics(5, 0, 9, [0, 2, 9], [(3, 0.4)]))
+        self.assertIsNone(cut.column_statistics('A', 'b'))
+        self.assertIsNone(cut.column_statistics('B', 'x'))
+
     def test_missing_relation(self):
         cut = FromFileCatalog.load_from_file(
             "{p}/set_cardinality_relation.py".format(p=test_file_path))
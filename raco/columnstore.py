@@ -0,0 +1,157 @@
+"""An in-process table store that keeps relations as typed columns.
+
+ColumnStore implements the same interface as raco.dbconn.DBConnection, but
+stores each attribute of a relation in its own array instead of round-
+tripping every tuple through SQLAlchemy and SQLite. Appending to a relation
+is amortized O(1) per tuple and scans read directly from the columns.
+"""
+
+import array
+import collections
+import itertools
+
+from raco.dbconn import DBConnection
+from raco.scheme import Scheme
+from raco.statistics import ColumnStatistics
+import raco.types as types
+
+# array typecodes for the raco types that have a compact representation.
+# Attributes of other types are stored in plain lists.
+raco_to_typecode = {types.LONG_TYPE: 'l',
+                    types.INT_TYPE: 'l',
+                    types.FLOAT_TYPE: 'd',
+                    types.DOUBLE_TYPE: 'd'}
+
+functions_schema = Scheme([("name", types.STRING_TYPE),
+                           ("description", types.STRING_TYPE),
+                           ("outputType", types.STRING_TYPE),
+                           ("lang", types.INT_TYPE),
+                           ("binary", types.BLOB_TYPE)])
+
+
+def new_column(_type):
+    """Return an empty column for values of the given raco type."""
+    if _type in raco_to_typecode:
+        return array.array(raco_to_typecode[_type])
+    return []
+
+
+class ColumnTable(object):
+    """A relation stored as one column per attribute."""
+
+    def __init__(self, scheme):
+        self.scheme = scheme
+        self.columns = [new_column(t) for t in scheme.get_types()]
+        self.count = 0
+        # the ColumnStatistics of each column, until the table changes
+        self.statistics = None
+
+    def append(self, tup):
+        # Like DBConnection, ignore values beyond the attributes of the scheme
+        columns = self.columns
+        for i, column in enumerate(columns):
+            value = tup[i]
+            try:
+                column.append(value)
+            except (TypeError, OverflowError):
+                # The value does not fit the typed array, e.g. a LONG_TYPE
+                # attribute that holds a float. Fall back to a list.
+                columns[i] = list(columns[i])
+                columns[i].append(value)
+        self.count += 1
+        self.statistics = None
+
+    def extend(self, tuples):
+        for tup in tuples:
+            self.append(tup)
+
+    def __iter__(self):
+        # Bound the scan by the current size so that tuples appended while
+        # it is running are not returned.
+        if not self.columns:
+            return itertools.repeat((), self.count)
+        return itertools.islice(itertools.izip(*self.columns), self.count)
+
+    def column_statistics(self):
+        """Return the ColumnStatistics of each column, computed once for
+        the current contents of the table."""
+        if self.statistics is None:
+            self.statistics = [
+                ColumnStatistics.from_values(
+                    itertools.islice(column, self.count))
+                for column in self.columns]
+        return self.statistics
+
+
+class ColumnStore(object):
+
+    def __init__(self):
+        """Initialize an empty table store."""
+        self.tables = {}
+        self.functions = {}
+
+    def __get_table(self, rel_key):
+        return self.tables[str(rel_key)]
+
+    def get_scheme(self, rel_key):
+        """Return the schema associated with a relation key."""
+        return self.__get_table(rel_key).scheme
+
+    def add_table(self, rel_key, schema, tuples=None):
+        """Add a table to the database."""
+        table = ColumnTable(schema)
+        if tuples:
+            table.extend(tuples)
+        self.tables[str(rel_key)] = table
+
+    def append_table(self, rel_key, tuples):
+        """Append tuples to an existing relation."""
+        self.__get_table(rel_key).extend(tuples)
+
+    def num_tuples(self, rel_key):
+        """Return number of tuples of rel_key """
+        return self.__get_table(rel_key).count
+
+    def scan(self, rel_key):
+        """Return an iterator over the tuples of a table."""
+        return iter(self.__get_table(rel_key))
+
+    def get_columns(self, rel_key):
+        """Return the columns of a table, without copying them."""
+        return self.__get_table(rel_key).columns
+
+    def column_statistics(self, rel_key, column):
+        """Return the ColumnStatistics of a column of a table."""
+        table = self.__get_table(rel_key)
+        return table.column_statistics()[table.scheme.getPosition(column)]
+
+    def get_table(self, rel_key):
+        """Retrieve the contents of a table as a bag (Counter)."""
+        return collections.Counter(self.scan(rel_key))
+
+    def delete_table(self, rel_key, ignore_failure=False):
+        """Delete a table from the database."""
+        try:
+            del self.tables[str(rel_key)]
+        except KeyError:
+            if not ignore_failure:
+                raise
+
+    def get_sql_output(self, sql):
+        """Retrieve the result of a query as a bag (Counter).
+
+        The query runs against an in-memory SQLite copy of the tables.
+        """
+        conn = DBConnection()
+        for name, table in self.tables.iteritems():
+            conn.add_table(name, table.scheme, iter(table))
+        return conn.get_sql_output(sql)
+
+    def get_function(self, name):
+        """Retrieve a function from catalog."""
+        return dict(self.functions[name])
+
+    def register_function(self, tup):
+        """Register a function in the catalog."""
+        func = dict(zip(functions_schema.get_names(), tup))
+        self.functions[func["name"]] = func
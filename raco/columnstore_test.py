@@ -0,0 +1,112 @@
+import array
+import collections
+import unittest
+import itertools
+
+from raco.columnstore import ColumnStore
+from raco.dbconn import DBConnection
+from raco.fake_data import FakeData
+from raco.algebra import Scan
+import raco.fakedb
+import raco.scheme as scheme
+import raco.types as types
+
+"""Test the in-process columnar table store."""
+
+
+class ColumnStoreTest(unittest.TestCase, FakeData):
+
+    def setUp(self):
+        self.store = ColumnStore()
+        self.store.add_table("emp", FakeData.emp_schema, FakeData.emp_table)
+        self.store.add_table("num", FakeData.numbers_schema,
+                             FakeData.numbers_table)
+
+    def test_empty_relation(self):
+        self.store.add_table("emp2", FakeData.emp_schema,
+                             collections.Counter())
+        self.assertEquals(self.store.get_table('emp2'), collections.Counter())
+        self.assertEquals(self.store.num_tuples('emp2'), 0)
+        self.assertEquals(self.store.get_scheme('emp2'), FakeData.emp_schema)
+
+    def test_scan(self):
+        self.assertEquals(self.store.get_table('emp'), FakeData.emp_table)
+        self.assertEquals(collections.Counter(self.store.scan('num')),
+                          FakeData.numbers_table)
+
+    def test_typed_columns(self):
+        ids, dept_ids, names, salaries = self.store.get_columns('emp')
+        self.assertIsInstance(ids, array.array)
+        self.assertIsInstance(salaries, array.array)
+        self.assertIsInstance(names, list)
+
+    def test_column_fallback(self):
+        schema = scheme.Scheme([("x", types.LONG_TYPE)])
+        self.store.add_table("mixed", schema, [(1,), (2.5,), (2 ** 80,)])
+        self.assertEquals(self.store.get_table("mixed"),
+                          collections.Counter([(1,), (2.5,), (2 ** 80,)]))
+
+    def test_num_tuples(self):
+        self.assertEquals(self.store.num_tuples('emp'),
+                          len(FakeData.emp_table))
+
+    def test_key_error(self):
+        with self.assertRaises(KeyError):
+            self.store.get_scheme("dept")
+        with self.assertRaises(KeyError):
+            self.store.get_table("dept")
+        with self.assertRaises(KeyError):
+            self.store.num_tuples("dept")
+
+    def test_delete_table(self):
+        self.store.delete_table("emp")
+        with self.assertRaises(KeyError):
+            self.store.get_scheme("emp")
+        with self.assertRaises(KeyError):
+            self.store.delete_table("emp")
+        self.store.delete_table("emp", ignore_failure=True)
+
+    def test_append_table(self):
+        self.store.append_table("emp", FakeData.emp_table)
+
+        it = itertools.chain(iter(FakeData.emp_table),
+                             iter(FakeData.emp_table))
+        self.assertEquals(self.store.get_table('emp'),
+                          collections.Counter(it))
+
+    def test_append_during_scan(self):
+        tuples = self.store.scan("emp")
+        self.store.append_table("emp", FakeData.emp_table)
+        self.assertEquals(collections.Counter(tuples), FakeData.emp_table)
+
+    def test_replace_during_scan(self):
+        tuples = self.store.scan("emp")
+        self.store.add_table("emp", FakeData.emp_schema, tuples)
+        self.assertEquals(self.store.get_table('emp'), FakeData.emp_table)
+
+    def test_sql_output(self):
+        out = self.store.get_sql_output("select id from emp where id < 3")
+        self.assertEquals(out, collections.Counter([(1,), (2,)]))
+
+    def test_functions(self):
+        self.store.register_function(("f", "desc", "LONG_TYPE", 1, "body"))
+        self.assertEquals(self.store.get_function("f")["description"],
+                          "desc")
+
+
+class FakeDatabaseTableStoreTest(unittest.TestCase, FakeData):
+
+    def check_store(self, table_store):
+        db = raco.fakedb.FakeDatabase(table_store=table_store)
+        db.ingest(FakeData.emp_key, FakeData.emp_table, FakeData.emp_schema)
+        scan = Scan(raco.relation_key.RelationKey.from_string(
+            FakeData.emp_key), FakeData.emp_schema)
+        self.assertEquals(db.evaluate_to_bag(scan), FakeData.emp_table)
+        self.assertEquals(db.num_tuples(FakeData.emp_key),
+                          len(FakeData.emp_table))
+
+    def test_column_store(self):
+        self.check_store(ColumnStore)
+
+    def test_sqlite_store(self):
+        self.check_store(DBConnection)
@@ -1,4 +1,5 @@
 from raco import algebra
+import raco.rules as raco_rules
 import raco.backends as language
 from .pipelines import Pipelined
 from raco.utility import emit
@@ -35,32 +36,127 @@ class PlanWriter():
         self.ind += 1
 
 
-def optimize_by_rules(expr, rules):
-    writer = PlanWriter()
-    writer.write_if_enabled(expr, "before rules")
-
-    for rule in rules:
+class RuleDriver(object):
+    """Apply a list of rules to an expression tree.
+
+    A rule is applied once to every operator of the tree, top-down. A
+    FixpointGroup of rules is applied again and again until none of its
+    rules changes the tree. To bound the work of these repeated passes,
+    the driver stamps each operator with the clock of its last change, and
+    remembers for each rule the clock at which the rule last visited an
+    operator; a rule skips a subtree that did not change since then.
+    """
+
+    def __init__(self):
+        self.writer = PlanWriter()
+        # incremented on every change made by a rule
+        self.clock = 0
+        # id(op) -> (op, stamp of op, max stamp of its subtree)
+        self.modified = {}
+        # id(rule) -> {id(op) -> (op, clock when rule last visited op)}
+        self.verified = {}
+
+    def optimize(self, expr, rules):
+        self.writer.write_if_enabled(expr, "before rules")
+        for rule in rules:
+            if getattr(rule, '_disabled', False):
+                continue
+            if isinstance(rule, raco_rules.FixpointGroup):
+                self.verified = {}
+                expr = self.fixpoint(expr, rule)
+            else:
+                expr = self.apply_once(expr, rule)
+        return expr
+
+    def changed(self, rule, before, after):
+        """Log and draw a change made by a rule"""
+        self.clock += 1
+        self.writer.write_if_enabled(after, str(rule))
+        LOG.debug("apply rule %s\n" +
+                  colored("  -", "red") + " %s" + "\n" +
+                  colored("  +", "green") + " %s", rule, before, after)
+
+    def apply_once(self, expr, rule):
+        """Apply a rule to every operator of the tree, top-down"""
         def recursiverule(e):
-            newe = rule(e)
-            writer.write_if_enabled(newe, str(rule))
+            newe, changed = rule.rewrite(e)
+            if changed:
+                self.changed(rule, e, newe)
             if newe.stop_recursion:
                 return newe
-
-            # log the optimizer step
-            if str(e) == str(newe):
-                LOG.debug("apply rule %s (no effect)\n" +
-                          " %s \n", rule, e)
-            else:
-                LOG.debug("apply rule %s\n" +
-                          colored("  -", "red") + " %s" + "\n" +
-                          colored("  +", "green") + " %s", rule, e, newe)
-
             newe.apply(recursiverule)
-
             return newe
-        expr = recursiverule(expr)
 
-    return expr
+        return recursiverule(expr)
+
+    def fixpoint(self, expr, group):
+        """Apply the rules of a group until they no longer change the
+        tree, or group.max_passes times"""
+        for _ in range(group.max_passes):
+            start = self.clock
+            for rule in group.rules:
+                if getattr(rule, '_disabled', False):
+                    continue
+                if isinstance(rule, raco_rules.FixpointGroup):
+                    expr = self.fixpoint(expr, rule)
+                else:
+                    expr = self.apply_tracked(expr, rule)
+            if self.clock == start:
+                return expr
+
+        LOG.warning("%s did not converge after %d passes",
+                    group, group.max_passes)
+        return expr
+
+    def apply_tracked(self, expr, rule):
+        """Apply a rule to every operator of the tree, top-down, skipping
+        the subtrees that did not change since the rule last visited them.
+        """
+        verified = self.verified.setdefault(id(rule), {})
+
+        def stamps(e):
+            op, own, subtree = self.modified.get(id(e), (None, 0, 0))
+            if op is not e:
+                # an operator we have never seen
+                return None, None
+            return own, subtree
+
+        def recursiverule(e, forced):
+            own, subtree = stamps(e)
+            if not forced and subtree is not None:
+                op, visited = verified.get(id(e), (None, -1))
+                if op is e and visited >= subtree:
+                    return e, subtree
+
+            visited = self.clock
+            newe, changed = rule.rewrite(e)
+            if changed:
+                self.changed(rule, e, newe)
+                # the rule may have changed the operators below in place
+                forced = True
+            if forced:
+                own = self.clock
+            elif newe is not e or own is None:
+                own = stamps(newe)[0] or 0
+
+            subtree_stamps = [own]
+            if not newe.stop_recursion:
+                def visit_child(child):
+                    newchild, child_stamp = recursiverule(child, forced)
+                    subtree_stamps.append(child_stamp)
+                    return newchild
+                newe.apply(visit_child)
+            subtree = max(subtree_stamps)
+
+            verified[id(newe)] = (newe, visited)
+            self.modified[id(newe)] = (newe, own, subtree)
+            return newe, subtree
+
+        return recursiverule(expr, False)[0]
+
+
+def optimize_by_rules(expr, rules):
+    return RuleDriver().optimize(expr, rules)
 
 
 def optimize(expr, target, **kwargs):
@@ -0,0 +1,113 @@
+import unittest
+
+from raco.algebra import Scan, Select, Join, Limit
+from raco.compile import optimize_by_rules
+from raco.expression import *
+from raco.relation_key import RelationKey
+from raco.rules import Rule, FixpointGroup
+import raco.scheme as scheme
+from raco import types
+
+"""Test the rule driver of the optimizer."""
+
+
+class CollapseLimits(Rule):
+
+    """Limit(a, Limit(b, X)) => Limit(min(a, b), X)"""
+
+    def fire(self, expr):
+        if isinstance(expr, Limit) and isinstance(expr.input, Limit):
+            return Limit(min(expr.count, expr.input.count), expr.input.input)
+        return expr
+
+
+class CountVisits(Rule):
+
+    """Leave the plan unchanged, but count the operators visited"""
+
+    def __init__(self):
+        self.visits = []
+        super(CountVisits, self).__init__()
+
+    def fire(self, expr):
+        self.visits.append(expr)
+        return expr
+
+
+class FlipLimit(Rule):
+
+    """Never converges: replace the top Limit by a copy of itself"""
+
+    def __init__(self):
+        self.fired = 0
+        super(FlipLimit, self).__init__()
+
+    def fire(self, expr):
+        if isinstance(expr, Limit):
+            self.fired += 1
+            return Limit(expr.count + 1, expr.input)
+        return expr
+
+
+class RuleDriverTest(unittest.TestCase):
+
+    schema = scheme.Scheme([("a", types.LONG_TYPE), ("b", types.LONG_TYPE)])
+
+    def scan(self, name):
+        return Scan(RelationKey.from_string("public:adhoc:" + name),
+                    self.schema)
+
+    def limits(self, n, input):
+        for i in range(n):
+            input = Limit(10 + i, input)
+        return input
+
+    @staticmethod
+    def count(plan, claz):
+        return sum(1 for op in plan.walk() if isinstance(op, claz))
+
+    def test_single_pass(self):
+        plan = self.limits(8, self.scan("R"))
+        plan = optimize_by_rules(plan, [CollapseLimits()])
+        # each rewrite skips one Limit, which is left for the next pass
+        self.assertEquals(self.count(plan, Limit), 4)
+
+    def test_fixpoint_converges(self):
+        plan = self.limits(8, self.scan("R"))
+        plan = optimize_by_rules(plan, [FixpointGroup([CollapseLimits()])])
+        self.assertEquals(self.count(plan, Limit), 1)
+        self.assertEquals(plan.count, 10)
+
+    def test_skip_unchanged_subtrees(self):
+        select = Select(EQ(UnnamedAttributeRef(0), NumericLiteral(1)),
+                        self.scan("S"))
+        plan = Join(EQ(UnnamedAttributeRef(0), UnnamedAttributeRef(2)),
+                    self.limits(8, self.scan("R")), select)
+        counter = CountVisits()
+        plan = optimize_by_rules(
+            plan, [FixpointGroup([CollapseLimits(), counter])])
+        self.assertEquals(self.count(plan, Limit), 1)
+
+        # the rules visit the changed side of the join on every pass, but
+        # the other side only on the first pass
+        visits = [id(op) for op in counter.visits]
+        self.assertEquals(visits.count(id(select)), 1)
+        self.assertEquals(visits.count(id(select.input)), 1)
+        self.assertGreater(visits.count(id(plan)), 1)
+
+    def test_disable_rule_in_group(self):
+        rule_list = [FixpointGroup([CollapseLimits()])]
+        Rule.apply_disable_flags(rule_list, 'no_CollapseLimits')
+        plan = optimize_by_rules(self.limits(8, self.scan("R")), rule_list)
+        self.assertEquals(self.count(plan, Limit), 8)
+
+        Rule.apply_disable_flags(rule_list)
+        plan = optimize_by_rules(plan, rule_list)
+        self.assertEquals(self.count(plan, Limit), 1)
+
+    def test_max_passes(self):
+        flip = FlipLimit()
+        plan = optimize_by_rules(Limit(1, self.scan("R")),
+                                 [FixpointGroup([flip], max_passes=3)])
+        self.assertEquals(flip.fired, 3)
+        self.assertEquals(plan.count, 4)
@@ -5,7 +5,6 @@ classes for representing and manipulating Datalog programs.
 In particular, they can be compiled to (iterative) relational algebra
 expressions.
 """
-import networkx as nx
 from raco import expression
 import raco.algebra as algebra
 from raco.expression.visitor import SimpleExpressionVisitor
@@ -222,6 +221,8 @@ class BFSLeftDeepPlanner(Planner):
     def chooseplan(self, costfunc=None):
         """Return a join sequence object based on the join graph.  This one is
         simple -- it just adds the joins according to a breadth first search"""
+        import networkx as nx
+
         # choose first node in the original insertion order (networkx does not
         # guarantee even a deterministic order)
         firstnode = [n for n in self.joingraph.nodes()
@@ -289,6 +290,8 @@ class Rule(object):
 
     def toRA(self, program):
         """Emit a relational plan for this rule"""
+        import networkx as nx
+
         if program.compiling(self.head):
             # recursive rule
             if not self.fixpoint:
@@ -11,6 +11,7 @@ from sqlalchemy import (Column, Table, MetaData, Integer, String, DateTime,
                         text)
 
 from raco.scheme import Scheme
+from raco.statistics import ColumnStatistics
 import raco.types as types
 
 type_to_raco = {Integer: types.LONG_TYPE,
@@ -38,6 +39,8 @@ class DBConnection(object):
         self.engine = create_engine(connection_string, echo=echo)
         self.metadata = MetaData()
         self.metadata.bind = self.engine
+        # the ColumnStatistics of the columns of each table, until it changes
+        self.statistics = {}
         self.__add_function_registry__()
 
     def __add_function_registry__(self):
@@ -77,6 +80,7 @@ class DBConnection(object):
     def append_table(self, rel_key, tuples):
         """Append tuples to an existing relation."""
         scheme = self.get_scheme(rel_key)
+        self.statistics.pop(str(rel_key), None)
 
         table = self.metadata.tables[str(rel_key)]
         tuples = [{n: v for n, v in zip(scheme.get_names(), tup)}
@@ -89,6 +93,22 @@ class DBConnection(object):
         table = self.metadata.tables[str(rel_key)]
         return self.engine.execute(table.count()).scalar()
 
+    def scan(self, rel_key):
+        """Return an iterator over the tuples of a table."""
+        return self.get_table(rel_key).elements()
+
+    def column_statistics(self, rel_key, column):
+        """Return the ColumnStatistics of a column of a table, computed
+        once for its current contents."""
+        scheme = self.get_scheme(rel_key)
+        statistics = self.statistics.get(str(rel_key))
+        if statistics is None:
+            columns = zip(*self.scan(rel_key)) or [()] * len(scheme)
+            statistics = [ColumnStatistics.from_values(values)
+                          for values in columns]
+            self.statistics[str(rel_key)] = statistics
+        return statistics[scheme.getPosition(column)]
+
     def get_table(self, rel_key):
         """Retrieve the contents of a table as a bag (Counter)."""
         table = self.metadata.tables[str(rel_key)]
@@ -97,6 +117,7 @@ class DBConnection(object):
 
     def delete_table(self, rel_key, ignore_failure=False):
         """Delete a table from the database."""
+        self.statistics.pop(str(rel_key), None)
         try:
             table = self.metadata.tables[str(rel_key)]
             table.drop(self.engine)
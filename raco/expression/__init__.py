@@ -4,3 +4,4 @@ from .boolean import *
 from .function import *
 from .util import *
 from .statevar import *
+from .compiler import *
@@ -71,9 +71,34 @@ class BuiltinAggregateExpression(AggregateExpression):
     def get_decomposable_state(self):
         return None
 
-    @abstractmethod
     def evaluate_aggregate(self, tuple_iterator, scheme):
         """Evaluate an aggregate over a bag of tuples"""
+        state = self.init_state()
+        for t in tuple_iterator:
+            state = self.update_state(state, self.input.evaluate(t, scheme))
+        return self.finalize_state(state)
+
+    def get_input(self):
+        """Return the expression whose values are aggregated, or None if
+        the aggregate does not depend on the values of the tuples"""
+        return self.input
+
+    @abstractmethod
+    def init_state(self):
+        """Return the accumulator state of an aggregate over no tuples"""
+
+    @abstractmethod
+    def update_state(self, state, value):
+        """Return the accumulator state after adding the value of the input
+        expression for one tuple to state"""
+
+    def finalize_state(self, state):
+        """Return the value of the aggregate from its accumulator state"""
+        return state
+
+
+# Accumulator state of MIN and MAX before they have seen a value
+EMPTY_STATE = object()
 
 
 class UdaAggregateExpression(AggregateExpression, UnaryOperator):
@@ -186,18 +211,37 @@ class TrivialAggregateExpression(BuiltinAggregateExpression):
 
 class MAX(UnaryFunction, TrivialAggregateExpression):
 
-    def evaluate_aggregate(self, tuple_iterator, scheme):
-        inputs = (self.input.evaluate(t, scheme) for t in tuple_iterator)
-        return max(inputs)
+    def init_state(self):
+        return EMPTY_STATE
+
+    def update_state(self, state, value):
+        if state is EMPTY_STATE:
+            return value
+        return max(state, value)
+
+    def finalize_state(self, state):
+        if state is EMPTY_STATE:
+            raise ValueError("MAX of an empty bag")
+        return state
 
     def typeof(self, scheme, state_scheme):
         return self.input.typeof(scheme, state_scheme)
 
 
 class MIN(UnaryFunction, TrivialAggregateExpression):
-    def evaluate_aggregate(self, tuple_iterator, scheme):
-        inputs = (self.input.evaluate(t, scheme) for t in tuple_iterator)
-        return min(inputs)
+
+    def init_state(self):
+        return EMPTY_STATE
+
+    def update_state(self, state, value):
+        if state is EMPTY_STATE:
+            return value
+        return min(state, value)
+
+    def finalize_state(self, state):
+        if state is EMPTY_STATE:
+            raise ValueError("MIN of an empty bag")
+        return state
 
     def typeof(self, scheme, state_scheme):
         return self.input.typeof(scheme, state_scheme)
@@ -208,13 +252,28 @@ class LEXMIN(NaryFunction, TrivialAggregateExpression):
     def evaluate_aggregate(self, tuple_iterator, scheme):
         raise NotImplementedError()
 
+    def init_state(self):
+        raise NotImplementedError()
+
+    def update_state(self, state, value):
+        raise NotImplementedError()
+
     def typeof(self, scheme, state_scheme):
         raise NotImplementedError()
 
 
 class COUNTALL(ZeroaryOperator, BuiltinAggregateExpression):
+    def init_state(self):
+        return 0
+
     def evaluate_aggregate(self, tuple_iterator, scheme):
-        return len(tuple_iterator)
+        return sum(1 for _ in tuple_iterator)
+
+    def get_input(self):
+        return None
+
+    def update_state(self, state, value):
+        return state + 1
 
     def typeof(self, scheme, state_scheme):
         return types.LONG_TYPE
@@ -228,13 +287,13 @@ class COUNTALL(ZeroaryOperator, BuiltinAggregateExpression):
 
 
 class COUNT(UnaryFunction, BuiltinAggregateExpression):
-    def evaluate_aggregate(self, tuple_iterator, scheme):
-        inputs = (self.input.evaluate(t, scheme) for t in tuple_iterator)
-        count = 0
-        for t in inputs:
-            if t is not None:
-                count += 1
-        return count
+    def init_state(self):
+        return 0
+
+    def update_state(self, state, value):
+        if value is not None:
+            return state + 1
+        return state
 
     def typeof(self, scheme, state_scheme):
         return types.LONG_TYPE
@@ -248,10 +307,13 @@ class COUNT(UnaryFunction, BuiltinAggregateExpression):
 
 
 class SUM(UnaryFunction, TrivialAggregateExpression):
-    def evaluate_aggregate(self, tuple_iterator, scheme):
-        inputs = (self.input.evaluate(t, scheme) for t in tuple_iterator)
+    def init_state(self):
+        return 0
 
-        return sum(x for x in inputs if x is not None)
+    def update_state(self, state, value):
+        if value is not None:
+            return state + value
+        return state
 
     def typeof(self, scheme, state_scheme):
         input_type = self.input.typeof(scheme, state_scheme)
@@ -260,10 +322,17 @@ class SUM(UnaryFunction, TrivialAggregateExpression):
 
 
 class AVG(UnaryFunction, BuiltinAggregateExpression):
-    def evaluate_aggregate(self, tuple_iterator, scheme):
-        inputs = (self.input.evaluate(t, scheme) for t in tuple_iterator)
-        filtered = list(x for x in inputs if x is not None)
-        return sum(filtered) / len(filtered)
+    def init_state(self):
+        # (sum, count)
+        return (0, 0)
+
+    def update_state(self, state, value):
+        if value is not None:
+            return (state[0] + value, state[1] + 1)
+        return state
+
+    def finalize_state(self, state):
+        return state[0] / state[1]
 
     def typeof(self, scheme, state_scheme):
         input_type = self.input.typeof(scheme, state_scheme)
@@ -281,16 +350,25 @@ class AVG(UnaryFunction, BuiltinAggregateExpression):
 
 
 class STDEV(UnaryFunction, BuiltinAggregateExpression):
-    def evaluate_aggregate(self, tuple_iterator, scheme):
-        inputs = (self.input.evaluate(t, scheme) for t in tuple_iterator)
-        filtered = [x for x in inputs if x is not None]
-
-        n = len(filtered)
+    def init_state(self):
+        # (count, mean, sum of squared differences from the mean), updated
+        # with Welford's method
+        return (0, 0.0, 0.0)
+
+    def update_state(self, state, value):
+        if value is None:
+            return state
+        n, mean, m2 = state
+        n += 1
+        delta = value - mean
+        mean += delta / n
+        return (n, mean, m2 + delta * (value - mean))
+
+    def finalize_state(self, state):
+        n, _, m2 = state
         if n < 2:
             return 0.0
-
-        mean = float(sum(filtered)) / n
-        return math.sqrt(sum((a - mean) ** 2 for a in filtered) / n)
+        return math.sqrt(m2 / n)
 
     def typeof(self, scheme, state_scheme):
         input_type = self.input.typeof(scheme, state_scheme)
@@ -0,0 +1,193 @@
+"""
+Compile Raco expressions to Python functions.
+
+Evaluating an expression tree with evaluate() walks the tree and resolves
+attribute names against the scheme for every tuple. The compiler instead
+generates the source of a single Python function for a list of expressions,
+with attribute positions resolved, constant subexpressions folded and the
+state values read once into a local. Expressions that the compiler does not
+know how to translate are evaluated with their evaluate() method.
+"""
+
+import math
+import random
+
+from raco import types
+from .expression import (Literal, NamedAttributeRef, UnnamedAttributeRef,
+                         UnnamedStateAttributeRef, NamedStateAttributeRef,
+                         PLUS, MINUS, DIVIDE, IDIVIDE, MOD, TIMES, NEG, CAST,
+                         Case)
+from .boolean import NOT, AND, OR, EQ, NEQ, LT, GT, LTEQ, GTEQ
+from .function import (WORKERID, RANDOM, ABS, CEIL, COS, FLOOR, LOG, SIN,
+                       SQRT, TAN, POW, LESSER, GREATER, SUBSTR, LEN, PYUDF)
+
+unary_templates = {NEG: "(-1 * {0})",
+                   NOT: "(not {0})",
+                   ABS: "abs({0})",
+                   CEIL: "_math.ceil({0})",
+                   COS: "_math.cos({0})",
+                   FLOOR: "_math.floor({0})",
+                   LOG: "_math.log({0})",
+                   SIN: "_math.sin({0})",
+                   SQRT: "_math.sqrt({0})",
+                   TAN: "_math.tan({0})",
+                   LEN: "len({0})"}
+
+binary_templates = {PLUS: "({0} + {1})",
+                    MINUS: "({0} - {1})",
+                    TIMES: "({0} * {1})",
+                    DIVIDE: "(float({0}) / {1})",
+                    IDIVIDE: "int({0} / {1})",
+                    MOD: "int({0} % {1})",
+                    AND: "({0} and {1})",
+                    OR: "({0} or {1})",
+                    EQ: "({0} == {1})",
+                    NEQ: "({0} != {1})",
+                    LT: "({0} < {1})",
+                    GT: "({0} > {1})",
+                    LTEQ: "({0} <= {1})",
+                    GTEQ: "({0} >= {1})",
+                    POW: "pow({0}, {1})",
+                    LESSER: "min({0}, {1})",
+                    GREATER: "max({0}, {1})"}
+
+# Constants of these types are written into the generated source
+inline_constant_types = (bool, int, long, basestring, type(None))
+
+
+class ExpressionCompiler(object):
+    """Generate the source of a Python function that evaluates expressions.
+
+    The generated function takes a tuple and an optional state object (with
+    a values attribute, as used by StatefulApply and UDAs) and returns a
+    tuple with the value of each expression.
+    """
+
+    def __init__(self, scheme, state_scheme=None):
+        self.scheme = scheme
+        self.state_scheme = state_scheme
+        # Objects referenced by the generated source, by name
+        self.env = {"_math": math}
+        self.uses_state = False
+
+    def bind(self, obj):
+        """Make obj available to the generated source; return its name."""
+        name = "_v{n}".format(n=len(self.env))
+        self.env[name] = obj
+        return name
+
+    def constant(self, value):
+        if isinstance(value, inline_constant_types):
+            return repr(value)
+        return self.bind(value)
+
+    def fallback(self, expr):
+        return "{e}.evaluate(t, {s}, state)".format(
+            e=self.bind(expr), s=self.bind(self.scheme))
+
+    def visit(self, expr):
+        """Return (source, is_constant) for an expression."""
+        if expr is None:
+            return "None", True
+        if isinstance(expr, Literal):
+            return self.constant(expr.value), True
+
+        _type = type(expr)
+        if _type in (NamedAttributeRef, UnnamedAttributeRef):
+            pos = expr.get_position(self.scheme, self.state_scheme)
+            return "t[{pos}]".format(pos=pos), False
+        if _type in (NamedStateAttributeRef, UnnamedStateAttributeRef):
+            self.uses_state = True
+            pos = expr.get_position(self.scheme, self.state_scheme)
+            return "sv[{pos}]".format(pos=pos), False
+        if _type == WORKERID:
+            return "0", True
+        if _type == RANDOM:
+            return "{r}()".format(r=self.bind(random.random)), False
+
+        if _type in unary_templates:
+            inputs = [expr.input]
+            render = unary_templates[_type].format
+        elif _type in binary_templates:
+            inputs = [expr.left, expr.right]
+            render = binary_templates[_type].format
+        elif _type == CAST:
+            inputs = [expr.input]
+            pytype = types.reverse_python_type_map[expr.typeof(None, None)]
+            render = (self.bind(pytype) + "({0})").format
+        elif _type == SUBSTR:
+            inputs = expr.operands
+            render = "{0}[{1}:{2}]".format
+        elif _type == Case:
+            inputs = [e for when in expr.when_tuples for e in when]
+            inputs.append(expr.else_expr)
+            render = render_case
+        elif _type == PYUDF and expr.func is not None:
+            # Not folded: the function may not be deterministic
+            func = self.bind(expr.func)
+            args = [self.visit(e)[0] for e in expr.arguments]
+            return "{f}({a})".format(f=func, a=", ".join(args)), False
+        else:
+            return self.fallback(expr), False
+
+        compiled = [self.visit(e) for e in inputs]
+        if all(is_constant for _, is_constant in compiled):
+            # Fold constant subexpressions. If the evaluation fails, leave
+            # it to raise the error when the expression is evaluated.
+            try:
+                return self.constant(expr.evaluate(None, self.scheme)), True
+            except Exception:
+                pass
+        return render(*[src for src, _ in compiled]), False
+
+    def function(self, exprs, as_tuple):
+        """Compile a function that evaluates exprs.
+
+        The function returns a tuple of the values of the expressions if
+        as_tuple is True; otherwise exprs must contain a single expression
+        and the function returns its value.
+        """
+        values = [self.visit(e)[0] for e in exprs]
+        lines = ["def _compiled(t, state=None):"]
+        if self.uses_state:
+            lines.append("    sv = state.values")
+        if not as_tuple:
+            assert len(values) == 1
+            lines.append("    return {v}".format(v=values[0]))
+        else:
+            lines.append("    return ({v})".format(
+                v="".join(v + ", " for v in values)))
+
+        code = compile("\n".join(lines), "<compiled expression>", "exec",
+                       0, True)
+        env = dict(self.env)
+        exec code in env
+        return env["_compiled"]
+
+
+def render_case(*args):
+    """Render CASE WHEN args[0] THEN args[1] ... ELSE args[-1] END"""
+    if len(args) == 1:
+        return args[0]
+    return "({r} if {t} else {e})".format(r=args[1], t=args[0],
+                                          e=render_case(*args[2:]))
+
+
+def compile_expressions(exprs, scheme, state_scheme=None):
+    """Compile a list of expressions to a Python function.
+
+    :param exprs: The expressions to evaluate. None entries evaluate to None.
+    :param scheme: The scheme of the tuples the expressions are evaluated on
+    :param state_scheme: The scheme of the state, if any
+    :return: A function f(tuple, state=None) that returns a tuple with the
+    value of each expression.
+    """
+    return ExpressionCompiler(scheme, state_scheme).function(exprs, True)
+
+
+def compile_expression(expr, scheme, state_scheme=None):
+    """Compile an expression to a Python function.
+
+    :return: A function f(tuple, state=None) that returns the value of expr.
+    """
+    return ExpressionCompiler(scheme, state_scheme).function([expr], False)
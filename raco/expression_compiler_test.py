@@ -0,0 +1,107 @@
+import collections
+import unittest
+
+import raco.fakedb
+from raco.algebra import Scan, Select, Apply
+from raco.expression import *
+from raco.expression.compiler import ExpressionCompiler
+from raco.fake_data import FakeData
+from raco.relation_key import RelationKey
+from raco.scheme import Scheme
+import raco.types as types
+
+"""Test the compilation of expressions to Python functions."""
+
+
+class State(object):
+    def __init__(self, values):
+        self.values = values
+
+
+class ExpressionCompilerTest(unittest.TestCase):
+
+    scheme = Scheme([("a", types.LONG_TYPE),
+                     ("b", types.DOUBLE_TYPE),
+                     ("s", types.STRING_TYPE)])
+
+    state_scheme = Scheme([("x", types.LONG_TYPE)])
+
+    tuples = [(1, 2.5, "abc"), (-4, 0.5, "hello"), (7, -3.0, "")]
+
+    def check(self, expr):
+        func = compile_expression(expr, self.scheme)
+        for t in self.tuples:
+            self.assertEquals(func(t), expr.evaluate(t, self.scheme))
+
+    def test_arithmetic(self):
+        a = NamedAttributeRef("a")
+        b = UnnamedAttributeRef(1)
+        self.check(PLUS(a, TIMES(b, NumericLiteral(3))))
+        self.check(MINUS(NEG(a), DIVIDE(a, b)))
+        self.check(IDIVIDE(a, NumericLiteral(3)))
+        self.check(MOD(a, NumericLiteral(3)))
+        self.check(POW(ABS(a), NumericLiteral(2)))
+        self.check(GREATER(a, LESSER(a, NumericLiteral(2))))
+        self.check(CAST(types.DOUBLE_TYPE, a))
+
+    def test_boolean(self):
+        a = NamedAttributeRef("a")
+        b = NamedAttributeRef("b")
+        self.check(AND(LT(a, b), NOT(EQ(a, NumericLiteral(7)))))
+        self.check(OR(GTEQ(a, b), NEQ(a, NumericLiteral(1))))
+
+    def test_strings(self):
+        s = NamedAttributeRef("s")
+        self.check(LEN(s))
+        self.check(SUBSTR([s, NumericLiteral(1), NumericLiteral(2)]))
+
+    def test_case(self):
+        a = NamedAttributeRef("a")
+        self.check(Case([(LT(a, NumericLiteral(0)), StringLiteral("neg")),
+                         (GT(a, NumericLiteral(5)), StringLiteral("big"))],
+                        StringLiteral("small")))
+
+    def test_constant_folding(self):
+        expr = PLUS(NamedAttributeRef("a"),
+                    TIMES(NumericLiteral(2), NumericLiteral(3)))
+        compiler = ExpressionCompiler(self.scheme)
+        self.assertEquals(compiler.visit(expr)[0], "(t[0] + 6)")
+
+        # Errors are raised on evaluation, not compilation
+        func = compile_expression(
+            DIVIDE(NumericLiteral(1), NumericLiteral(0)), self.scheme)
+        with self.assertRaises(ZeroDivisionError):
+            func(self.tuples[0])
+
+    def test_state(self):
+        exprs = [PLUS(NamedStateAttributeRef("x"), NamedAttributeRef("a")),
+                 UnnamedStateAttributeRef(0)]
+        func = compile_expressions(exprs, self.scheme, self.state_scheme)
+        self.assertEquals(func(self.tuples[0], State([10])), (11, 10))
+
+    def test_fallback(self):
+        expr = MD5(NamedAttributeRef("s"))
+        self.check(expr)
+
+    def test_compiled_on_operator(self):
+        db = raco.fakedb.FakeDatabase()
+        db.ingest(FakeData.emp_key, FakeData.emp_table, FakeData.emp_schema)
+        scan = Scan(RelationKey.from_string(FakeData.emp_key),
+                    FakeData.emp_schema)
+        select = Select(GT(NamedAttributeRef("salary"), NumericLiteral(5000)),
+                        scan)
+        apply = Apply([("id", NamedAttributeRef("id"))], select)
+        expected = collections.Counter(
+            (t[0],) for t in FakeData.emp_table.elements() if t[3] > 5000)
+
+        self.assertEquals(db.evaluate_to_bag(apply), expected)
+        func = apply._compiled_expressions['emitters'][1]
+        self.assertEquals(db.evaluate_to_bag(apply), expected)
+        self.assertIs(apply._compiled_expressions['emitters'][1], func)
+
+        # Changed expressions are recompiled
+        apply.emitters = [("salary", NamedAttributeRef("salary"))]
+        self.assertEquals(
+            db.evaluate_to_bag(apply),
+            collections.Counter((t[3],) for t in FakeData.emp_table.elements()
+                                if t[3] > 5000))
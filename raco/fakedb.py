@@ -1,19 +1,428 @@
 
+import bisect
 import collections
+import copy
 import itertools
 import csv
+import heapq
+import operator
 import random
+import uuid
 
-from raco.dbconn import DBConnection
+from raco.columnstore import ColumnStore
 from raco import relation_key, types
-from raco.algebra import StoreTemp, DEFAULT_CARDINALITY
+from raco.algebra import (Scan, ScanTemp, Store, StoreTemp, AppendTemp, Sink,
+                          Sequence, Parallel, DoWhile, UntilConvergence,
+                          ScanIDB, IDBController, EOSController,
+                          ZeroaryOperator, UnaryOperator, UnionAll, Join,
+                          GroupBy, Difference, Limit, OrderBy, TopK,
+                          StatefulApply, DEFAULT_CARDINALITY)
 from raco.catalog import Catalog
-from raco.expression import AND, EQ, BuiltinAggregateExpression
+from raco.expression import (AND, EQ, RANDOM, PYUDF, Expression,
+                             BuiltinAggregateExpression,
+                             UnnamedAttributeRef, accessed_columns,
+                             compile_expression, compile_expressions,
+                             extract_conjuncs, rebase_expr,
+                             to_unnamed_recursive)
 from raco.representation import RepresentationProperties
 
 debug = False
 
 
+def split_join_condition(condition, left_len, combined_scheme):
+    """Split a join condition into equijoin keys and a residual predicate.
+
+    A conjunct is an equijoin key if it is an equality whose one side reads
+    only columns of the left input and whose other side reads only columns
+    of the right input.  Right-hand key expressions are rebased so that they
+    can be evaluated directly against a right input tuple.
+
+    :param condition: the join condition, or None
+    :param left_len: the number of columns in the left input
+    :param combined_scheme: the concatenated scheme of both inputs
+    :returns: a tuple (left_keys, right_keys, residual), where residual is
+    an expression over the combined scheme, or None
+    """
+    if condition is None:
+        return [], [], None
+
+    condition = to_unnamed_recursive(copy.deepcopy(condition),
+                                     combined_scheme)
+
+    def side(expr):
+        # Random expressions must be re-evaluated for every pair of tuples
+        if any(isinstance(e, RANDOM) for e in expr.walk()):
+            return None
+        cols = accessed_columns(expr)
+        if cols and all(c < left_len for c in cols):
+            return 'left'
+        if cols and all(c >= left_len for c in cols):
+            return 'right'
+        return None
+
+    left_keys = []
+    right_keys = []
+    residuals = []
+    for conjunc in extract_conjuncs(condition):
+        if isinstance(conjunc, EQ):
+            sides = (side(conjunc.left), side(conjunc.right))
+            if sides == ('left', 'right'):
+                left_key, right_key = conjunc.left, conjunc.right
+            elif sides == ('right', 'left'):
+                left_key, right_key = conjunc.right, conjunc.left
+            else:
+                residuals.append(conjunc)
+                continue
+            if left_len > 0:
+                rebase_expr(right_key, left_len)
+            left_keys.append(left_key)
+            right_keys.append(right_key)
+        else:
+            residuals.append(conjunc)
+
+    residual = reduce(AND, residuals) if residuals else None
+    return left_keys, right_keys, residual
+
+
+def key_function(keys, scheme):
+    """Return a function that extracts a hashable join key from a tuple.
+
+    Like operator.itemgetter, the key is a scalar for a single key expression
+    and a tuple otherwise, so keys built from either side compare equal."""
+    if all(isinstance(k, UnnamedAttributeRef) for k in keys):
+        return operator.itemgetter(*[k.position for k in keys])
+    if len(keys) == 1:
+        return compile_expression(keys[0], scheme)
+    return compile_expressions(keys, scheme)
+
+
+class Descending(object):
+    """Wrap a sort key column so that larger values sort first."""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __ne__(self, other):
+        return self.value != other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def sort_key(sort_columns, ascending):
+    """Return a (key, reverse) pair that sorts tuples in a single pass.
+
+    If all columns sort in the same direction, the key is a plain
+    operator.itemgetter and reverse gives the direction; otherwise the
+    descending columns are wrapped in Descending."""
+    if all(ascending) or not any(ascending):
+        return operator.itemgetter(*sort_columns), not ascending[0]
+
+    def key(t):
+        return tuple(t[col] if asc else Descending(t[col])
+                     for col, asc in zip(sort_columns, ascending))
+    return key, False
+
+
+def compiled(op, name, exprs, scheme, state_scheme=None, single=False):
+    """Compile expressions evaluated by an operator.
+
+    The compiled function is cached on the operator under the given name, and
+    reused by later evaluations of the operator as long as the expressions and
+    schemes are unchanged. If single is True, exprs must contain one
+    expression and the function returns its value rather than a tuple."""
+    cache = op.__dict__.setdefault('_compiled_expressions', {})
+    key = (tuple(repr(e) for e in exprs), repr(scheme), repr(state_scheme),
+           single)
+    if name not in cache or cache[name][0] != key:
+        if single:
+            func = compile_expression(exprs[0], scheme, state_scheme)
+        else:
+            func = compile_expressions(exprs, scheme, state_scheme)
+        cache[name] = (key, func)
+    return cache[name][1]
+
+
+def build_on_left(op):
+    """Decide whether to build the hash table on the left input of a join.
+
+    The smaller input, according to the cardinality estimates, is hashed.
+    If the estimates are unavailable, hash the right input."""
+    try:
+        return op.left.num_tuples() < op.right.num_tuples()
+    except NotImplementedError:
+        return False
+
+
+class TrieNode(object):
+    """One level of a trie over a relation, used by the leapfrog triejoin.
+
+    keys is the sorted list of distinct values of this level's attribute;
+    children maps each value to the next level (a TrieNode) or, at the last
+    level, to the list of matching tuples."""
+
+    def __init__(self, keys, children):
+        self.keys = keys
+        self.children = children
+
+
+def build_trie(tuples, key_columns):
+    """Index a bag of tuples on key_columns, in order.
+
+    With no key columns, the trie is just the list of tuples."""
+    if not key_columns:
+        return list(tuples)
+    groups = collections.defaultdict(list)
+    for tpl in tuples:
+        groups[tpl[key_columns[0]]].append(tpl)
+    return TrieNode(sorted(groups),
+                    {k: build_trie(v, key_columns[1:])
+                     for k, v in groups.iteritems()})
+
+
+def leapfrog_intersect(key_lists):
+    """Yield, in order, the values that appear in every sorted key list.
+
+    Each list is traversed by a cursor that seeks (by binary search) to the
+    largest value seen so far; see Veldhuizen, "Leapfrog Triejoin: a worst-case
+    optimal join algorithm", ICDT 2014."""
+    if not all(key_lists):
+        return
+    k = len(key_lists)
+    order = sorted(range(k), key=lambda i: key_lists[i][0])
+    key_lists = [key_lists[i] for i in order]
+    cursors = [0] * k
+    max_key = key_lists[-1][0]
+    p = 0
+    while True:
+        keys = key_lists[p]
+        if keys[cursors[p]] == max_key:
+            # The least cursor has caught up with the greatest: all agree
+            yield max_key
+            cursors[p] += 1
+        else:
+            cursors[p] = bisect.bisect_left(keys, max_key, cursors[p])
+        if cursors[p] == len(keys):
+            return
+        max_key = keys[cursors[p]]
+        p = (p + 1) % k
+
+
+def leapfrog_triejoin(inputs, conditions):
+    """Join bags of tuples with the leapfrog triejoin algorithm.
+
+    :param inputs: a list of iterators of tuples, one per relation
+    :param conditions: a list of join variables, each a list of
+    (relation index, column index) pairs that must be equal.  Variables are
+    bound in the order given.
+    :returns: an iterator over the concatenated tuples of the join
+    """
+    # For each relation, the columns bound by each variable, in order
+    var_columns = [collections.defaultdict(list) for _ in inputs]
+    for var, cond in enumerate(conditions):
+        for rel, col in cond:
+            var_columns[rel][var].append(col)
+
+    tries = []
+    rel_vars = []
+    for rel, it in enumerate(inputs):
+        variables = sorted(var_columns[rel])
+        columns = [var_columns[rel][v] for v in variables]
+        # A variable bound to several columns of one relation is a selection
+        repeated = [cols for cols in columns if len(cols) > 1]
+        tuples = (tpl for tpl in it
+                  if all(tpl[c] == tpl[cols[0]]
+                         for cols in repeated for c in cols[1:]))
+        tries.append(build_trie(tuples, [cols[0] for cols in columns]))
+        rel_vars.append(set(variables))
+
+    participants = [[rel for rel in range(len(inputs)) if var in rel_vars[rel]]
+                    for var in range(len(conditions))]
+
+    def search(var, nodes):
+        if var == len(conditions):
+            # Every variable is bound; nodes are the matching tuple bags
+            for combination in itertools.product(*nodes):
+                yield sum(combination, ())
+            return
+        rels = participants[var]
+        for value in leapfrog_intersect([nodes[rel].keys for rel in rels]):
+            next_nodes = list(nodes)
+            for rel in rels:
+                next_nodes[rel] = nodes[rel].children[value]
+            for tpl in search(var + 1, next_nodes):
+                yield tpl
+
+    return search(0, tries)
+
+
+# Operators that draw random samples of their input
+random_operators = ('sample', 'myriasample', 'samplescan')
+
+# Operators that execute plans rather than compute a relation
+statement_operators = (Sequence, Parallel, DoWhile, UntilConvergence,
+                       IDBController, EOSController, Store, StoreTemp,
+                       AppendTemp, Sink)
+
+
+def operator_expressions(op):
+    """Yield the expressions evaluated by an operator."""
+    for attr in ('condition', 'grouping_list', 'aggregate_list', 'emitters',
+                 'inits', 'updaters'):
+        value = getattr(op, attr, None)
+        if value is None:
+            continue
+        if isinstance(value, Expression):
+            value = [value]
+        for item in value:
+            # emitters, inits and updaters are (name, expression) pairs
+            expr = item[1] if isinstance(item, tuple) else item
+            if isinstance(expr, Expression):
+                yield expr
+
+
+def is_deterministic(op):
+    """Return False if evaluating op twice may give different results."""
+    if op.opname().lower() in random_operators:
+        return False
+    return not any(isinstance(e, (RANDOM, PYUDF))
+                   for expr in operator_expressions(op) for e in expr.walk())
+
+
+def find_loop_invariants(body):
+    """Find the subplans of a loop body whose output is the same in every
+    iteration: they read no temporary or stored relation written by the
+    body, and are deterministic.
+
+    :return: (subplans, join_inputs): the maximal loop-invariant subplans
+    that are worth materializing, and the loop-invariant inputs of the joins
+    that depend on the loop, as sets of operator ids.
+    """
+    assigned = set()
+    stored = set()
+    for statement in body:
+        for op in statement.walk():
+            if isinstance(op, (StoreTemp, AppendTemp)):
+                assigned.add(op.name)
+            elif isinstance(op, Store):
+                stored.add(str(op.relation_key))
+
+    subplans = set()
+    join_inputs = set()
+
+    def visit(op):
+        """Return True if op is loop invariant."""
+        if op.stop_recursion or isinstance(op, ScanIDB):
+            return False
+        children = op.children()
+        invariant = [visit(child) for child in children]
+        if isinstance(op, ScanTemp):
+            return op.name not in assigned
+        if isinstance(op, Scan):
+            return str(op.relation_key) not in stored
+        if all(invariant) and is_deterministic(op) and \
+                not isinstance(op, statement_operators):
+            return True
+        for child, child_invariant in zip(children, invariant):
+            if child_invariant and not isinstance(child, ZeroaryOperator):
+                subplans.add(id(child))
+            if child_invariant and isinstance(op, Join):
+                join_inputs.add(id(child))
+        return False
+
+    for statement in body:
+        visit(statement)
+    return subplans, join_inputs
+
+
+# Operators whose output cannot be maintained by evaluating them on the new
+# tuples of their inputs only. Recursive inputs that contain one of these are
+# evaluated on the full IDB relations instead.
+non_incremental_operators = (GroupBy, Difference, Limit, TopK,
+                             StatefulApply)
+
+
+def idb_name(op):
+    """Return the name of the IDB read by op, or None if op reads no IDB.
+
+    In logical plans, an IDB is read by ScanIDB. In Myria plans, it is read by
+    a consumer that stops the recursion into its producer, the IDBController.
+    """
+    if isinstance(op, ScanIDB):
+        return op.name
+    if op.stop_recursion:
+        while isinstance(op, UnaryOperator):
+            op = op.input
+        if isinstance(op, IDBController):
+            return op.name
+    return None
+
+
+def idb_controller(op):
+    """Return the IDBController computed by a child of UntilConvergence."""
+    while not isinstance(op, IDBController):
+        op = op.input
+    return op
+
+
+def union_branches(op):
+    """Split a plan into the inputs of its top-level UnionAll operators."""
+    if isinstance(op, UnionAll):
+        return [branch for arg in op.args for branch in union_branches(arg)]
+    return [op]
+
+
+class IDBState(object):
+    """The relation computed by an IDBController during a fixpoint.
+
+    Derived tuples are combined with the relation according to the aggregate
+    of the controller (see IDBController.get_agg). Like the output of a Myria
+    IDBController, every tuple that changes the relation is appended to a
+    log, which consumers read incrementally.
+    """
+
+    def __init__(self, controller):
+        agg = controller.get_agg()
+        self.type = agg["type"]
+        self.key_columns = agg.get("keyColIndices")
+        self.value_columns = agg.get("valueColIndices")
+        self.threshold = agg.get("threshold") or 1
+        self.relation = {}
+        self.counts = collections.Counter()
+        self.log = []
+
+    def add(self, tpl):
+        if self.type == "DupElim":
+            if tpl in self.relation:
+                return
+            self.relation[tpl] = tpl
+        elif self.type == "KeepMinValue":
+            key = tuple(tpl[i] for i in self.key_columns)
+            current = self.relation.get(key)
+            if current is not None and \
+                    [current[i] for i in self.value_columns] <= \
+                    [tpl[i] for i in self.value_columns]:
+                return
+            self.relation[key] = tpl
+        else:
+            # CountFilter: emit the key and its count once the count reaches
+            # the threshold, and again whenever it grows afterwards
+            key = tuple(tpl[i] for i in self.key_columns)
+            self.counts[key] += 1
+            if self.counts[key] < self.threshold:
+                return
+            tpl = key + (self.counts[key],)
+            self.relation[key] = tpl
+        self.log.append(tpl)
+
+    def tuples(self):
+        return self.relation.itervalues()
+
+
 class State(object):
     def __init__(self, op_scheme, state_scheme, init_exprs):
         self.scheme = state_scheme
@@ -33,16 +442,54 @@ class State(object):
 class FakeDatabase(Catalog):
     """An in-memory implementation of relational algebra operators"""
 
-    def __init__(self):
+    def __init__(self, table_store=ColumnStore, vectorized=False,
+                 incremental_loops=False):
+        """Initialize an empty database.
+
+        :param table_store: A callable that returns an empty table store,
+        such as raco.columnstore.ColumnStore (the default) or
+        raco.dbconn.DBConnection to keep the tables in SQLite.
+        :param vectorized: If True, evaluate Select, Apply and GroupBy on
+        batches of columns with NumPy (see raco.vectorized).
+        :param incremental_loops: If True, DoWhile evaluates the subplans of
+        its body that do not depend on the loop once, and reuses their output
+        (and the hash tables built on it by joins) in later iterations.
+        """
         # Persistent tables, identified by RelationKey
-        self.tables = DBConnection()
+        self.tables = table_store()
 
         # Temporary tables, identified by string name
-        self.temp_tables = DBConnection()
+        self.temp_tables = table_store()
 
         # partitionings
         self.partitionings = {}
 
+        # The version of the persistent tables and functions, incremented
+        # whenever they change, to fingerprint the database as a catalog
+        self.catalog_id = uuid.uuid4().hex
+        self.catalog_version = 0
+
+        # IDB relations computed by UntilConvergence, identified by name
+        self.idbs = {}
+
+        # While a fixpoint runs: the part of its IDB log that each operator
+        # reading an IDB returns, the side of each recursive join to hash,
+        # and the hash tables of join inputs that do not read an IDB.
+        self.idb_bindings = {}
+        self.join_build_sides = {}
+        self.loop_invariant_inputs = set()
+        self.join_tables = {}
+
+        # While a DoWhile runs in incremental mode: the output of its loop
+        # invariant subplans, or None until they are first evaluated
+        self.incremental_loops = incremental_loops
+        self.materialized = {}
+
+        self.vectorized_executor = None
+        if vectorized:
+            from raco.vectorized import VectorizedExecutor
+            self.vectorized_executor = VectorizedExecutor(self)
+
     def get_num_servers(self):
         return 1
 
@@ -52,6 +499,17 @@ class FakeDatabase(Catalog):
         except KeyError:
             return DEFAULT_CARDINALITY
 
+    def column_statistics(self, rel_key, column):
+        """The statistics of a column of a stored relation, computed once
+        per version of the relation"""
+        try:
+            return self.tables.column_statistics(rel_key, column)
+        except KeyError:
+            return None
+
+    def fingerprint(self):
+        return (self.catalog_id, self.catalog_version)
+
     def partitioning(self, rel_key):
         """get fake metadata for relation.
         This has no effect on query evaluation
@@ -64,9 +522,28 @@ class FakeDatabase(Catalog):
         For "query-type" operators, return a tuple iterator.
         For store queries, the return value is None.
         """
+        if id(op) in self.materialized:
+            return self.evaluate_materialized(op)
+        if self.vectorized_executor is not None:
+            batch = self.vectorized_executor.evaluate(op)
+            if batch is not None:
+                return batch.tuples()
+        return self.evaluate_rows(op)
+
+    def evaluate_rows(self, op):
+        """Evaluate a relational algebra operation one tuple at a time."""
         method = getattr(self, op.opname().lower())
         return method(op)
 
+    def evaluate_materialized(self, op):
+        """Evaluate a loop-invariant subplan once and keep its output."""
+        tuples = self.materialized[id(op)]
+        if tuples is None:
+            del self.materialized[id(op)]
+            tuples = list(self.evaluate(op))
+            self.materialized[id(op)] = tuples
+        return iter(tuples)
+
     def evaluate_to_bag(self, op):
         """Return a bag (collections.Counter instance) for the operation"""
         return collections.Counter(self.evaluate(op))
@@ -79,9 +556,11 @@ class FakeDatabase(Catalog):
         assert isinstance(rel_key, relation_key.RelationKey)
         self.tables.add_table(rel_key, scheme, contents.elements())
         self.partitionings[rel_key] = partitioning
+        self.catalog_version += 1
 
     def add_function(self, tup):
         print ("added function")
+        self.catalog_version += 1
         return self.tables.register_function(tup)
 
     def get_function(self, name):
@@ -125,7 +604,7 @@ class FakeDatabase(Catalog):
 
     def scan(self, op):
         assert isinstance(op.relation_key, relation_key.RelationKey)
-        return self.tables.get_table(op.relation_key).elements()
+        return self.tables.scan(op.relation_key)
 
     def calculatesamplingdistribution(self, op):
         if op.is_pct:
@@ -183,49 +662,95 @@ class FakeDatabase(Catalog):
     def select(self, op):
         child_it = self.evaluate(op.input)
 
-        def filter_func(_tuple):
-            # Note: this implicitly uses python truthiness rules for
-            # interpreting non-boolean expressions.
-            # TODO: Is this the the right semantics here?
-            return op.condition.evaluate(_tuple, op.scheme())
-
+        # Note: this implicitly uses python truthiness rules for
+        # interpreting non-boolean expressions.
+        # TODO: Is this the the right semantics here?
+        filter_func = compiled(op, 'condition', [op.condition], op.scheme(),
+                               single=True)
         return itertools.ifilter(filter_func, child_it)
 
     def apply(self, op):
-        child_it = self.evaluate(op.input)
+        return self.apply_rows(op, self.evaluate(op.input))
+
+    def apply_rows(self, op, child_it):
         scheme = op.input.scheme()
 
-        def make_tuple(input_tuple):
-            ls = [colexpr.evaluate(input_tuple, scheme)
-                  for (_, colexpr) in op.emitters]
-            return tuple(ls)
-        return (make_tuple(t) for t in child_it)
+        make_tuple = compiled(op, 'emitters',
+                              [colexpr for (_, colexpr) in op.emitters],
+                              scheme)
+        return itertools.imap(make_tuple, child_it)
 
     def statefulapply(self, op):
         child_it = self.evaluate(op.input)
         scheme = op.input.scheme()
 
         state = State(scheme, op.state_scheme, op.inits)
+        update = compiled(op, 'updaters', [expr for (_, expr) in op.updaters],
+                          scheme, op.state_scheme)
+        emit = compiled(op, 'emitters',
+                        [colexpr for (_, colexpr) in op.emitters],
+                        scheme, op.state_scheme)
 
         def make_tuple(input_tuple, state):
             # Update state variables
-            state.update(input_tuple, op.updaters)
+            state.values = update(input_tuple, state)
 
             # Extract a result for each emit expression
-            return tuple([colexpr.evaluate(input_tuple, scheme, state)
-                          for (_, colexpr) in op.emitters])
+            return emit(input_tuple, state)
 
         return (make_tuple(t, state) for t in child_it)
 
     def join(self, op):
-        # Compute the cross product of the children and flatten
-        left_it = self.evaluate(op.left)
-        right_it = self.evaluate(op.right)
-        p1 = itertools.product(left_it, right_it)
+        left_scheme = op.left.scheme()
+        right_scheme = op.right.scheme()
+        combined = left_scheme + right_scheme
+        left_keys, right_keys, residual = split_join_condition(
+            op.condition, len(left_scheme), combined)
+
+        if not left_keys:
+            # No equijoin conditions: compute the cross product of the
+            # children and flatten
+            p1 = itertools.product(self.evaluate(op.left),
+                                   self.evaluate(op.right))
+        else:
+            # Hash the smaller input on the equijoin keys, probe with the
+            # other one
+            left_key = key_function(left_keys, left_scheme)
+            right_key = key_function(right_keys, right_scheme)
+            build_left = self.join_build_sides.get(id(op))
+            if build_left is None:
+                build_left = build_on_left(op)
+            if build_left:
+                table = self.hash_table(op.left, left_key)
+                p1 = ((x, y) for y in self.evaluate(op.right)
+                      for x in table.get(right_key(y), ()))
+            else:
+                table = self.hash_table(op.right, right_key)
+                p1 = ((x, y) for x in self.evaluate(op.left)
+                      for y in table.get(left_key(x), ()))
         p2 = (x + y for (x, y) in p1)
 
-        # Return tuples that match on the join conditions
-        return (tpl for tpl in p2 if op.condition.evaluate(tpl, op.scheme()))
+        if residual is None:
+            return p2
+
+        # Return tuples that match on the remaining join conditions
+        residual = compiled(op, 'residual', [residual], combined, single=True)
+        return itertools.ifilter(residual, p2)
+
+    def hash_table(self, op, key):
+        """Hash the output of op on a join key.
+
+        Inside a fixpoint, the table of an input that does not read an IDB
+        is built once and reused by the following iterations."""
+        table = self.join_tables.get(id(op))
+        if table is not None:
+            return table
+        table = collections.defaultdict(list)
+        for tpl in self.evaluate(op):
+            table[key(tpl)].append(tpl)
+        if id(op) in self.loop_invariant_inputs:
+            self.join_tables[id(op)] = table
+        return table
 
     def projectingjoin(self, op):
         # standard join, projecting the output columns
@@ -233,19 +758,17 @@ class FakeDatabase(Catalog):
                 for t in self.join(op))
 
     def naryjoin(self, op):
-        def eval_conditions(conditions, tpl):
-            """Turns the weird NaryJoin condition set into a proper
-            expression, then evaluates it."""
-            cond = reduce(lambda a, b: AND(a, b),
-                          map(lambda (a, b): EQ(a, b), conditions))
-            return cond.evaluate(tpl, op.scheme())
-
-        # Elements of prod are tuples of tuples like ((1, 2), (3, 4))
-        prod = itertools.product(*(self.evaluate(child)
-                                   for child in op.children()))
-        # Elements of tuples have been flattened like (1, 2, 3, 4)
-        tuples = (sum(x, ()) for x in prod)
-        return (tpl for tpl in tuples if eval_conditions(op.conditions, tpl))
+        # Map each join attribute to a (child index, column index) pair
+        attr_map = []
+        for child_idx, child in enumerate(op.children()):
+            attr_map.extend((child_idx, col)
+                            for col in range(len(child.scheme())))
+        combined = reduce(operator.add, [c.scheme() for c in op.children()])
+        conditions = [[attr_map[attr.get_position(combined)] for attr in cond]
+                      for cond in op.conditions]
+
+        return leapfrog_triejoin([self.evaluate(child)
+                                  for child in op.children()], conditions)
 
     def crossproduct(self, op):
         left_it = self.evaluate(op.left)
@@ -266,17 +789,29 @@ class FakeDatabase(Catalog):
                    for t in self.evaluate(op.input))
 
     def limit(self, op):
-        it = self.evaluate(op.input)
+        child = op.input
+        if isinstance(child, OrderBy) and id(child) not in self.materialized:
+            # Keep the first tuples in a heap instead of sorting them all
+            return self.top_k(self.evaluate(child.input), op.count,
+                              child.sort_columns, child.ascending)
+        it = self.evaluate(child)
         return itertools.islice(it, op.count)
 
     def orderby(self, op):
         it = self.evaluate(op.input)
-        oList = reversed(zip(op.sort_columns, op.ascending))
-        sortedList = list(it)
-        for o in oList:
-            sortedList = sorted(
-                sortedList, key=lambda x: x[o[0]], reverse=not o[1])
-        return iter(sortedList)
+        key, reverse = sort_key(op.sort_columns, op.ascending)
+        return iter(sorted(it, key=key, reverse=reverse))
+
+    def topk(self, op):
+        it = self.evaluate(op.input)
+        return self.top_k(it, op.count, op.sort_columns, op.ascending)
+
+    @staticmethod
+    def top_k(it, count, sort_columns, ascending):
+        key, reverse = sort_key(sort_columns, ascending)
+        if reverse:
+            return iter(heapq.nlargest(count, it, key=key))
+        return iter(heapq.nsmallest(count, it, key=key))
 
     @staticmethod
     def singletonrelation(op):
@@ -304,45 +839,66 @@ class FakeDatabase(Catalog):
         return sets[0].intersection(sets[1])
 
     def groupby(self, op):
-        child_it = self.evaluate(op.input)
-        input_scheme = op.input.scheme()
+        return self.groupby_rows(op, self.evaluate(op.input))
 
-        def process_grouping_columns(_tuple):
-            ls = [sexpr.evaluate(_tuple, input_scheme) for
-                  sexpr in op.grouping_list]
-            return tuple(ls)
+    def groupby_rows(self, op, child_it):
+        input_scheme = op.input.scheme()
 
-        # Calculate groups of matching input tuples.
+        # For now, built-in aggregates are handled differently than UDA
+        # aggregates.  TODO: clean this up!
+        builtins = [expr for expr in op.aggregate_list
+                    if isinstance(expr, BuiltinAggregateExpression)]
+        udas = [expr for expr in op.aggregate_list
+                if not isinstance(expr, BuiltinAggregateExpression)]
+
+        grouping_columns = compiled(op, 'grouping', op.grouping_list,
+                                    input_scheme)
+        aggregate_inputs = compiled(
+            op, 'aggregate_inputs', [expr.get_input() for expr in builtins],
+            input_scheme)
+        update = compiled(op, 'updaters', [expr for (_, expr) in op.updaters],
+                          input_scheme, op.state_scheme)
+        # UDA emitters can reference only the state tuple
+        emit = compiled(op, 'emitters', [expr.input for expr in udas],
+                        None, op.state_scheme)
+
+        def new_group():
+            return (State(input_scheme, op.state_scheme, op.inits),
+                    [expr.init_state() for expr in builtins])
+
+        # Calculate the aggregate states of each group in a single pass,
+        # without materializing the input tuples of any group.
         # If there are no grouping terms, then all tuples are added
-        # to a single bin.
-        results = collections.defaultdict(list)
-
+        # to a single bin, which exists even if the input is empty.
+        groups = {}
         if len(op.grouping_list) == 0:
-            results[()] = list(child_it)
-        else:
-            for input_tuple in child_it:
-                grouped_tuple = process_grouping_columns(input_tuple)
-                results[grouped_tuple].append(input_tuple)
+            groups[()] = new_group()
+
+        for input_tuple in child_it:
+            key = grouping_columns(input_tuple)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = new_group()
+            state, agg_states = group
+            state.values = update(input_tuple, state)
+            values = aggregate_inputs(input_tuple)
+            for i, expr in enumerate(builtins):
+                agg_states[i] = expr.update_state(agg_states[i], values[i])
 
         # resolve aggregate functions
-        for key, tuples in results.iteritems():
-            state = State(input_scheme, op.state_scheme, op.inits)
-            for tpl in tuples:
-                state.update(tpl, op.updaters)
-
-            # For now, built-in aggregates are handled differently than UDA
-            # aggregates.  TODO: clean this up!
+        for key, (state, agg_states) in groups.iteritems():
+            builtin_values = iter(
+                expr.finalize_state(agg_state)
+                for expr, agg_state in zip(builtins, agg_states))
+            uda_values = iter(emit(None, state))
 
             agg_fields = []
             for expr in op.aggregate_list:
                 if isinstance(expr, BuiltinAggregateExpression):
-                    # Old-style aggregate: pass all tuples to the eval func
-                    agg_fields.append(
-                        expr.evaluate_aggregate(tuples, input_scheme))
+                    # Old-style aggregate: finalize its accumulator
+                    agg_fields.append(next(builtin_values))
                 else:
-                    # UDA-style aggregate: evaluate a normal expression that
-                    # can reference only the state tuple
-                    agg_fields.append(expr.evaluate(None, None, state))
+                    agg_fields.append(next(uda_values))
             yield(key + tuple(agg_fields))
 
     def sequence(self, op):
@@ -364,33 +920,183 @@ class FakeDatabase(Catalog):
         if isinstance(term_op, StoreTemp):
             term_op = term_op.input
 
+        subplans, join_inputs = set(), set()
+        if self.incremental_loops:
+            subplans, join_inputs = find_loop_invariants(children)
+            # Do not replace the outputs kept by an enclosing loop
+            subplans.difference_update(self.materialized)
+            join_inputs.difference_update(self.loop_invariant_inputs)
+        self.materialized.update((key, None) for key in subplans)
+        self.loop_invariant_inputs.update(join_inputs)
+
         if debug:
             print '---------- Values at top of do/while -----'
             self.dump_all()
 
-        while True:
-            for op in body_ops:
-                self.evaluate(op)
-            result_iterator = self.evaluate(term_op)
+        try:
+            while True:
+                for op in body_ops:
+                    self.evaluate(op)
+                result_iterator = self.evaluate(term_op)
 
-            if debug:
-                i += 1
-                print '-------- Iteration %d ------------' % i
-                self.dump_all()
+                if debug:
+                    i += 1
+                    print '-------- Iteration %d ------------' % i
+                    self.dump_all()
 
-            try:
-                tpl = result_iterator.next()
+                try:
+                    tpl = result_iterator.next()
 
-                if debug:
-                    print 'Term: %s' % str(tpl)
+                    if debug:
+                        print 'Term: %s' % str(tpl)
 
-                # XXX should we use python truthiness here?
-                if not tpl[0]:
+                    # XXX should we use python truthiness here?
+                    if not tpl[0]:
+                        break
+                except StopIteration:
+                    break
+                except IndexError:
                     break
-            except StopIteration:
-                break
-            except IndexError:
-                break
+        finally:
+            for key in subplans:
+                del self.materialized[key]
+            for key in join_inputs:
+                self.loop_invariant_inputs.remove(key)
+                self.join_tables.pop(key, None)
+
+    def scanidb(self, op):
+        name = idb_name(op)
+        state = self.idbs[name]
+        binding = self.idb_bindings.get(id(op))
+        if binding is None:
+            return iter(list(state.tuples()))
+        start, end = binding
+        if start is None:
+            # Non-incremental input: read the current relation
+            return iter(list(state.tuples()))
+        return itertools.islice(state.log, start, end)
+
+    def untilconvergence(self, op):
+        """Compute the IDBs of a do/until convergence loop by semi-naive
+        evaluation.
+
+        Each operator that reads an IDB keeps a cursor into the log of the
+        IDB. The recursive inputs of a controller are evaluated once per
+        reader with new tuples, reading the new tuples from that reader, the
+        whole log from the readers before it and the previously read part of
+        the log from the readers after it; so each derivation is computed
+        exactly once. In SYNC mode, the tuples derived in an iteration are
+        read in the next one; in ASYNC mode, they are read by the controllers
+        evaluated after theirs in the same iteration.
+
+        pull_order_policy chooses the input of each recursive join to hash:
+        PULL_IDB hashes the input that reads an IDB, PULL_EDB and BUILD_EDB
+        the other one. Hash tables of inputs that do not read an IDB are kept
+        across iterations.
+        """
+        controllers = [idb_controller(child) for child in op.children()
+                       if not isinstance(child, EOSController)]
+        sync = all(c.recursion_mode == "SYNC" for c in controllers)
+        for controller in controllers:
+            self.idbs[controller.name] = IDBState(controller)
+
+        # The recursive inputs of each controller: (plan, incremental,
+        # readers), where readers are (operator id, IDB name) pairs
+        recursive_inputs = {}
+        cursors = {}
+        join_inputs = set()
+        for controller in controllers:
+            inputs = []
+            for branch in union_branches(controller.args[1]):
+                readers = []
+                incremental = True
+                for child in branch.walk():
+                    name = idb_name(child)
+                    if name is not None:
+                        readers.append((id(child), name))
+                        cursors[id(child)] = 0
+                    elif isinstance(child, non_incremental_operators):
+                        incremental = False
+                    if isinstance(child, Join):
+                        join_inputs.update(self.plan_recursive_join(
+                            child, op.pull_order_policy))
+                if readers:
+                    inputs.append((branch, incremental, readers))
+            recursive_inputs[controller.name] = inputs
+
+        def evaluate_into(plan, state):
+            for tpl in self.evaluate(plan):
+                state.add(tpl)
+
+        def fire(controller, ends):
+            state = self.idbs[controller.name]
+            for plan, incremental, readers in recursive_inputs[
+                    controller.name]:
+                if not incremental:
+                    if all(cursors[r] == ends[n] for r, n in readers):
+                        continue
+                    self.idb_bindings = {r: (None, None) for r, n in readers}
+                    evaluate_into(plan, state)
+                    for r, n in readers:
+                        cursors[r] = ends[n]
+                    continue
+
+                for reader, name in readers:
+                    start, end = cursors[reader], ends[name]
+                    if start == end:
+                        continue
+                    self.idb_bindings = {r: (0, cursors[r])
+                                         for r, n in readers}
+                    self.idb_bindings[reader] = (start, end)
+                    evaluate_into(plan, state)
+                    cursors[reader] = end
+
+        def log_sizes():
+            return {name: len(state.log)
+                    for name, state in self.idbs.iteritems()}
+
+        join_inputs.difference_update(self.loop_invariant_inputs)
+        self.loop_invariant_inputs.update(join_inputs)
+        try:
+            for controller in controllers:
+                evaluate_into(controller.args[0], self.idbs[controller.name])
+
+            sizes = log_sizes()
+            while True:
+                for controller in controllers:
+                    fire(controller, sizes if sync else log_sizes())
+                new_sizes = log_sizes()
+                if new_sizes == sizes:
+                    break
+                sizes = new_sizes
+        finally:
+            self.idb_bindings = {}
+            self.join_build_sides = {}
+            for key in join_inputs:
+                self.loop_invariant_inputs.remove(key)
+                self.join_tables.pop(key, None)
+
+        for controller in controllers:
+            if controller.relation_key is not None:
+                self.tables.add_table(controller.relation_key,
+                                      controller.scheme(),
+                                      self.idbs[controller.name].tuples())
+                self.catalog_version += 1
+
+    def plan_recursive_join(self, op, pull_order_policy):
+        """Choose the input of a join in a recursive input to hash.
+
+        :return: the ids of the inputs of the join that read no IDB
+        """
+        reads_idb = [any(idb_name(x) is not None for x in child.walk())
+                     for child in (op.left, op.right)]
+        if reads_idb[0] != reads_idb[1]:
+            if pull_order_policy == "PULL_IDB":
+                self.join_build_sides[id(op)] = reads_idb[0]
+            elif pull_order_policy in ("PULL_EDB", "BUILD_EDB"):
+                self.join_build_sides[id(op)] = reads_idb[1]
+        return [id(child) for child, reads in zip((op.left, op.right),
+                                                  reads_idb) if not reads]
 
     def debroadcast(self, op):
         return self.evaluate(op.input)
@@ -400,6 +1106,7 @@ class FakeDatabase(Catalog):
 
         scheme = op.input.scheme()
         self.tables.add_table(op.relation_key, scheme, self.evaluate(op.input))
+        self.catalog_version += 1
         return None
 
     def sink(self, op):
@@ -407,6 +1114,7 @@ class FakeDatabase(Catalog):
         self.tables.add_table(
             relation_key.RelationKey("OUTPUT"),
             scheme, self.evaluate(op.input))
+        self.catalog_version += 1
         return None
 
     def dump(self, op):
@@ -422,7 +1130,7 @@ class FakeDatabase(Catalog):
         self.temp_tables.append_table(op.name, self.evaluate(op.input))
 
     def scantemp(self, op):
-        return self.temp_tables.get_table(op.name).elements()
+        return self.temp_tables.scan(op.name)
 
     def myriascan(self, op):
         return self.scan(op)
@@ -463,6 +1171,8 @@ class FakeDatabase(Catalog):
         return self.evaluate(op.input)
 
     def myriasplitconsumer(self, op):
+        if op.stop_recursion:
+            return self.scanidb(op)
         return self.evaluate(op.input)
 
     def myriasplitproducer(self, op):
@@ -496,6 +1206,8 @@ class FakeDatabase(Catalog):
         return self.groupby(op)
 
     def myriashuffleconsumer(self, op):
+        if op.stop_recursion:
+            return self.scanidb(op)
         return self.evaluate(op.input)
 
     def myriashuffleproducer(self, op):
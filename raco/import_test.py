@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+import unittest
+
+"""Test that slow dependencies are only imported on first use."""
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def loaded_modules(code, modules):
+    """The modules among modules that are loaded after running code in a new
+    interpreter"""
+    check = ('\nimport sys\nprint [m for m in {!r} '
+             'if sys.modules.get(m) is not None]'.format(modules))
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    output = subprocess.check_output([sys.executable, '-c', code + check],
+                                     env=env)
+    return eval(output.strip().splitlines()[-1])
+
+
+class LazyImportTest(unittest.TestCase):
+
+    heavy = ['networkx', 'numpy', 'pyparsing', 'requests', 'sqlalchemy']
+
+    def test_raco(self):
+        self.assertEqual(loaded_modules('import raco', self.heavy), [])
+
+    def test_myria_algebra(self):
+        self.assertEqual(
+            loaded_modules('import raco.backends.myria', self.heavy), [])
+
+    def test_datalog(self):
+        code = 'import raco\nraco.parse("A(x) :- R(x, y)")'
+        self.assertEqual(loaded_modules(code, ['pyparsing']), ['pyparsing'])
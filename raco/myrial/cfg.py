@@ -104,29 +104,28 @@ class ControlFlowGraph(object):
                    for i in self.graph}
         live_out = {i: set() for i in self.graph}
 
-        while True:
-            # Create a copy of live_in, live_out that we will compare against
-            # to detect loop termination. This is shallower than a full deep
-            # copy, but we need to copy the value sets in this dictionary as
-            # they are mutated in the loop below. Make the sets frozen to
-            # ensure they are really immutable.
-            live_in_prev = {i: frozenset(s) for i, s in live_in.items()}
-            live_out_prev = {i: frozenset(s) for i, s in live_out.items()}
-
-            for i in self.graph:
-                # live out variables that are not defined are live-in
-                def_var = self.graph.node[i]['def_var']
-                def_set = set()
-                if def_var is not None:
-                    def_set.add(def_var)
-                live_in[i].update(live_out_prev[i] - def_set)
-
+        # Liveness flows backwards: visit the nodes in reverse program order,
+        # so that a pass propagates it through straight-line code; only loops
+        # need more passes.
+        order = sorted(self.graph, reverse=True)
+        changed = True
+        while changed:
+            changed = False
+            for i in order:
                 # variables that are live-in at a successor are live-out
                 for successor in self.graph.successors(i):
-                    live_out[i].update(live_in_prev[successor])
+                    if not live_in[successor] <= live_out[i]:
+                        live_out[i].update(live_in[successor])
+                        changed = True
+
+                # live out variables that are not defined are live-in
+                def_var = self.graph.node[i]['def_var']
+                live_out_undefined = live_out[i] - {def_var}
+                if not live_out_undefined <= live_in[i]:
+                    live_in[i].update(live_out_undefined)
+                    changed = True
 
-            if live_in == live_in_prev and live_out == live_out_prev:
-                return live_in, live_out
+        return live_in, live_out
 
     def __delete_node(self, node):
         """Remove a node from the control flow graph.
@@ -248,19 +247,18 @@ class ControlFlowGraph(object):
 
         _continue = True
         while _continue:
-            _continue = False
             live_in, live_out = self.compute_liveness()
 
-            for node in self.graph:
-                out_set = live_out[node]
-                def_var = self.graph.node[node]['def_var']
-
-                # Only delete nodes that 1) Define a variable (and therefore
-                # aren't STORE, etc.); 2) Are not required downstream.
-                if def_var and def_var not in out_set:
-                    self.__delete_node(node)
-                    _continue = True
-                    break
+            # Only delete nodes that 1) Define a variable (and therefore
+            # aren't STORE, etc.); 2) Are not required downstream. Deleting a
+            # node only removes uses, so the other dead nodes stay dead: delete
+            # them all before recomputing liveness.
+            dead = [node for node in self.graph
+                    if self.graph.node[node]['def_var'] and
+                    self.graph.node[node]['def_var'] not in live_out[node]]
+            for node in dead:
+                self.__delete_node(node)
+            _continue = bool(dead)
 
     def dead_loop_elimination(self):
         """Delete entire do/while loops whose results are not consumed.
@@ -1,6 +1,9 @@
 """Basic test of the command-line interface to Myrial."""
 
+import os
+import shutil
 import subprocess
+import tempfile
 import unittest
 
 
@@ -12,11 +15,42 @@ class CliTest(unittest.TestCase):
         self.assertIn('DO', out)
         self.assertIn('WHILE', out)
 
+    def test_cli_parse_tables(self):
+        # the tables are kept in the cache directory of the user
+        directory = tempfile.mkdtemp()
+        try:
+            env = dict(os.environ, XDG_CACHE_HOME=directory)
+            for _ in range(2):
+                proc = subprocess.Popen(
+                    ['python', 'scripts/myrial', 'examples/reachable.myl'],
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+                out, err = proc.communicate()
+                self.assertIn('DO', out)
+                self.assertEqual(err, '')
+            self.assertEqual(os.listdir(os.path.join(directory, 'raco')),
+                             ['myrial_parsetab.pickle'])
+        finally:
+            shutil.rmtree(directory)
+
     def test_cli_standalone_execute(self):
         out = subprocess.check_output(['python', 'scripts/myrial', '-f',
                                        'examples/standalone.myl'])
         self.assertIn('Dan Suciu,engineering', out)
 
+    def test_cli_standalone_analyze(self):
+        out = subprocess.check_output(['python', 'scripts/myrial',
+                                       '--analyze', 'examples/standalone.myl'])
+        self.assertIn('Dan Suciu,engineering', out)
+        self.assertIn('MyriaSymmetricHashJoin', out)
+        self.assertIn('(rows=7 in=0 calls=1 ', out)
+
+        proc = subprocess.Popen(['python', 'scripts/myrial', '--analyze',
+                                 '-r', 'examples/standalone.myl'],
+                                stderr=subprocess.PIPE)
+        err = proc.communicate()[1]
+        self.assertEquals(proc.returncode, 2)
+        self.assertIn('not allowed with argument -r', err)
+
     def test_cli_standalone_json(self):
         out = subprocess.check_output(['python', 'scripts/myrial', '-j',
                                        'examples/cast.myl'])
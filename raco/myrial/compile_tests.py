@@ -0,0 +1,54 @@
+import collections
+import unittest
+
+import raco.algebra
+import raco.fakedb
+import raco.myrial.interpreter as interpreter
+import raco.scheme as scheme
+from raco import types
+
+
+class CompileStagesTest(unittest.TestCase):
+
+    program = """
+    x = scan(public:adhoc:X);
+    y = [from x where a > 1 emit a, count(*)];
+    store(y, OUTPUT);
+    """
+
+    schema = scheme.Scheme([("a", types.LONG_TYPE), ("b", types.LONG_TYPE)])
+
+    def setUp(self):
+        self.db = raco.fakedb.FakeDatabase()
+        self.db.ingest("public:adhoc:X",
+                       collections.Counter([(1, 2), (3, 4), (3, 5)]),
+                       self.schema)
+
+    def test_stages(self):
+        stages = interpreter.compile_stages(self.program, self.db)
+        self.assertEqual(list(stages.timings),
+                         ['parse', 'evaluate', 'logical', 'optimized_logical',
+                          'physical', 'json'])
+        self.assertEqual([s[0] for s in stages.statements],
+                         ['ASSIGN', 'ASSIGN', 'STORE'])
+        self.assertIsInstance(stages.logical_plan, raco.algebra.Sequence)
+        self.assertEqual(stages.json['logicalRa'],
+                         str(stages.optimized_logical_plan))
+        self.assertEqual(stages.json['rawQuery'], self.program)
+
+        # the optimizations do not modify the logical plan
+        processor = interpreter.StatementProcessor(self.db)
+        processor.evaluate(interpreter.Parser().parse(self.program))
+        self.assertEqual(str(stages.logical_plan),
+                         str(processor.get_logical_plan()))
+
+        self.db.evaluate(stages.physical_plan)
+        self.assertEqual(self.db.get_table('OUTPUT'),
+                         collections.Counter([(3, 2)]))
+
+    def test_no_optimized_logical(self):
+        stages = interpreter.compile_stages(self.program, self.db,
+                                            optimize_logical=False)
+        self.assertIsNone(stages.optimized_logical_plan)
+        self.assertNotIn('optimized_logical', stages.timings)
+        self.assertEqual(stages.json['logicalRa'], str(stages.logical_plan))
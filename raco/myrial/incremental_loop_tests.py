@@ -0,0 +1,56 @@
+import collections
+
+import raco.fakedb
+from raco.myrial import pagerank_test, query_tests, reachable_tests
+
+
+class CountingDatabase(raco.fakedb.FakeDatabase):
+    """A FakeDatabase that counts the scans of each temporary table."""
+
+    def __init__(self, **kwargs):
+        super(CountingDatabase, self).__init__(**kwargs)
+        self.scans = collections.Counter()
+
+    def scantemp(self, op):
+        self.scans[op.name] += 1
+        return super(CountingDatabase, self).scantemp(op)
+
+
+class IncrementalQueryTests(query_tests.TestQueryFunctions):
+    """Run the query tests with loop-invariant subplans materialized."""
+
+    def create_db(self):
+        return raco.fakedb.FakeDatabase(incremental_loops=True)
+
+
+class IncrementalReachableTest(reachable_tests.ReachableTest):
+
+    def create_db(self):
+        return raco.fakedb.FakeDatabase(incremental_loops=True)
+
+
+class IncrementalPageRankTest(pagerank_test.PageRankTest):
+
+    # OutDegree and the loop read Edge
+    edge_scans = 2
+
+    def create_db(self):
+        return CountingDatabase(incremental_loops=True)
+
+    def test_invariants_evaluated_once(self):
+        self.test_pagerank()
+        # The loop reads Edge in Vertex JOIN Edge, which does not depend
+        # on the loop, and OutDegree only in the join with PageRank.
+        self.assertEquals(self.db.scans['Edge'], self.edge_scans)
+        self.assertEquals(self.db.scans['OutDegree'], 1)
+        # PageRank is assigned in the loop
+        self.assertGreater(self.db.scans['PageRank'], 2)
+
+
+class IncrementalVectorizedPageRankTest(IncrementalPageRankTest):
+
+    # The vectorized GroupBy of OutDegree reads the columns of Edge directly
+    edge_scans = 1
+
+    def create_db(self):
+        return CountingDatabase(incremental_loops=True, vectorized=True)
@@ -3,11 +3,16 @@ import raco.myrial.multiway as multiway
 from raco.myrial.cfg import ControlFlowGraph
 from raco.myrial.emitarg import FullWildcardEmitArg, TableWildcardEmitArg
 from raco.myrial.exceptions import *
+from raco.myrial.parser import Parser
+from raco.myrial.plan_cache import (CompiledPlan, PlanCache,
+                                    normalize_program)
 import raco.algebra
 import raco.expression
 import raco.catalog
 import raco.scheme
-from raco.backends.myria import (MyriaLeftDeepTreeAlgebra,
+from raco.backends.logical import OptLogicalAlgebra
+from raco.backends.myria import (MyriaAlgebra,
+                                 MyriaLeftDeepTreeAlgebra,
                                  MyriaHyperCubeAlgebra,
                                  compile_to_json)
 from raco.compile import optimize
@@ -17,6 +22,7 @@ from raco.algebra import Shuffle
 import collections
 import copy
 from functools import reduce
+import timeit
 
 
 class DuplicateAliasException(Exception):
@@ -81,7 +87,7 @@ class ExpressionProcessor(object):
             raise NoSuchRelationException(_id)
 
         self.uses_set.add(_id)
-        return copy.deepcopy(self.symbols[_id])
+        return raco.algebra.clone_operator(self.symbols[_id])
 
     def alias(self, _id):
         return self.__lookup_symbol(_id)
@@ -95,13 +101,21 @@ class ExpressionProcessor(object):
             # Create a dummy schema suitable for emitting plans
             return raco.scheme.DummyScheme()
 
+    def _get_scan_statistics(self, rel_key, scheme):
+        if isinstance(scheme, raco.scheme.DummyScheme):
+            return None
+        return [self.catalog.column_statistics(rel_key, name)
+                for name in scheme.get_names()]
+
     def scan(self, rel_key):
         """Scan a database table."""
         assert isinstance(rel_key, relation_key.RelationKey)
         scheme = self._get_scan_scheme(rel_key)
         return raco.algebra.Scan(rel_key, scheme,
                                  self.catalog.num_tuples(rel_key),
-                                 self.catalog.partitioning(rel_key))
+                                 self.catalog.partitioning(rel_key),
+                                 statistics=self._get_scan_statistics(
+                                     rel_key, scheme))
 
     def samplescan(self, rel_key, samp_size, is_pct, samp_type):
         """Sample a base relation."""
@@ -575,15 +589,19 @@ class StatementProcessor(object):
         kwargs['target'] = target_phys_algebra
         return optimize(logical_plan, **kwargs)
 
-    def get_physical_plan(self, **kwargs):
-        """Return an operator representing the physical query plan."""
+    def get_target_algebra(self, **kwargs):
+        """Return the physical algebra that get_physical_plan targets."""
         target_phys_algebra = kwargs.get('target_alg')
         if target_phys_algebra is None:
             if kwargs.get('multiway_join', False):
                 target_phys_algebra = MyriaHyperCubeAlgebra(self.catalog)
             else:
                 target_phys_algebra = MyriaLeftDeepTreeAlgebra()
+        return target_phys_algebra
 
+    def get_physical_plan(self, **kwargs):
+        """Return an operator representing the physical query plan."""
+        target_phys_algebra = self.get_target_algebra(**kwargs)
         return self.__get_physical_plan_for__(target_phys_algebra, **kwargs)
 
     def get_json(self, **kwargs):
@@ -602,3 +620,127 @@ class StatementProcessor(object):
         # not the string representation of the logical plan
         return compile_to_json(
             "NOT_SOURCED_FROM_LOGICAL_RA", pps, pps, "myrial")
+
+
+def compile_program(program, catalog, cache=None, udas=None, **kwargs):
+    """Compile a MyriaL program.
+
+    :param program: the text of the program
+    :param catalog: the Catalog of the relations it reads
+    :param cache: an optional PlanCache of compiled programs
+    :param udas: the user-defined aggregates, as in Parser.parse
+    :param kwargs: the arguments of StatementProcessor.get_physical_plan
+    :returns: a CompiledPlan. Its json is None unless the target algebra
+    is a Myria algebra.
+    """
+    processor = StatementProcessor(catalog)
+    algebra = processor.get_target_algebra(**kwargs)
+    source = (program, repr(udas))
+    fingerprint = catalog.fingerprint()
+
+    def key_of(normalized):
+        return PlanCache.make_key(normalized, algebra, kwargs, fingerprint)
+
+    statements = None
+    normalized = None
+    if cache is not None:
+        normalized = cache.get_normalized(source)
+        if normalized is None:
+            statements = Parser().parse(program, udas=udas)
+            # before the evaluation modifies the statements
+            normalized = normalize_program(statements)
+            if normalized is not None:
+                cache.put_normalized(source, normalized)
+        compiled = cache.get(key_of(normalized))
+        if compiled is not None:
+            if compiled.json is not None:
+                # the cached plan may come from a different text
+                compiled.json['rawQuery'] = program
+            return compiled
+
+    if statements is None:
+        statements = Parser().parse(program, udas=udas)
+    processor.evaluate(statements)
+    logical_plan = processor.get_logical_plan(**kwargs)
+    # the optimizer modifies the plan it is given
+    physical_plan = optimize(raco.algebra.clone_operator(logical_plan),
+                             **dict(kwargs, target=algebra))
+    json = None
+    if isinstance(algebra, MyriaAlgebra):
+        json = compile_to_json(program, logical_plan, physical_plan, "MyriaL")
+    compiled = CompiledPlan(physical_plan, json)
+    if cache is not None:
+        cache.put(key_of(normalized), compiled)
+    return compiled
+
+
+# The stages of compiling a program: its parsed statements, its logical plan,
+# the logical plan optimized by OptLogicalAlgebra (or None), its physical
+# plan, its JSON encoding for the Myria algebras (or None), and an
+# OrderedDict of the time in seconds of each stage
+CompilationStages = collections.namedtuple(
+    'CompilationStages', ['statements', 'logical_plan',
+                          'optimized_logical_plan', 'physical_plan', 'json',
+                          'timings'])
+
+
+def compile_stages(program, catalog, udas=None, language="MyriaL",
+                   optimize_logical=True, **kwargs):
+    """Compile a MyriaL program, and return every stage of the compilation.
+
+    The program is parsed and evaluated once; the optimized logical plan and
+    the physical plan are optimized from copies of the logical plan.
+
+    :param program: the text of the program
+    :param catalog: the Catalog of the relations it reads
+    :param udas: the user-defined aggregates, as in Parser.parse
+    :param language: the language of the program in its JSON encoding
+    :param optimize_logical: whether to optimize the logical plan with
+    OptLogicalAlgebra; the JSON encoding shows this plan if it is computed,
+    the logical plan otherwise
+    :param kwargs: the arguments of StatementProcessor.get_physical_plan
+    :returns: CompilationStages
+    """
+    clock = timeit.default_timer
+    timings = collections.OrderedDict()
+
+    start = clock()
+    statements = Parser().parse(program, udas=udas)
+    timings['parse'] = clock() - start
+
+    processor = StatementProcessor(catalog)
+    algebra = processor.get_target_algebra(**kwargs)
+    # the evaluation modifies the statements
+    evaluated = copy.deepcopy(statements)
+    start = clock()
+    processor.evaluate(evaluated)
+    timings['evaluate'] = clock() - start
+
+    start = clock()
+    logical_plan = processor.get_logical_plan(**kwargs)
+    timings['logical'] = clock() - start
+
+    optimized_logical_plan = None
+    if optimize_logical:
+        start = clock()
+        optimized_logical_plan = optimize(
+            raco.algebra.clone_operator(logical_plan),
+            target=OptLogicalAlgebra())
+        timings['optimized_logical'] = clock() - start
+
+    start = clock()
+    physical_plan = optimize(raco.algebra.clone_operator(logical_plan),
+                             **dict(kwargs, target=algebra))
+    timings['physical'] = clock() - start
+
+    json = None
+    if isinstance(algebra, MyriaAlgebra):
+        shown = optimized_logical_plan
+        if shown is None:
+            shown = logical_plan
+        start = clock()
+        json = compile_to_json(program, shown, physical_plan, language)
+        timings['json'] = clock() - start
+
+    return CompilationStages(statements, logical_plan, optimized_logical_plan,
+                             physical_plan, json, timings)
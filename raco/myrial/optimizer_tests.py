@@ -1,4 +1,5 @@
 import collections
+import copy
 import random
 import sys
 import re
@@ -17,9 +18,11 @@ from raco.backends.myria import (
     compile_to_json)
 from raco.backends.myria import (MyriaLeftDeepTreeAlgebra,
                                  MyriaHyperCubeAlgebra)
-from raco.compile import optimize
+from raco.compile import optimize, optimize_by_rules
+from raco import rules
 from raco import relation_key
 from raco.catalog import FakeCatalog
+from raco.statistics import ColumnStatistics
 
 import raco.scheme as scheme
 import raco.myrial.myrial_test as myrial_test
@@ -453,6 +456,102 @@ class OptimizerTest(myrial_test.MyrialTestCase):
              for (s3, d3) in self.z_data.elements() if d1 == s2 and d2 == s3])
         self.assertEquals(result, expected)
 
+    def test_reorder_joins_avoids_cross_product(self):
+        """Test that the cost-based join order joins X and Z through Y
+        rather than through a cross product."""
+        s = expression.AND(expression.EQ(AttRef("c"), AttRef("d")),
+                           expression.EQ(AttRef("f"), AttRef("src")))
+        lp = StoreTemp('OUTPUT',
+                       Select(s, CrossProduct(
+                           CrossProduct(Scan(self.x_key, self.x_scheme),
+                                        Scan(self.z_key, self.z_scheme)),
+                           Scan(self.y_key, self.y_scheme))))
+
+        pp = self.logical_to_physical(copy.deepcopy(lp))
+        self.assertEquals(self.get_count(pp, CrossProduct), 1)
+
+        pp = self.logical_to_physical(lp, reorder_joins=True)
+        self.assertEquals(self.get_count(pp, CrossProduct), 0)
+        self.assertEquals(self.get_count(pp, Join), 2)
+
+        self.db.evaluate(pp)
+        result = self.db.get_temp_table('OUTPUT')
+        expected = collections.Counter(
+            [(a, b, c, s, t, d, e, f) for (a, b, c) in self.x_data
+             for (s, t) in self.z_data.elements()
+             for (d, e, f) in self.y_data if c == d and f == s])
+        self.assertEquals(result, expected)
+
+    def test_reorder_joins_by_cardinality(self):
+        """Test that the cost-based join order joins the small relations
+        first."""
+        def plan():
+            return StoreTemp(
+                'OUTPUT',
+                Join(expression.EQ(AttIndex(5), AttIndex(6)),
+                     Join(expression.EQ(AttIndex(2), AttIndex(3)),
+                          Scan(self.x_key, self.x_scheme, 1000000),
+                          Scan(self.y_key, self.y_scheme, 100000)),
+                     Scan(self.z_key, self.z_scheme, 10)))
+
+        lp = optimize_by_rules(plan(), [rules.CostBasedJoinOrder()])
+        self.assertIsInstance(lp.input, Apply)
+        top = lp.input.input
+        self.assertIsInstance(top, Join)
+        self.assertEquals(top.right.relation_key, self.x_key)
+        self.assertEquals(set([top.left.left.relation_key,
+                               top.left.right.relation_key]),
+                          set([self.y_key, self.z_key]))
+        self.assertEquals(lp.scheme(), plan().scheme())
+
+        # the new order is stable
+        self.assertEquals(
+            optimize_by_rules(copy.deepcopy(lp),
+                              [rules.CostBasedJoinOrder()]), lp)
+
+        pp = self.logical_to_physical(lp)
+        self.db.evaluate(pp)
+        result = self.db.get_temp_table('OUTPUT')
+        expected = collections.Counter(
+            [(a, b, c, d, e, f, s, t) for (a, b, c) in self.x_data
+             for (d, e, f) in self.y_data
+             for (s, t) in self.z_data.elements() if c == d and f == s])
+        self.assertEquals(result, expected)
+
+        # the catalog cardinalities take precedence over those of the scans
+        catalog = FakeCatalog(1, {'X': 10, 'Y': 100000, 'Z': 1000000})
+        lp = optimize_by_rules(plan(), [rules.CostBasedJoinOrder(catalog)])
+        self.assertIsInstance(lp.input, Join)
+
+    def test_reorder_joins_by_statistics(self):
+        """Test that the cost-based join order uses the distinct counts of
+        the join columns."""
+        def plan(statistics):
+            def scan(key, sch, stats):
+                return Scan(key, sch, 1000,
+                            statistics=stats if statistics else None)
+            y = scan(self.y_key, self.y_scheme,
+                     [None, None, ColumnStatistics(1)])
+            z = scan(self.z_key, self.z_scheme, [ColumnStatistics(1), None])
+            x = scan(self.x_key, self.x_scheme,
+                     [None, None, ColumnStatistics(1000)])
+            return Join(expression.EQ(AttIndex(0), AttIndex(7)),
+                        Join(expression.EQ(AttIndex(2), AttIndex(3)), y, z),
+                        x)
+
+        # without statistics, both orders are estimated to cost the same
+        lp = plan(False)
+        self.assertEquals(
+            optimize_by_rules(plan(False), [rules.CostBasedJoinOrder()]),
+            lp)
+
+        # with them, joining Y to Z first is estimated to yield 1000000
+        # tuples, and joining X to Y first 1000 tuples
+        lp = optimize_by_rules(plan(True), [rules.CostBasedJoinOrder()])
+        self.assertIsInstance(lp, Apply)
+        self.assertEquals(lp.input.right.relation_key, self.z_key)
+        self.assertEquals(lp.scheme(), plan(True).scheme())
+
     def test_explicit_shuffle(self):
         """Test of a user-directed partition operation."""
 
@@ -1463,3 +1562,65 @@ class OptimizerTest(myrial_test.MyrialTestCase):
         self.assertIsInstance(pp.input.input, MyriaShuffleProducer)
         self.assertIsInstance(pp.input.input.input, Select)
         self.assertIsInstance(pp.input.input.input.input, FileScan)
+
+    def test_share_subplans(self):
+        """Test that a subplan that is used twice is computed once."""
+        query = """
+        T = [from scan(public:adhoc:X) as x where x.a < 5 and x.b < 10
+             emit *];
+        S = [from T as p, T as q where p.b = q.c emit p.a, q.b];
+        store(S, OUTPUT);
+        """
+        expected = collections.Counter(
+            [(a1, b2) for (a1, b1, c1) in self.x_data.elements()
+             for (a2, b2, c2) in self.x_data.elements()
+             if a1 < 5 and b1 < 10 and a2 < 5 and b2 < 10 and
+             b1 == c2])
+
+        pp = self.get_physical_plan(query)
+        self.assertEquals(self.get_count(pp, StoreTemp), 0)
+
+        self.new_processor()
+        pp = self.get_physical_plan(query, share_subplans=True)
+        self.assertEquals(self.get_count(pp, StoreTemp), 1)
+        self.assertEquals(self.get_count(pp, ScanTemp), 2)
+        self.assertEquals(self.get_count(pp, Select), 1)
+        self.db.evaluate(pp)
+        self.assertEquals(self.db.get_table('OUTPUT'), expected)
+
+    def test_share_subplans_across_writes(self):
+        """Test that subplans are not shared across a statement that writes
+        the relations they read."""
+        query = """
+        A = [from scan(public:adhoc:X) as x where x.a < 5 and x.b < 10
+             emit a, b];
+        store(A, OUTPUT);
+        {}
+        B = [from scan(public:adhoc:X) as x where x.a < 5 and x.b < 10
+             emit a, c];
+        store(B, OUTPUT2);
+        """
+
+        pp = self.get_physical_plan(query.format(''), share_subplans=True)
+        self.assertEquals(self.get_count(pp, StoreTemp), 1)
+
+        self.new_processor()
+        pp = self.get_physical_plan(query.format(
+            'C = [from scan(public:adhoc:X) as x where x.a > 2 emit *];'
+            'store(C, public:adhoc:X);'), share_subplans=True)
+        self.assertEquals(self.get_count(pp, StoreTemp), 0)
+        self.db.evaluate(pp)
+        expected = collections.Counter(
+            [(a, c) for (a, b, c) in self.x_data.elements()
+             if 2 < a < 5 and b < 10])
+        self.assertEquals(self.db.get_table('OUTPUT2'), expected)
+
+    def test_share_subplans_not_random(self):
+        """Test that nondeterministic subplans are not shared."""
+        query = """
+        T = [from scan(public:adhoc:X) as x where random() < 0.5 emit *];
+        S = [from T as p, T as q where p.b = q.c emit p.a, q.b];
+        store(S, OUTPUT);
+        """
+        pp = self.get_physical_plan(query, share_subplans=True)
+        self.assertEquals(self.get_count(pp, StoreTemp), 0)
@@ -1,7 +1,10 @@
 # -*- coding: UTF-8 -*-
 
 import collections
+import os
+import shutil
 import sys
+import tempfile
 
 from ply import yacc
 
@@ -93,6 +96,21 @@ def get_num_emitters(ex):
     return len(get_emitters(ex))
 
 
+def user_tables_file():
+    """The file in which command-line tools keep the parse tables: in the
+    cache directory of the user, since the package may be read-only. None
+    if the directory cannot be created."""
+    cache = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    directory = os.path.join(cache, 'raco')
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+    except OSError:
+        return None
+    return os.path.join(directory, 'myrial_parsetab.pickle')
+
+
 class TupleExpression(sexpr.Expression):
     """Represents an instance of a tuple-valued Expression
 
@@ -143,6 +161,10 @@ class Parser(object):
     # mapping from UDA name to local, remote aggregates
     decomposable_aggs = {}
 
+    # The LALR parser generated from the grammar. The grammar does not depend
+    # on the instance, so the parser is generated once and shared.
+    lr_parser = None
+
     def __init__(self, log=yacc.PlyLogger(sys.stderr)):
         self.log = log
         self.tokens = scanner.tokens
@@ -1268,13 +1290,69 @@ class Parser(object):
         Parser.udf_functions = {}
         Parser.decomposable_aggs = {}
         map(lambda uda: self.add_python_udf(*uda), udas or [])
-        parser = yacc.yacc(module=self, debug=False, optimize=False)
+        parser = self.get_lr_parser()
         stmts = parser.parse(s, lexer=scanner.lexer, tracking=True)
 
         # Strip out the remnants of parsed functions to leave only a list of
         # statements
         return [st for st in stmts if st is not None]
 
+    @classmethod
+    def get_lr_parser(cls, write_tables=False, picklefile=None):
+        """Return the shared LALR parser, generating its tables on first use.
+
+        Generating the tables takes far longer than parsing a program, so they
+        can also be kept on disk for later processes: in the module
+        raco.myrial.parsetab if write_tables is set (which is read whenever
+        it exists), or in picklefile, e.g., when the package is read-only
+        (see user_tables_file). Either is regenerated when the grammar
+        changes. A picklefile is replaced atomically, so that processes
+        starting at the same time never read a partial one; if its
+        directory cannot be written, the tables are not kept.
+        """
+        if cls.lr_parser is None:
+            if picklefile is not None:
+                cls.lr_parser = cls._pickled_lr_parser(picklefile)
+            else:
+                cls.lr_parser = yacc.yacc(module=cls(), debug=False,
+                                          optimize=False,
+                                          write_tables=write_tables)
+        return cls.lr_parser
+
+    @classmethod
+    def _pickled_lr_parser(cls, picklefile):
+        """Build the parser from a private copy of picklefile, which yacc
+        regenerates if it is missing, stale or unreadable, and move the copy
+        over picklefile."""
+        try:
+            fd, tmp = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(picklefile)),
+                suffix='.tmp')
+        except OSError:
+            return yacc.yacc(module=cls(), debug=False, optimize=False,
+                             write_tables=False)
+        os.close(fd)
+        try:
+            try:
+                shutil.copyfile(picklefile, tmp)
+            except IOError:
+                # yacc generates the tables of a missing file
+                os.remove(tmp)
+            try:
+                lr_parser = yacc.yacc(module=cls(), debug=False,
+                                      optimize=False, picklefile=tmp)
+            except Exception:
+                # e.g., a file truncated by a crash
+                os.remove(tmp)
+                lr_parser = yacc.yacc(module=cls(), debug=False,
+                                      optimize=False, picklefile=tmp)
+            if os.path.exists(tmp):
+                os.rename(tmp, picklefile)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return lr_parser
+
     @staticmethod
     def p_error(token):
         if token:
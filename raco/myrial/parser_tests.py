@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from raco.myrial.parser import Parser, user_tables_file
+from raco.myrial.exceptions import MyrialCompileException
+import raco.types as types
+
+
+class ParseTablesTest(unittest.TestCase):
+
+    program = """
+    x = scan(public:adhoc:X);
+    y = [from x where a > 1 emit a, count(*)];
+    store(y, OUTPUT);
+    """
+
+    def setUp(self):
+        self.lr_parser = Parser.lr_parser
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        Parser.lr_parser = self.lr_parser
+        shutil.rmtree(self.directory)
+
+    def test_shared(self):
+        first = Parser()
+        second = Parser()
+        # emit arguments do not compare by value
+        self.assertEqual(repr(first.parse(self.program)),
+                         repr(second.parse(self.program)))
+        self.assertIs(first.get_lr_parser(), second.get_lr_parser())
+
+    def test_udas(self):
+        # the functions of a parse do not leak into the next one
+        program = "x = scan(public:adhoc:X); y = [from x emit f(a)];"
+        Parser().parse(program, udas=[('f', types.LONG_TYPE)])
+        with self.assertRaises(MyrialCompileException):
+            Parser().parse(program)
+
+    def test_picklefile(self):
+        picklefile = os.path.join(self.directory, 'parsetab.pickle')
+        expected = repr(Parser().parse(self.program))
+
+        Parser.lr_parser = None
+        Parser.get_lr_parser(picklefile=picklefile)
+        self.assertTrue(os.path.exists(picklefile))
+
+        # a later process reads the tables back
+        Parser.lr_parser = None
+        Parser.get_lr_parser(picklefile=picklefile)
+        self.assertEqual(repr(Parser().parse(self.program)), expected)
+
+        # a truncated file is regenerated
+        with open(picklefile, 'r+b') as f:
+            f.truncate(100)
+        Parser.lr_parser = None
+        Parser.get_lr_parser(picklefile=picklefile)
+        self.assertEqual(repr(Parser().parse(self.program)), expected)
+        self.assertGreater(os.path.getsize(picklefile), 100)
+        self.assertEqual(os.listdir(self.directory), ['parsetab.pickle'])
+
+    def test_user_tables_file(self):
+        environ = dict(os.environ)
+        try:
+            os.environ['XDG_CACHE_HOME'] = os.path.join(self.directory, 'a')
+            self.assertEqual(
+                user_tables_file(),
+                os.path.join(self.directory, 'a', 'raco',
+                             'myrial_parsetab.pickle'))
+            self.assertTrue(
+                os.path.isdir(os.path.join(self.directory, 'a', 'raco')))
+
+            # a cache directory that cannot be created
+            path = os.path.join(self.directory, 'file')
+            open(path, 'w').close()
+            os.environ['XDG_CACHE_HOME'] = path
+            self.assertIsNone(user_tables_file())
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
@@ -0,0 +1,174 @@
+"""A cache of compiled MyriaL programs.
+
+Compiling a program parses it, evaluates its statements into a logical plan
+and optimizes the plan with the rules of the target algebra. Programs that
+are submitted again and again, such as the templates of a dashboard, can
+skip all of it with a PlanCache.
+
+An entry is keyed by:
+- the normalized program: the repr of its parsed statements, which ignores
+  whitespace and comments,
+- the target algebra and the compiler arguments,
+- the fingerprint of the catalog (Catalog.fingerprint()), which changes
+  whenever the relations or functions the plans depend on change.
+Programs compiled against a catalog without a fingerprint are not cached.
+
+The cache keeps the most recently used entries in memory. If it is given a
+directory, it also writes each entry there with pickle, and reads back the
+entries it does not hold in memory, e.g., after a restart.
+"""
+
+import collections
+import copy
+import cPickle as pickle
+import hashlib
+import logging
+import os
+import tempfile
+
+LOG = logging.getLogger(__name__)
+
+# The compiled forms of a program: its physical plan and, for the Myria
+# algebras, its JSON encoding (or None)
+CompiledPlan = collections.namedtuple('CompiledPlan',
+                                      ['physical_plan', 'json'])
+
+
+def normalize_program(statements):
+    """Return the normalized text of a parsed program, or None if the
+    statements cannot be represented faithfully."""
+    text = repr(statements)
+    # objects without a repr of their value
+    if ' object at 0x' in text:
+        return None
+    return text
+
+
+def target_key(target, kwargs):
+    """Identify a target, i.e., an algebra or the name of a target, and the
+    compiler arguments."""
+    if not isinstance(target, basestring):
+        target = '{}.{}'.format(type(target).__module__,
+                                type(target).__name__)
+    args = sorted((k, repr(v)) for k, v in kwargs.items()
+                  if k not in ('target', 'target_alg'))
+    return (target, tuple(args))
+
+
+class PlanCache(object):
+    """An LRU cache of CompiledPlans, optionally backed by a directory."""
+
+    def __init__(self, max_size=256, directory=None):
+        assert max_size > 0
+        self.max_size = max_size
+        self.directory = directory
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.entries = collections.OrderedDict()
+        # The normalized key of each raw program text, to skip parsing
+        self.normalized = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(normalized_program, target, kwargs, fingerprint):
+        """Return the key of a compiled program, or None if it cannot be
+        cached."""
+        if normalized_program is None or fingerprint is None:
+            return None
+        return repr((normalized_program, target_key(target, kwargs),
+                     fingerprint))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries or (
+            self.directory is not None and os.path.exists(self.path(key)))
+
+    def path(self, key):
+        digest = hashlib.sha1(key).hexdigest()
+        return os.path.join(self.directory, digest + '.plan')
+
+    def get(self, key):
+        """Return a copy of the CompiledPlan of a key, or None."""
+        if key is None:
+            return None
+        entry = self.entries.pop(key, None)
+        if entry is None and self.directory is not None:
+            entry = self.read(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.remember(key, entry)
+        # the caller may modify the plan or its JSON encoding
+        return copy.deepcopy(entry)
+
+    def put(self, key, entry):
+        """Cache a CompiledPlan."""
+        if key is None:
+            return
+        assert isinstance(entry, CompiledPlan)
+        entry = copy.deepcopy(entry)
+        self.entries.pop(key, None)
+        self.remember(key, entry)
+        if self.directory is not None:
+            self.write(key, entry)
+
+    def remember(self, key, entry):
+        self.entries[key] = entry
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def read(self, key):
+        try:
+            with open(self.path(key), 'rb') as f:
+                stored_key, entry = pickle.load(f)
+        except IOError:
+            return None
+        except Exception as e:
+            # e.g., a truncated file, or the classes of the plan changed
+            LOG.warning('Ignoring a cached plan that cannot be read: %s', e)
+            return None
+        # a collision of the file names
+        if stored_key != key:
+            return None
+        return entry
+
+    def write(self, key, entry):
+        try:
+            data = pickle.dumps((key, entry), pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            LOG.debug('Not writing a plan that cannot be pickled: %s', e)
+            return
+        # write a temporary file, then rename it over the entry, so that
+        # readers never see a partial entry
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, self.path(key))
+
+    def get_normalized(self, source):
+        """Return the normalized program of a source, i.e., the raw text of
+        a program and the definitions it was parsed with, that was compiled
+        before, or None."""
+        normalized = self.normalized.pop(source, None)
+        if normalized is not None:
+            self.normalized[source] = normalized
+        return normalized
+
+    def put_normalized(self, source, normalized):
+        self.normalized.pop(source, None)
+        self.normalized[source] = normalized
+        while len(self.normalized) > self.max_size:
+            self.normalized.popitem(last=False)
+
+    def clear(self):
+        """Remove all the entries, including those on disk."""
+        self.entries.clear()
+        self.normalized.clear()
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith('.plan'):
+                    os.remove(os.path.join(self.directory, name))
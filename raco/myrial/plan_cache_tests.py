@@ -0,0 +1,140 @@
+import collections
+import shutil
+import tempfile
+import unittest
+
+from raco.backends.cpp import CCAlgebra
+from raco.catalog import Catalog
+import raco.fakedb
+import raco.myrial.interpreter as interpreter
+from raco.myrial.plan_cache import PlanCache
+import raco.scheme as scheme
+from raco import types
+
+
+class PlanCacheTest(unittest.TestCase):
+
+    program = """
+    x = scan(public:adhoc:X);
+    y = [from x where a > 1 emit a, count(*)];
+    store(y, OUTPUT);
+    """
+
+    # the same program, formatted differently
+    reformatted = """x = scan(public:adhoc:X);  -- the input
+    y = [from x where a>1 emit a, count(*)]; store(y, OUTPUT);"""
+
+    schema = scheme.Scheme([("a", types.LONG_TYPE), ("b", types.LONG_TYPE)])
+
+    def setUp(self):
+        self.db = raco.fakedb.FakeDatabase()
+        self.db.ingest("public:adhoc:X",
+                       collections.Counter([(1, 2), (3, 4)]), self.schema)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def compile(self, cache, program=None, catalog=None, **kwargs):
+        return interpreter.compile_program(program or self.program,
+                                           catalog or self.db,
+                                           cache=cache, **kwargs)
+
+    def test_no_cache(self):
+        compiled = self.compile(None)
+        self.assertEqual(compiled.json['rawQuery'], self.program)
+        self.assertEqual(
+            compiled.json['plan'],
+            interpreter.compile_program(self.program, self.db).json['plan'])
+
+    def test_hit(self):
+        cache = PlanCache()
+        first = self.compile(cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+        second = self.compile(cache)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(second, first)
+        # the cache returns copies
+        self.assertIsNot(second.physical_plan, first.physical_plan)
+
+        # whitespace and comments are normalized away
+        third = self.compile(cache, self.reformatted)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        self.assertEqual(third.physical_plan, first.physical_plan)
+        self.assertEqual(third.json['rawQuery'], self.reformatted)
+
+    def test_key(self):
+        cache = PlanCache()
+        self.compile(cache)
+        # other compiler arguments
+        self.compile(cache, push_sql=False)
+        # another algebra
+        compiled = self.compile(cache, target_alg=CCAlgebra())
+        self.assertIsNone(compiled.json)
+        self.assertEqual((cache.hits, cache.misses), (0, 3))
+
+        # the catalog changes
+        self.db.ingest("public:adhoc:Y", collections.Counter([(1, 2)]),
+                       self.schema)
+        self.compile(cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 4))
+        self.compile(cache, push_sql=False)
+        self.assertEqual((cache.hits, cache.misses), (0, 5))
+        self.compile(cache)
+        self.assertEqual((cache.hits, cache.misses), (1, 5))
+
+    def test_no_fingerprint(self):
+        class Unversioned(Catalog):
+            def __init__(self, db):
+                self.db = db
+
+            def get_scheme(self, rel_key):
+                return self.db.get_scheme(rel_key)
+
+            def num_tuples(self, rel_key):
+                return self.db.num_tuples(rel_key)
+
+            def get_num_servers(self):
+                return self.db.get_num_servers()
+
+            def partitioning(self, rel_key):
+                return self.db.partitioning(rel_key)
+
+        cache = PlanCache()
+        self.compile(cache, catalog=Unversioned(self.db))
+        self.compile(cache, catalog=Unversioned(self.db))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.hits, 0)
+
+    def test_lru(self):
+        cache = PlanCache(max_size=2)
+        programs = [self.program.replace('a > 1', 'a > {}'.format(i))
+                    for i in range(3)]
+        for program in programs:
+            self.compile(cache, program)
+        self.assertEqual(len(cache), 2)
+        # the least recently used program was evicted
+        self.compile(cache, programs[0])
+        self.assertEqual(cache.hits, 0)
+        self.compile(cache, programs[2])
+        self.assertEqual(cache.hits, 1)
+
+    def test_disk(self):
+        cache = PlanCache(max_size=1, directory=self.directory)
+        first = self.compile(cache)
+        self.compile(cache, self.program.replace('a > 1', 'a > 2'))
+
+        # evicted from memory, but read back from disk
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(self.compile(cache), first)
+        self.assertEqual(cache.hits, 1)
+
+        # by another cache, e.g., after a restart
+        other = PlanCache(directory=self.directory)
+        self.assertEqual(self.compile(other), first)
+        self.assertEqual((other.hits, other.misses), (1, 0))
+
+        other.clear()
+        self.compile(other)
+        self.assertEqual((other.hits, other.misses), (1, 1))
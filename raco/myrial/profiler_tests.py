@@ -0,0 +1,44 @@
+import raco.profiler
+from raco.myrial import query_tests, pagerank_test
+
+
+class ProfiledQueryTests(query_tests.TestQueryFunctions):
+    """Run the query tests with every operator profiled."""
+
+    def create_db(self):
+        return raco.profiler.ProfilingDatabase()
+
+
+class ProfiledPageRankTest(pagerank_test.PageRankTest):
+
+    def create_db(self):
+        return raco.profiler.ProfilingDatabase(incremental_loops=True)
+
+    def test_analyze(self):
+        self.test_pagerank()
+        plan = self.processor.get_physical_plan()
+        self.db.reset_profile()
+        self.db.evaluate(plan)
+
+        profile = self.db.get_profile(plan)
+        loops = [s for s in profile.values()
+                 if s['operator'].opname() == 'DoWhile']
+        self.assertEquals(len(loops), 1)
+        self.assertEquals(loops[0]['calls'], 1)
+
+        joins = [s for s in profile.values()
+                 if s['operator'].opname() == 'MyriaSymmetricHashJoin']
+        # Vertex JOIN Edge does not depend on the loop and is evaluated
+        # once, the joins with PageRank in every iteration.
+        calls = sorted(s['calls'] for s in joins)
+        self.assertEquals(calls[0], 1)
+        self.assertGreater(calls[-1], 1)
+        for s in joins:
+            self.assertGreater(s['peak_materialized'], 0)
+            self.assertGreater(s['tuples_out'], 0)
+            self.assertGreater(s['tuples_in'], 0)
+
+        lines = self.db.explain(plan).split('\n')
+        self.assertEquals(len(lines), len(profile))
+        self.assertTrue(all('(never executed)' not in line
+                            for line in lines))
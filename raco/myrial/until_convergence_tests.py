@@ -0,0 +1,194 @@
+
+import collections
+
+import raco.fakedb
+import raco.scheme as scheme
+import raco.myrial.myrial_test as myrial_test
+from raco import types
+
+
+class CountingDatabase(raco.fakedb.FakeDatabase):
+    """A FakeDatabase that counts the scans of each temporary table."""
+
+    def __init__(self):
+        super(CountingDatabase, self).__init__()
+        self.scans = collections.Counter()
+
+    def scantemp(self, op):
+        self.scans[op.name] += 1
+        return super(CountingDatabase, self).scantemp(op)
+
+
+class UntilConvergenceTest(myrial_test.MyrialTestCase):
+
+    edge_table = collections.Counter([
+        (1, 2),
+        (2, 3),
+        (3, 4),
+        (4, 3),
+        (3, 5),
+        (4, 13),
+        (5, 4),
+        (1, 9),
+        (7, 1),
+        (6, 1),
+        (10, 11),
+        (11, 12),
+        (12, 10),
+        (13, 4),
+        (10, 1)])
+
+    edge_schema = scheme.Scheme([("src", types.LONG_TYPE),
+                                 ("dst", types.LONG_TYPE)])
+    edge_key = "public:adhoc:edges"
+
+    def create_db(self):
+        return CountingDatabase()
+
+    def setUp(self):
+        super(UntilConvergenceTest, self).setUp()
+
+        self.db.ingest(UntilConvergenceTest.edge_key,
+                       UntilConvergenceTest.edge_table,
+                       UntilConvergenceTest.edge_schema)
+
+    def transitive_closure(self):
+        closure = set(UntilConvergenceTest.edge_table)
+        while True:
+            new = set((a, d) for (a, b) in closure for (c, d) in closure
+                      if b == c)
+            if new <= closure:
+                return closure
+            closure |= new
+
+    def connected_components(self):
+        """Propagate the minimum node id along the edges."""
+        edges = UntilConvergenceTest.edge_table
+        cc = dict((src, src) for (src, _) in edges)
+        while True:
+            new = dict(cc)
+            for src, dst in edges:
+                if src in cc and cc[src] < new.get(dst, cc[src] + 1):
+                    new[dst] = cc[src]
+            if new == cc:
+                return collections.Counter(cc.items())
+            cc = new
+
+    reachable_query = """
+    E = scan(public:adhoc:edges);
+    do
+        Reach = [src, dst] <-
+                [from E emit E.src, E.dst] +
+                [from Reach, E where Reach.dst = E.src
+                 emit Reach.src, E.dst];
+    until convergence {mode};
+    store(Reach, OUTPUT);
+    """
+
+    cc_query = """
+    E = scan(public:adhoc:edges);
+    V = select distinct E.src as x from E;
+    do
+        CC = [nid, MIN(cid) as cid] <-
+             [from V emit V.x as nid, V.x as cid] +
+             [from E, CC where E.src = CC.nid emit E.dst as nid, CC.cid];
+    until convergence {mode};
+    store(CC, OUTPUT);
+    """
+
+    def test_reachable(self):
+        expected = collections.Counter(self.transitive_closure())
+        for mode in ["", "sync", "async pull_idb"]:
+            self.new_processor()
+            self.check_result(self.reachable_query.format(mode=mode),
+                              expected, test_logical=True)
+
+    def test_nonlinear_reachable(self):
+        query = """
+        E = scan(public:adhoc:edges);
+        do
+            Reach = [src, dst] <-
+                    [from E emit E.src, E.dst] +
+                    [from Reach as R1, Reach as R2 where R1.dst = R2.src
+                     emit R1.src, R2.dst];
+        until convergence;
+        store(Reach, OUTPUT);
+        """
+        expected = collections.Counter(self.transitive_closure())
+        self.check_result(query, expected, test_logical=True)
+
+    def test_connected_components(self):
+        expected = self.connected_components()
+        for mode in ["", "sync", "async", "pull_idb", "build_edb"]:
+            self.new_processor()
+            self.check_result(self.cc_query.format(mode=mode),
+                              expected, test_logical=True)
+
+    def test_myria_plan(self):
+        """Evaluate the Myria physical plan, which stores the IDB from its
+        IDBController."""
+        expected = self.connected_components()
+        for mode in ["sync", "async build_edb"]:
+            self.new_processor()
+            self.parse(self.cc_query.format(mode=mode))
+            self.db.evaluate(self.processor.get_physical_plan())
+            self.assertEquals(self.db.get_table('OUTPUT'), expected)
+
+    def test_count_filter(self):
+        """Count the number of nodes that reach each node."""
+        query = """
+        E = scan(public:adhoc:edges);
+        do
+            Reach = [src, dst] <-
+                    [from E emit E.src, E.dst] +
+                    [from Reach, E where Reach.dst = E.src
+                     emit Reach.src, E.dst];
+            Reached = [dst, COUNT(*) as num] <-
+                      [from Reach emit Reach.dst];
+        until convergence;
+        Popular = [from Reached where num >= 5 emit dst, num];
+        store(Popular, OUTPUT);
+        """
+        counts = collections.Counter(dst for (_, dst)
+                                     in self.transitive_closure())
+        expected = collections.Counter(
+            (dst, num) for dst, num in counts.items() if num >= 5)
+        self.check_result(query, expected, test_logical=True)
+
+    def test_non_incremental_input(self):
+        """A recursive input with an aggregate reads the whole IDB."""
+        query = """
+        E = scan(public:adhoc:edges);
+        do
+            Reach = [src, dst] <-
+                    [from E emit E.src, E.dst] +
+                    [from Reach, E where Reach.dst = E.src
+                     emit Reach.src, E.dst];
+            Size = [src, MIN(num) as num] <-
+                   [from Reach emit Reach.src, 0 - COUNT(*) as num];
+        until convergence {mode};
+        store(Size, OUTPUT);
+        """
+        counts = collections.Counter(src for (src, _)
+                                     in self.transitive_closure())
+        expected = collections.Counter(
+            (src, -num) for src, num in counts.items())
+        for mode in ["sync", "async"]:
+            self.new_processor()
+            self.check_result(query.format(mode=mode), expected,
+                              test_logical=True)
+
+    def test_build_edb_hashes_once(self):
+        """The EDB input of a recursive join is scanned once."""
+        expected = self.connected_components()
+        self.parse(self.cc_query.format(mode="build_edb"))
+        self.db.evaluate(self.processor.get_physical_plan())
+        self.assertEquals(self.db.get_table('OUTPUT'), expected)
+        self.assertEquals(self.db.scans['E'], 2)  # V and the join
+
+        self.db.scans.clear()
+        self.new_processor()
+        self.parse(self.cc_query.format(mode="pull_idb"))
+        self.db.evaluate(self.processor.get_physical_plan())
+        self.assertEquals(self.db.get_table('OUTPUT'), expected)
+        self.assertGreater(self.db.scans['E'], 2)
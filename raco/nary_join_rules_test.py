@@ -1,9 +1,16 @@
 from nose.plugins.skip import SkipTest
+import itertools
+import random
 import unittest
 import algebra
 from raco import RACompiler
 from raco.catalog import FakeCatalog
 from raco.backends import myria as myrialang
+from raco.expression import UnnamedAttributeRef as AttIndex
+from raco.relation_key import RelationKey
+from raco.statistics import ColumnStatistics
+import raco.scheme as scheme
+from raco import types
 
 
 class testNaryJoin(unittest.TestCase):
@@ -159,3 +166,138 @@ class testNaryJoin(unittest.TestCase):
         # note: there is more than one optimal [4,4,4,4] or [1,16,1,16] etc.
         self.assertEqual(get_work_load(rect_join, [4, 4, 4, 4]),
                          get_work_load(rect_join, get_dim_size(rect_join)))
+
+    @staticmethod
+    def triangle(sizes, statistics=None):
+        """R(x,y), S(y,z), T(z,x) as an NaryJoin of scans"""
+        sch = scheme.Scheme([("a", types.LONG_TYPE),
+                             ("b", types.LONG_TYPE)])
+        children = [algebra.Scan(RelationKey.from_string(
+                                 "public:adhoc:" + name), sch, size,
+                                 statistics=statistics)
+                    for name, size in zip("RST", sizes)]
+        conditions = [[AttIndex(0), AttIndex(5)], [AttIndex(1), AttIndex(2)],
+                      [AttIndex(3), AttIndex(4)]]
+        return algebra.NaryJoin(children, conditions)
+
+    def test_agm_bound(self):
+        # the triangle query outputs at most N^(3/2) tuples
+        self.assertEqual(self.triangle([100, 100, 100]).num_tuples(), 1000)
+        self.assertEqual(self.triangle([100, 10000, 100]).num_tuples(),
+                         10000)
+
+        # no better bound than the cross product for R(x,y), S(z,p)
+        sch = scheme.Scheme([("a", types.LONG_TYPE)] * 2)
+        cross = algebra.NaryJoin(
+            [algebra.Scan(RelationKey.from_string("public:adhoc:R"), sch,
+                          100),
+             algebra.Scan(RelationKey.from_string("public:adhoc:S"), sch,
+                          50)], [])
+        self.assertEqual(cross.num_tuples(), 5000)
+
+        # the parents of the join see the bound
+        shuffle = algebra.HyperCubeShuffle(self.triangle([100, 100, 100]))
+        self.assertEqual(shuffle.num_tuples(), 1000)
+
+    def test_statistics_estimate(self):
+        # every join column has 100 distinct values: 100^3 / 100^3
+        stats = [ColumnStatistics(100), ColumnStatistics(100)]
+        self.assertEqual(
+            self.triangle([100, 100, 100], stats).num_tuples(), 1)
+        # the estimate never exceeds the AGM bound
+        stats = [ColumnStatistics(1), ColumnStatistics(1)]
+        self.assertEqual(
+            self.triangle([100, 100, 100], stats).num_tuples(), 1000)
+
+    def test_hyper_cube_dim_size(self):
+        join = self.triangle([100, 100, 100])
+        child_schemes = [c.scheme() for c in join.children()]
+        conditions = myrialang.convert_nary_conditions(
+            join.conditions, child_schemes)
+        HSClass = myrialang.HCShuffleBeforeNaryJoin
+        r_index = HSClass.reversed_index(child_schemes, conditions)
+
+        dim_sizes, workload = HSClass.get_hyper_cube_dim_size(
+            64, [100, 100, 100], conditions, r_index)
+        self.assertEqual(dim_sizes, (4, 4, 4))
+        self.assertEqual(workload, 3 * 100 / 16.0)
+        # each cell joins 100/16 tuples of each child
+        self.assertAlmostEqual(
+            HSClass.local_join_bound(dim_sizes, [100, 100, 100], r_index),
+            (100 / 16.0) ** 1.5)
+
+    def test_dim_size_optimum(self):
+        """The pruned search finds the least workload of all the dimension
+        sizes"""
+        HSClass = myrialang.HCShuffleBeforeNaryJoin
+        rand = random.Random(42)
+
+        def all_dim_sizes(num_dims, num_server):
+            if num_dims == 0:
+                yield ()
+                return
+            for size in range(1, num_server + 1):
+                for rest in all_dim_sizes(num_dims - 1, num_server // size):
+                    yield (size,) + rest
+
+        # (child, column) of each variable of a triangle, a chain of 3
+        # relations and a 4-cycle with a self join column
+        queries = [[[(0, 0), (2, 1)], [(0, 1), (1, 0)], [(1, 1), (2, 0)]],
+                   [[(0, 1), (1, 0)], [(1, 1), (2, 0)]],
+                   [[(0, 0), (3, 1)], [(0, 1), (1, 0), (1, 1)],
+                    [(1, 2), (2, 0)], [(2, 1), (3, 0)]]]
+        widths = [[2, 2, 2], [2, 2, 2], [2, 3, 2, 2]]
+        for conditions, child_widths in zip(queries, widths):
+            child_schemes = [[None] * w for w in child_widths]
+            r_index = HSClass.reversed_index(child_schemes, conditions)
+            for num_server in [1, 7, 16, 30, 64]:
+                for _ in range(5):
+                    child_sizes = [rand.choice([0, 1, 10, 1000, 50000])
+                                   for _ in child_widths]
+                    dim_sizes, workload = HSClass.get_hyper_cube_dim_size(
+                        num_server, child_sizes, conditions, r_index)
+                    self.assertLessEqual(reduce(lambda a, b: a * b,
+                                                dim_sizes), num_server)
+                    self.assertEqual(workload, HSClass.workload(
+                        dim_sizes, child_sizes, r_index))
+                    best = min(
+                        HSClass.workload(d, child_sizes, r_index)
+                        for d in all_dim_sizes(len(conditions), num_server))
+                    self.assertAlmostEqual(workload, best)
+
+    def test_cell_partition_arithmetic(self):
+        """The cell partition computed arithmetically matches the one
+        enumerated from every cell"""
+        HSClass = myrialang.HCShuffleBeforeNaryJoin
+
+        def enumerated(dim_sizes, conditions, child_schemes, child_idx,
+                       hashed_columns):
+            r_index = HSClass.reversed_index(child_schemes, conditions)
+            hashed_dims = [r_index[child_idx][c] for c in hashed_columns]
+            partition = {}
+            for coordinate in itertools.product(
+                    *[range(d) for d in dim_sizes]):
+                voxel = tuple(coordinate[d] for d in hashed_dims)
+                partition.setdefault(voxel, []).append(
+                    HSClass.coord_to_worker_id(coordinate, dim_sizes))
+            return [wid for vox, wid in sorted(partition.items())]
+
+        # the triangle, with a column joined to itself in the first child
+        conditions = [[(0, 0), (2, 1)], [(0, 1), (0, 2), (1, 0)],
+                      [(1, 1), (2, 0)]]
+        child_schemes = [[None] * 3, [None] * 2, [None] * 2]
+        hashed = [(0, 1, 2), (0, 1), (0, 1)]
+        for dim_sizes in [(1, 2, 2), (2, 3, 4), (3, 1, 5)]:
+            for child_idx, hashed_columns in enumerate(hashed):
+                self.assertEqual(
+                    HSClass.get_cell_partition(
+                        dim_sizes, conditions, child_schemes, child_idx,
+                        hashed_columns),
+                    enumerated(dim_sizes, conditions, child_schemes,
+                               child_idx, hashed_columns))
+
+        # T(z, x) is replicated along y
+        self.assertEqual(
+            HSClass.get_cell_partition([1, 2, 2], conditions,
+                                       child_schemes, 2, (0, 1)),
+            [[0, 2], [1, 3]])
@@ -1,4 +1,5 @@
 import unittest
+import math
 
 import raco.fakedb
 from raco.relation_key import RelationKey
@@ -147,3 +148,188 @@ class OperatorTest(unittest.TestCase):
         pj = ProjectingJoin(condition=BooleanLiteral(True),
                             left=emp, right=emp1, output_columns=refs)
         self.assertEquals(emp.scheme().get_names(), pj.scheme().get_names())
+
+    def _nested_loop_join(self, predicate):
+        emp = TestQueryFunctions.emp_table
+        return collections.Counter(
+            x + y for x in emp.elements() for y in emp.elements()
+            if predicate(x, y))
+
+    def test_hash_join(self):
+        emp = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        emp1 = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        join = Join(EQ(UnnamedAttributeRef(1), UnnamedAttributeRef(5)),
+                    emp, emp1)
+        expected = self._nested_loop_join(lambda x, y: x[1] == y[1])
+        self.assertEquals(self.db.evaluate_to_bag(join), expected)
+
+    def test_hash_join_build_left(self):
+        emp = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema,
+                   cardinality=1)
+        emp1 = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        join = Join(EQ(UnnamedAttributeRef(5), UnnamedAttributeRef(1)),
+                    emp, emp1)
+        expected = self._nested_loop_join(lambda x, y: x[1] == y[1])
+        self.assertEquals(self.db.evaluate_to_bag(join), expected)
+
+    def test_hash_join_residual(self):
+        emp = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        emp1 = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        cond = AND(EQ(NamedAttributeRef("dept_id"),
+                      NamedAttributeRef("dept_id1")),
+                   AND(LT(UnnamedAttributeRef(0), UnnamedAttributeRef(4)),
+                       EQ(UnnamedAttributeRef(3), UnnamedAttributeRef(3))))
+        join = Join(cond, emp, emp1)
+        expected = self._nested_loop_join(
+            lambda x, y: x[1] == y[1] and x[0] < y[0])
+        self.assertEquals(self.db.evaluate_to_bag(join), expected)
+
+    def test_hash_join_expression_keys(self):
+        emp = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        emp1 = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        cond = EQ(UnnamedAttributeRef(4),
+                  PLUS(UnnamedAttributeRef(0), NumericLiteral(1)))
+        pj = ProjectingJoin(cond, emp, emp1,
+                            [UnnamedAttributeRef(0), UnnamedAttributeRef(4)])
+        expected = collections.Counter(
+            (x[0], x[0] + 1) for x in TestQueryFunctions.emp_table
+            if x[0] < 7)
+        self.assertEquals(self.db.evaluate_to_bag(pj), expected)
+
+    def test_theta_join(self):
+        emp = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        emp1 = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        join = Join(LT(UnnamedAttributeRef(3), UnnamedAttributeRef(7)),
+                    emp, emp1)
+        expected = self._nested_loop_join(lambda x, y: x[3] < y[3])
+        self.assertEquals(self.db.evaluate_to_bag(join), expected)
+
+    edge_table = collections.Counter([
+        (1, 2), (2, 3), (3, 1), (1, 3), (3, 4), (4, 1), (2, 3), (4, 4)])
+
+    edge_schema = scheme.Scheme([("src", types.LONG_TYPE),
+                                 ("dst", types.LONG_TYPE)])
+
+    edge_key = relation_key.RelationKey.from_string("public:adhoc:edges")
+
+    def _edges(self):
+        self.db.ingest(self.edge_key, self.edge_table, self.edge_schema)
+        return Scan(self.edge_key, self.edge_schema)
+
+    def test_nary_join_triangle(self):
+        # A(x,y,z) :- E(x,y), E(y,z), E(z,x)
+        children = [self._edges(), self._edges(), self._edges()]
+        conds = [[UnnamedAttributeRef(0), UnnamedAttributeRef(5)],
+                 [UnnamedAttributeRef(1), UnnamedAttributeRef(2)],
+                 [UnnamedAttributeRef(3), UnnamedAttributeRef(4)]]
+        edges = list(self.edge_table.elements())
+        expected = collections.Counter(
+            a + b + c for a in edges for b in edges for c in edges
+            if a[1] == b[0] and b[1] == c[0] and c[1] == a[0])
+        result = self.db.evaluate_to_bag(NaryJoin(children, conds))
+        self.assertEquals(result, expected)
+
+    def test_nary_join_repeated_and_free_columns(self):
+        # A(x,y,z) :- E(x,x), E(x,y), E(z,w)
+        children = [self._edges(), self._edges(), self._edges()]
+        conds = [[UnnamedAttributeRef(0), UnnamedAttributeRef(1),
+                  UnnamedAttributeRef(2)]]
+        edges = list(self.edge_table.elements())
+        expected = collections.Counter(
+            a + b + c for a in edges for b in edges for c in edges
+            if a[0] == a[1] == b[0])
+        result = self.db.evaluate_to_bag(NaryJoin(children, conds))
+        self.assertEquals(result, expected)
+
+    def test_leapfrog_join_output_columns(self):
+        from raco.backends.myria import MyriaLeapFrogJoin
+        children = [self._edges(), self._edges()]
+        conds = [[UnnamedAttributeRef(1), UnnamedAttributeRef(2)]]
+        out = [UnnamedAttributeRef(0), UnnamedAttributeRef(3)]
+        edges = list(self.edge_table.elements())
+        expected = collections.Counter(
+            (a[0], b[1]) for a in edges for b in edges if a[1] == b[0])
+        result = self.db.evaluate_to_bag(
+            MyriaLeapFrogJoin(children, conds, out))
+        self.assertEquals(result, expected)
+
+    def test_streaming_group_by(self):
+        emp = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        salary = UnnamedAttributeRef(3)
+        aggs = [COUNTALL(), COUNT(salary), SUM(salary), AVG(salary),
+                MIN(salary), MAX(salary), STDEV(salary)]
+        gb = GroupBy([UnnamedAttributeRef(1)], aggs, emp)
+
+        def stdev(xs):
+            mean = float(sum(xs)) / len(xs)
+            return math.sqrt(sum((x - mean) ** 2 for x in xs) / len(xs))
+
+        result = self.db.evaluate_to_bag(gb)
+        self.assertEquals(len(result), 3)
+        for row in result:
+            xs = [t[3] for t in TestQueryFunctions.emp_table if t[1] == row[0]]
+            self.assertEquals(
+                row[:7], (row[0], len(xs), len(xs), sum(xs),
+                          sum(xs) / len(xs), min(xs), max(xs)))
+            self.assertAlmostEqual(row[7], stdev(xs) if len(xs) > 1 else 0.0)
+
+    def test_streaming_group_by_empty_input(self):
+        emp = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        empty = Select(EQ(UnnamedAttributeRef(0), NumericLiteral(0)), emp)
+        salary = UnnamedAttributeRef(3)
+        gb = GroupBy([], [COUNTALL(), SUM(salary)], empty)
+        self.assertEquals(self.db.evaluate_to_bag(gb),
+                          collections.Counter([(0, 0)]))
+
+        gb = GroupBy([UnnamedAttributeRef(1)], [COUNTALL()], empty)
+        self.assertEquals(self.db.evaluate_to_bag(gb), collections.Counter())
+
+    def test_orderby_mixed_directions(self):
+        emp = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        ob = OrderBy(emp, [3, 1, 0], [False, True, False])
+        expected = sorted(TestQueryFunctions.emp_table.elements(),
+                          key=lambda t: (-t[3], t[1], -t[0]))
+        self.assertEquals(list(self.db.evaluate(ob)), expected)
+
+    def test_topk(self):
+        emp = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        for cols, asc in [([3], [True]), ([3, 0], [False, False]),
+                          ([3, 2], [False, True])]:
+            ob = OrderBy(emp, cols, asc)
+            for count in [0, 3, 10]:
+                topk = TopK(emp, count, cols, asc)
+                expected = list(self.db.evaluate(Limit(count, ob)))
+                self.assertEquals(list(self.db.evaluate(topk)), expected)
+                self.assertEquals(
+                    expected, list(self.db.evaluate(ob))[:count])
+
+    def test_limit_orderby_to_topk(self):
+        from raco.backends.logical import OptLogicalAlgebra
+        from raco.compile import optimize
+
+        emp = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        plan = Store(RelationKey("OUTPUT"),
+                     Limit(2, OrderBy(emp, [3, 0], [False, True])))
+        plan = optimize(plan, OptLogicalAlgebra())
+        self.assertEquals(plan.input, TopK(emp, 2, [3, 0], [False, True]))
+
+        self.db.evaluate(plan)
+        self.assertEquals(self.db.get_table("OUTPUT"),
+                          collections.Counter([(2, 1, "Dan Halperin", 90000),
+                                               (6, 3, "Dan Suciu", 90000)]))
+
+    def test_clone_operator(self):
+        emp = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        condition = GT(UnnamedAttributeRef(3), NumericLiteral(10000))
+        plan = Store(RelationKey("OUTPUT"), Select(condition, emp))
+        clone = clone_operator(plan)
+        self.assertEquals(clone, plan)
+
+        # operators and expressions are copied ...
+        self.assertIsNot(clone.input, plan.input)
+        self.assertIsNot(clone.input.condition, condition)
+        clone.input.condition.right.value = 50000
+        self.assertEquals(condition.right.value, 10000)
+        # ... the schemes and relation keys are shared
+        self.assertIs(clone.input.input.scheme(), emp.scheme())
+        self.assertIs(clone.relation_key, plan.relation_key)
@@ -418,6 +418,10 @@ class MyriaLPlatformTests(object):
         STORE(out, OUTPUT);
         """, "unionall_then_join")
 
+    def test_reorder_joins(self):
+        q = self.myrial_from_sql(["R2", "T2", "S2"], "reorder_joins")
+        self.check(q, "reorder_joins", reorder_joins=True)
+
     def test_join_of_two_unionalls(self):
         self.check_sub_tables("""
         T2 = SCAN(%(T2)s);
@@ -0,0 +1,240 @@
+"""Profile the operators of a plan evaluated by the FakeDatabase.
+
+A ProfilingDatabase is a FakeDatabase that records, for every operator it
+evaluates, the wall time spent in it, the number of tuples it reads and
+produces, and the largest number of tuples it materializes at once. After a
+plan has been evaluated, get_profile() returns these statistics next to the
+optimizer's num_tuples() estimate of each operator, and explain() prints
+the plan annotated with them (EXPLAIN ANALYZE).
+
+Time is measured while an operator is evaluated and while its output is
+pulled, so it includes the time of the operators below it; self_time
+excludes the time of its children. When the database is vectorized, the
+operators below a vectorized Select, Apply or GroupBy are evaluated by the
+vectorized executor and are not profiled separately. A Limit sorts the input
+of an OrderBy below it as a top-k; the OrderBy is profiled as producing the
+tuples the Limit keeps.
+"""
+
+import collections
+import timeit
+
+from raco import algebra
+from raco.fakedb import FakeDatabase
+
+
+def materialized_size(result):
+    """Return the number of tuples held by the output of an operator, or
+    None if the output is computed lazily."""
+    if hasattr(result, '__len__'):
+        return len(result)
+    if hasattr(result, '__length_hint__'):
+        # iterators over a materialized list, set or dict
+        return result.__length_hint__()
+    return None
+
+
+def plan_operators(plan):
+    """Yield the (depth, operator) pairs of a plan in pre-order."""
+    seen = set()
+    stack = [(0, plan)]
+    while stack:
+        depth, op = stack.pop()
+        if id(op) in seen:
+            continue
+        seen.add(id(op))
+        yield depth, op
+        stack.extend((depth + 1, child)
+                     for child in reversed(op.children()))
+
+
+def estimate_error(estimate, actual):
+    """The factor by which an estimate is off (the q-error), at least 1."""
+    estimate = max(estimate, 1)
+    actual = max(actual, 1)
+    return float(max(estimate, actual)) / min(estimate, actual)
+
+
+class OperatorProfile(object):
+    """The statistics of one operator, summed over all its evaluations."""
+
+    def __init__(self, op):
+        self.op = op
+        self.calls = 0
+        self.time = 0.0
+        self.tuples_out = 0
+        self.peak_materialized = None
+        # whether the operator is a statement, which produces no tuples
+        self.statement = False
+
+    def materialized(self, size):
+        if self.peak_materialized is None or size > self.peak_materialized:
+            self.peak_materialized = size
+
+
+class ProfilingDatabase(FakeDatabase):
+    """A FakeDatabase that profiles the operators it evaluates."""
+
+    # Operators that keep one state per output tuple until they produce
+    # their first tuple
+    grouping_operators = (algebra.GroupBy,)
+
+    def __init__(self, **kwargs):
+        super(ProfilingDatabase, self).__init__(**kwargs)
+        # OperatorProfiles, keyed by operator id
+        self.profiles = {}
+        # The operators being evaluated, innermost last
+        self.active = []
+
+    def reset_profile(self):
+        self.profiles = {}
+
+    def profile(self, op):
+        prof = self.profiles.get(id(op))
+        if prof is None:
+            prof = self.profiles[id(op)] = OperatorProfile(op)
+        return prof
+
+    def evaluate(self, op):
+        if any(active is op for active in self.active):
+            # e.g., a loop-invariant subplan evaluated to be materialized
+            return super(ProfilingDatabase, self).evaluate(op)
+        return self.run(op, super(ProfilingDatabase, self).evaluate)
+
+    def run(self, op, evaluate):
+        """Profile the evaluation of op by evaluate(op)."""
+        prof = self.profile(op)
+        prof.calls += 1
+        self.active.append(op)
+        start = timeit.default_timer()
+        try:
+            result = evaluate(op)
+        finally:
+            prof.time += timeit.default_timer() - start
+            self.active.pop()
+
+        if result is None:
+            prof.statement = True
+            self.profile_statement(op, prof)
+            return None
+        size = materialized_size(result)
+        if size is not None:
+            prof.materialized(size)
+        return self.pull(prof, iter(result))
+
+    def pull(self, prof, it):
+        """Count and time the tuples pulled from an operator."""
+        op = prof.op
+        while True:
+            self.active.append(op)
+            start = timeit.default_timer()
+            try:
+                tpl = next(it)
+            except StopIteration:
+                if isinstance(op, self.grouping_operators):
+                    prof.materialized(prof.tuples_out)
+                return
+            finally:
+                prof.time += timeit.default_timer() - start
+                self.active.pop()
+            prof.tuples_out += 1
+            yield tpl
+
+    def limit(self, op):
+        child = op.input
+        if isinstance(child, algebra.OrderBy) and \
+                id(child) not in self.materialized:
+            # The Limit sorts the input of its OrderBy as a top-k: profile
+            # the OrderBy as producing the tuples the Limit keeps
+            parent = super(ProfilingDatabase, self)
+            return self.run(child, lambda _: parent.limit(op))
+        return super(ProfilingDatabase, self).limit(op)
+
+    def profile_statement(self, op, prof):
+        """Record the size of the table written by a statement."""
+        if isinstance(op, (algebra.StoreTemp, algebra.AppendTemp)):
+            prof.materialized(self.temp_tables.num_tuples(op.name))
+        elif isinstance(op, algebra.Store):
+            prof.materialized(self.tables.num_tuples(op.relation_key))
+
+    def hash_table(self, op, key):
+        table = super(ProfilingDatabase, self).hash_table(op, key)
+        # the join that builds the table is being evaluated
+        if self.active:
+            self.profile(self.active[-1]).materialized(
+                sum(len(tuples) for tuples in table.itervalues()))
+        return table
+
+    def get_profile(self, plan):
+        """Return the statistics of the operators of an evaluated plan.
+
+        The result is an OrderedDict in pre-order of the plan, keyed by
+        '<opname>#<position>'. Each value is a dict of the operator, its
+        depth in the plan, its num_tuples() estimate (None if the operator
+        does not estimate its output), the number of times it was evaluated,
+        its time and self_time in seconds, the tuples it read and produced
+        (None for statements, such as Store), its peak materialized size
+        (None if it only streams tuples), and the estimate error of its
+        average output per evaluation.
+        Operators that were never evaluated have 0 calls.
+        """
+        ret = collections.OrderedDict()
+        for position, (depth, op) in enumerate(plan_operators(plan)):
+            prof = self.profiles.get(id(op)) or OperatorProfile(op)
+            children = [self.profiles.get(id(child)) or OperatorProfile(child)
+                        for child in op.children()]
+            tuples_in = sum(c.tuples_out for c in children)
+            try:
+                estimate = op.num_tuples()
+            except NotImplementedError:
+                estimate = None
+
+            error = None
+            if estimate is not None and prof.calls and not prof.statement:
+                error = estimate_error(estimate,
+                                       float(prof.tuples_out) / prof.calls)
+
+            ret['{op}#{pos}'.format(op=op.opname(), pos=position)] = {
+                'operator': op,
+                'depth': depth,
+                'estimate': estimate,
+                'calls': prof.calls,
+                'time': prof.time,
+                'self_time': max(prof.time - sum(c.time for c in children),
+                                 0.0),
+                'tuples_in': tuples_in,
+                'tuples_out': None if prof.statement else prof.tuples_out,
+                'peak_materialized': prof.peak_materialized,
+                'estimate_error': error}
+        return ret
+
+    def explain(self, plan):
+        """Return the plan, one operator per line, annotated with its
+        estimated and actual statistics."""
+        lines = []
+        for stats in self.get_profile(plan).itervalues():
+            op = stats['operator']
+            if stats['calls'] == 0:
+                annotation = 'never executed'
+            else:
+                fields = []
+                if stats['estimate'] is not None:
+                    fields.append('est={0}'.format(stats['estimate']))
+                if stats['tuples_out'] is not None:
+                    fields.append('rows={0}'.format(stats['tuples_out']))
+                if stats['estimate_error'] is not None:
+                    fields.append(
+                        'err={0:.1f}x'.format(stats['estimate_error']))
+                fields.append('in={0}'.format(stats['tuples_in']))
+                if stats['peak_materialized'] is not None:
+                    fields.append(
+                        'peak={0}'.format(stats['peak_materialized']))
+                fields.append('calls={0}'.format(stats['calls']))
+                fields.append('time={0:.3f}ms'.format(stats['time'] * 1000))
+                fields.append(
+                    'self={0:.3f}ms'.format(stats['self_time'] * 1000))
+                annotation = ' '.join(fields)
+            lines.append('{indent}{op} ({annotation})'.format(
+                indent=' ' * (4 * stats['depth']), op=op.shortStr(),
+                annotation=annotation))
+        return '\n'.join(lines)
@@ -0,0 +1,123 @@
+import collections
+import unittest
+
+from raco.algebra import Scan, Select, GroupBy, Join, Store, OrderBy, Limit
+from raco.expression import *
+from raco.fake_data import FakeData
+from raco.myrial.interpreter import StatementProcessor
+from raco.myrial.parser import Parser
+from raco.profiler import ProfilingDatabase, estimate_error
+from raco.relation_key import RelationKey
+
+"""Test the profiling of operators evaluated by the FakeDatabase."""
+
+
+class ProfilerTest(unittest.TestCase, FakeData):
+
+    def setUp(self):
+        self.db = ProfilingDatabase()
+        self.db.ingest(FakeData.emp_key, FakeData.emp_table,
+                       FakeData.emp_schema)
+        self.db.ingest(FakeData.dept_key, FakeData.dept_table,
+                       FakeData.dept_schema)
+
+    def scan(self, key, schema):
+        return Scan(RelationKey.from_string(key), schema)
+
+    def test_profile(self):
+        emp = self.scan(FakeData.emp_key, FakeData.emp_schema)
+        dept = self.scan(FakeData.dept_key, FakeData.dept_schema)
+        select = Select(GT(NamedAttributeRef("salary"), NumericLiteral(5000)),
+                        emp)
+        join = Join(EQ(UnnamedAttributeRef(1), UnnamedAttributeRef(4)),
+                    select, dept)
+        groupby = GroupBy([UnnamedAttributeRef(5)], [COUNTALL()], join)
+        plan = Store(RelationKey("OUTPUT"), groupby)
+        self.db.evaluate(plan)
+
+        profile = self.db.get_profile(plan)
+        self.assertEquals(profile.keys(),
+                          ['Store#0', 'GroupBy#1', 'Join#2', 'Select#3',
+                           'Scan#4', 'Scan#5'])
+        stats = profile.values()
+        for depth, op, s in zip([0, 1, 2, 3, 4, 3], [plan, groupby, join,
+                                                     select, emp, dept],
+                                stats):
+            self.assertEquals(s['depth'], depth)
+            self.assertIs(s['operator'], op)
+            self.assertEquals(s['calls'], 1)
+            self.assertGreaterEqual(s['self_time'], 0.0)
+            self.assertLessEqual(s['self_time'], s['time'])
+
+        store, groupby, join, select, emp, dept = stats
+        self.assertEquals([s['tuples_out'] for s in stats],
+                          [None, 3, 5, 5, 7, 4])
+        self.assertEquals([s['tuples_in'] for s in stats],
+                          [3, 5, 9, 7, 0, 0])
+
+        # the output table, the groups and the hashed input of the join
+        self.assertEquals(store['peak_materialized'], 3)
+        self.assertEquals(groupby['peak_materialized'], 3)
+        self.assertIn(join['peak_materialized'], [4, 5])
+        self.assertIsNone(select['peak_materialized'])
+
+        self.assertEquals(emp['estimate'], select['estimate'] * 2)
+        self.assertEquals(select['estimate_error'],
+                          estimate_error(select['estimate'], 5))
+        self.assertIsNone(store['estimate_error'])
+
+    def test_repeated_evaluation(self):
+        emp = self.scan(FakeData.emp_key, FakeData.emp_schema)
+        limit = Limit(2, OrderBy(emp, [3], [False]))
+        for _ in range(3):
+            self.assertEquals(len(list(self.db.evaluate(limit))), 2)
+        profile = self.db.get_profile(limit)
+        self.assertEquals(profile['Limit#0']['calls'], 3)
+        self.assertEquals(profile['Limit#0']['tuples_out'], 6)
+        # the Limit evaluates its OrderBy as a top-k, which keeps the first
+        # tuples in a heap
+        self.assertIsNone(profile['Limit#0']['peak_materialized'])
+        self.assertEquals(profile['OrderBy#1']['peak_materialized'], 2)
+        self.assertEquals(profile['OrderBy#1']['calls'], 3)
+        self.assertEquals(profile['OrderBy#1']['tuples_out'], 6)
+        self.assertEquals(profile['OrderBy#1']['tuples_in'], 21)
+        self.assertEquals(profile['Limit#0']['tuples_in'], 6)
+        self.assertEquals(profile['Scan#2']['tuples_out'], 21)
+
+        self.db.reset_profile()
+        self.assertEquals(self.db.get_profile(limit)['Limit#0']['calls'], 0)
+
+    def test_explain(self):
+        emp = self.scan(FakeData.emp_key, FakeData.emp_schema)
+        limit = Limit(2, OrderBy(emp, [3], [False]))
+        self.assertEquals(collections.Counter(self.db.evaluate(limit)),
+                          collections.Counter([(2, 1, "Dan Halperin", 90000),
+                                               (6, 3, "Dan Suciu", 90000)]))
+        lines = self.db.explain(limit).split('\n')
+        self.assertEquals(len(lines), 3)
+        self.assertTrue(lines[0].startswith('Limit(2) (est=2 rows=2 '))
+        self.assertIn(' in=2 calls=1 time=', lines[0])
+        self.assertTrue(lines[1].startswith('    OrderBy(3-) ('))
+        self.assertIn(' rows=2 ', lines[1])
+        self.assertIn(' in=7 peak=2 calls=1 ', lines[1])
+        self.assertTrue(lines[2].startswith('        Scan('))
+        self.assertIn(' rows=7 ', lines[2])
+
+    def test_explain_logical_plan(self):
+        processor = StatementProcessor(self.db)
+        processor.evaluate(Parser().parse("""
+            x = scan({emp});
+            y = select * from x order by salary desc limit 3;
+            store(y, OUTPUT);""".format(emp=FakeData.emp_key)))
+        plan = processor.get_logical_plan()
+        self.db.evaluate(plan)
+        profile = self.db.get_profile(plan)
+        limit, = [s for s in profile.values()
+                  if s['operator'].opname() == 'Limit']
+        orderby, = [s for s in profile.values()
+                    if s['operator'].opname() == 'OrderBy']
+        self.assertEquals(limit['tuples_out'], 3)
+        self.assertEquals(limit['tuples_in'], 3)
+        self.assertEquals(orderby['calls'], 1)
+        self.assertEquals(orderby['tuples_in'], 7)
+        self.assertNotIn('never executed', self.db.explain(plan))
@@ -1,12 +1,14 @@
+import copy
 import re
 
-from raco import algebra, expression
+from raco import algebra, expression, statistics
 from raco.representation import RepresentationProperties
 from .expression import (accessed_columns, UnnamedAttributeRef,
                          rebase_local_aggregate_output, rebase_finalizer,
                          to_unnamed_recursive, StateVar, RANDOM)
 
 from abc import ABCMeta, abstractmethod
+import collections
 import itertools
 
 
@@ -29,6 +31,18 @@ class Rule(object):
         else:
             return self.fire(expr)
 
+    def rewrite(self, expr):
+        """Fire this rule and report whether it changed the expression tree.
+
+        Returns the possibly modified expression tree and a boolean. The
+        change is detected by comparing the signatures of the operator
+        before and after firing (see node_signature), so a rule that
+        modifies an operator in place in a way its signature does not show
+        must override this method."""
+        before = node_signature(expr)
+        new_expr = self(expr)
+        return new_expr, node_signature(new_expr) != before
+
     @classmethod
     def apply_disable_flags(cls, rule_list, *args):
         disabled_rules = set()
@@ -41,12 +55,45 @@ class Rule(object):
 
         for r in rule_list:
             r._disabled = r.__class__.__name__ in disabled_rules
+            if isinstance(r, FixpointGroup):
+                cls.apply_disable_flags(r.rules, *args)
 
     @abstractmethod
     def fire(self, expr):
         """Apply this rule to the supplied expression tree"""
 
 
+def node_signature(op):
+    """Summarize an operator and its children without stringifying the
+    whole subtree: the operator's type, its shortStr(), and the identities
+    and shortStr() of its children."""
+    children = op.children()
+    return (type(op), op.shortStr(), [id(c) for c in children],
+            [c.shortStr() for c in children])
+
+
+class FixpointGroup(Rule):
+
+    """A group of rules that is applied until none of them changes the
+    expression tree, or at most max_passes times.
+
+    The optimizer applies each rule of the group to the whole tree in turn,
+    as for a list of rules, but after the first pass it skips the subtrees
+    that no rule changed since the rule last left them unchanged."""
+
+    def __init__(self, rules, max_passes=10):
+        self.rules = rules
+        self.max_passes = max_passes
+        super(FixpointGroup, self).__init__()
+
+    def fire(self, expr):
+        from raco.compile import optimize_by_rules
+        return optimize_by_rules(expr, [self])
+
+    def __str__(self):
+        return "FixpointGroup(%s)" % ", ".join(str(r) for r in self.rules)
+
+
 class AbstractInterpretedValue:
 
     def __init__(self):
@@ -368,6 +415,23 @@ class RemoveTrivialSequences(Rule):
             return expr
 
 
+class LimitOrderByToTopK(Rule):
+
+    """Fuse a Limit over an OrderBy into a TopK, which keeps only the first
+    count tuples instead of sorting its whole input."""
+
+    def fire(self, op):
+        if op.__class__ == algebra.Limit and \
+                op.input.__class__ == algebra.OrderBy:
+            child = op.input
+            return algebra.TopK(child.input, op.count, child.sort_columns,
+                                child.ascending)
+        return op
+
+    def __str__(self):
+        return "Limit(OrderBy) => TopK"
+
+
 class SplitSelects(Rule):
 
     """Replace AND clauses with multiple consecutive selects."""
@@ -821,6 +885,380 @@ class SwapJoinSides(Rule):
         return "Join(L,R) => Join(R,L)"
 
 
+class CostBasedJoinOrder(Rule):
+
+    """Reorder a tree of joins and cross products into the left-deep join
+    order of least estimated cost.
+
+    The relations below the tree and the conjuncts of the join conditions
+    form a join graph. A Selinger-style dynamic program computes, for every
+    subset of the relations, the cheapest left-deep plan that joins them,
+    where the cost of a plan is the sum of the estimated sizes of its
+    intermediate results. A relation is joined without a join condition
+    (a cross product) only if no relation of the subset is connected to the
+    others. The sizes are estimated from the cardinalities of the relations,
+    taken from the catalog if one is given, and from the selectivities of
+    the conjuncts, estimated from the statistics of the columns they
+    compare when the relations have them.
+
+    Among plans of the same cost, the plan with fewer cross products is
+    preferred. The tree is only replaced if the new order is estimated to be
+    cheaper, and an Apply puts the columns back in their original order."""
+
+    def __init__(self, catalog=None, max_relations=10):
+        self.catalog = catalog
+        # the number of subsets grows exponentially with the relations
+        self.max_relations = max_relations
+        super(CostBasedJoinOrder, self).__init__()
+
+    @staticmethod
+    def is_join(op):
+        if isinstance(op, algebra.ProjectingJoin):
+            return op.output_columns is None
+        return isinstance(op, (algebra.Join, algebra.CrossProduct))
+
+    def cardinality(self, op):
+        """The estimated number of tuples of a relation of the join graph"""
+        if self.catalog is not None and isinstance(op, algebra.Scan):
+            return self.catalog.num_tuples(op.relation_key)
+        try:
+            return op.num_tuples()
+        except NotImplementedError:
+            return algebra.DEFAULT_CARDINALITY
+
+    @staticmethod
+    def selectivity(conjunct, cardinalities):
+        """Estimate the fraction of tuples that satisfy a conjunct of a join
+        condition, given the cardinalities of the relations it references.
+        """
+        if isinstance(conjunct, expression.EQ):
+            if len(cardinalities) == 2:
+                # assume that the join is on a key of the larger relation
+                return 1.0 / max(max(cardinalities), 1)
+            return 0.1
+        if isinstance(conjunct, (expression.LT, expression.LTEQ,
+                                 expression.GT, expression.GTEQ)):
+            return 1.0 / 3
+        return 0.1
+
+    def collect(self, op, offset, graph):
+        """Add the relations and the join conditions of a tree of joins to
+        the join graph. offset is the position of the first column of op in
+        the output of the whole tree. Returns the bitmask of the relations
+        below op."""
+        if not self.is_join(op):
+            graph['relations'].append(op)
+            graph['owners'].extend([len(graph['relations']) - 1] *
+                                   len(op.scheme()))
+            return 1 << (len(graph['relations']) - 1)
+
+        left = self.collect(op.left, offset, graph)
+        right = self.collect(op.right, offset + len(op.left.scheme()), graph)
+        if isinstance(op, algebra.Join) and op.condition is not None:
+            condition = to_unnamed_recursive(copy.deepcopy(op.condition),
+                                             op.scheme())
+            for conjunct in expression.extract_conjuncs(condition):
+                columns = accessed_columns(conjunct)
+                expression.reindex_expr(
+                    conjunct, {c: c + offset for c in columns})
+                mask = 0
+                for c in columns:
+                    mask |= 1 << graph['owners'][c + offset]
+                graph['conjuncts'].append((conjunct, mask))
+        graph['joins'].append((left, right))
+        return left | right
+
+    def fire(self, expr):
+        if not self.is_join(expr):
+            return expr
+
+        graph = {'relations': [], 'owners': [], 'conjuncts': [], 'joins': []}
+        self.collect(expr, 0, graph)
+        relations, conjuncts = graph['relations'], graph['conjuncts']
+        if len(relations) > self.max_relations:
+            return expr
+
+        cards = [float(max(self.cardinality(r), 1)) for r in relations]
+        selectivities = []
+        for conjunct, mask in conjuncts:
+            sel = statistics.selectivity(conjunct, expr.scheme(),
+                                         expr.column_statistics)
+            if sel is None:
+                referenced = [cards[i] for i in range(len(relations))
+                              if mask & (1 << i)]
+                sel = self.selectivity(conjunct, referenced)
+            selectivities.append(sel)
+
+        sizes = {}
+
+        def size(mask):
+            """The estimated size of the join of a subset of relations"""
+            if mask not in sizes:
+                ret = 1.0
+                for i, card in enumerate(cards):
+                    if mask & (1 << i):
+                        ret *= card
+                for (_, cmask), sel in zip(conjuncts, selectivities):
+                    if cmask & ~mask == 0:
+                        ret *= sel
+                sizes[mask] = ret
+            return sizes[mask]
+
+        def joins(left, right):
+            """Whether a join condition connects two sets of relations"""
+            return any(cmask & left and cmask & right and
+                       cmask & ~(left | right) == 0
+                       for (_, cmask) in conjuncts)
+
+        # best[mask] = (cost, number of cross products, order) of the
+        # cheapest left-deep plan that joins the relations in mask
+        best = {1 << i: (0.0, 0, [i]) for i in range(len(relations))}
+        for num in range(2, len(relations) + 1):
+            for subset in itertools.combinations(range(len(relations)), num):
+                mask = sum(1 << i for i in subset)
+                candidates = [i for i in subset
+                              if joins(1 << i, mask & ~(1 << i))]
+                for i in candidates or subset:
+                    cost, crosses, order = best[mask & ~(1 << i)]
+                    plan = (cost + size(mask), crosses + (not candidates),
+                            order + [i])
+                    if mask not in best or plan[:2] < best[mask][:2]:
+                        best[mask] = plan
+
+        cost, crosses, order = best[(1 << len(relations)) - 1]
+        current_cost = sum(size(left | right)
+                           for (left, right) in graph['joins'])
+        current_crosses = sum(not joins(left, right)
+                              for (left, right) in graph['joins'])
+        if not (cost < current_cost * (1 - 1e-9) or
+                (cost <= current_cost * (1 + 1e-9) and
+                 crosses < current_crosses)):
+            return expr
+
+        return self.build(expr, graph, order)
+
+    @staticmethod
+    def build(expr, graph, order):
+        """Build the left-deep tree that joins the relations in order"""
+        relations, conjuncts = graph['relations'], graph['conjuncts']
+        owners = graph['owners']
+
+        # the position of each column of the tree in the new tree
+        index_map = {}
+        for i in order:
+            for c, owner in enumerate(owners):
+                if owner == i:
+                    index_map[c] = len(index_map)
+
+        applied = set()
+        op = relations[order[0]]
+        placed = 1 << order[0]
+        for i in order[1:]:
+            placed |= 1 << i
+            condition = None
+            for k, (conjunct, mask) in enumerate(conjuncts):
+                if k in applied or mask & ~placed:
+                    continue
+                applied.add(k)
+                expression.reindex_expr(conjunct, index_map)
+                condition = (conjunct if condition is None
+                             else expression.AND(condition, conjunct))
+            if condition is None:
+                op = algebra.CrossProduct(op, relations[i])
+            else:
+                op = algebra.Join(condition, op, relations[i])
+
+        sch = expr.scheme()
+        emitters = [(sch.getName(c), UnnamedAttributeRef(index_map[c]))
+                    for c in range(len(owners))]
+        return algebra.Apply(emitters=emitters, input=op)
+
+    def __str__(self):
+        return "Join order => cheapest left-deep join order"
+
+
+class ShareCommonSubplans(Rule):
+
+    """Compute the subplans that the statements of a Sequence or a DoWhile
+    repeat only once.
+
+    Each statement, and each branch of a statement such as the inputs of a
+    UnionAll or of a self-join, is compiled independently, so the same
+    scans, selections and joins are computed once per occurrence. This rule
+    finds the subtrees that are structurally equal and read the same
+    versions of their inputs, i.e., no statement between two occurrences
+    writes a relation or a temporary relation they read. It stores the
+    result of such a subtree with a StoreTemp inserted before the first
+    statement that uses it, and replaces its occurrences with ScanTemps.
+    Larger subtrees are considered first.
+
+    A subtree that occurs k times is shared if the work it saves, k - 1
+    times the estimated number of tuples produced by its operators, exceeds
+    the cost of writing its result once and reading it k times. Subtrees
+    with nondeterministic operators or expressions, e.g., samples and
+    random(), are never shared."""
+
+    # operators whose subtrees may be shared, if their inputs may
+    sharable = (algebra.Select, algebra.Apply, algebra.Join,
+                algebra.CrossProduct, algebra.NaryJoin, algebra.GroupBy,
+                algebra.Distinct, algebra.Project, algebra.Union,
+                algebra.UnionAll, algebra.Intersection, algebra.Difference,
+                algebra.OrderBy, algebra.TopK)
+
+    # the inputs of the shared subtrees, which are not worth sharing alone
+    leaves = (algebra.Scan, algebra.ScanTemp, algebra.FileScan,
+              algebra.EmptyRelation, algebra.SingletonRelation)
+
+    # statements whose plans are not visited: they are optimized on their own
+    blocks = (algebra.Sequence, algebra.DoWhile, algebra.Parallel,
+              algebra.UntilConvergence)
+
+    def __init__(self):
+        # the number of temporary relations created so far, to name them
+        self.num_temps = 0
+        super(ShareCommonSubplans, self).__init__()
+
+    @staticmethod
+    def cardinality(op):
+        try:
+            return op.num_tuples()
+        except NotImplementedError:
+            return algebra.DEFAULT_CARDINALITY
+
+    @staticmethod
+    def is_deterministic(op):
+        """Whether the expressions of an operator are deterministic"""
+        def expressions(value):
+            if isinstance(value, expression.Expression):
+                yield value
+            elif isinstance(value, (list, tuple)):
+                for v in value:
+                    for e in expressions(v):
+                        yield e
+
+        return not any(isinstance(e, RANDOM)
+                       for value in op.__dict__.values()
+                       for ex in expressions(value) for e in ex.walk())
+
+    @staticmethod
+    def writes(op):
+        """The relations and the temporary relations written by a plan"""
+        ret = set()
+        for o in op.walk():
+            if isinstance(o, algebra.Store):
+                ret.add(('relation', str(o.relation_key)))
+            elif isinstance(o, (algebra.StoreTemp, algebra.AppendTemp)):
+                ret.add(('temp', o.name))
+        return ret
+
+    @staticmethod
+    def reads(op):
+        """The relation or the temporary relation read by a leaf"""
+        if isinstance(op, algebra.Scan):
+            return frozenset([('relation', str(op.relation_key))])
+        if isinstance(op, algebra.ScanTemp):
+            return frozenset([('temp', op.name)])
+        return frozenset()
+
+    def temp_name(self, taken):
+        while True:
+            name = '__shared{}'.format(self.num_temps)
+            self.num_temps += 1
+            if name not in taken:
+                return name
+
+    def fire(self, expr):
+        if not isinstance(expr, (algebra.Sequence, algebra.DoWhile)):
+            return expr
+
+        # (relation or temp) -> the number of statements that wrote it
+        versions = collections.defaultdict(int)
+        # (type, shortStr, ids of the children) -> [(operator, id)]
+        signatures = {}
+        ids = itertools.count()
+        # (id, versions read) -> [(statement, operator, parent, number of
+        #                          operators, work)] in program order
+        occurrences = collections.OrderedDict()
+
+        def visit(op, parent, statement):
+            """Register the sharable subtrees of op. Returns the id, the
+            relations read, the number of operators and the work of op if
+            it is sharable, None otherwise."""
+            if isinstance(op, self.blocks):
+                return None
+            infos = [visit(c, op, statement) for c in op.children()]
+            if (not isinstance(op, self.sharable + self.leaves) or
+                    None in infos or not self.is_deterministic(op)):
+                return None
+
+            # equal operators have the same signature; the converse does
+            # not hold for operators that do not compare their arguments
+            signature = (type(op), op.shortStr(),
+                         tuple(info[0] for info in infos))
+            candidates = signatures.setdefault(signature, [])
+            for other, op_id in candidates:
+                if other == op:
+                    break
+            else:
+                op_id = next(ids)
+                candidates.append((op, op_id))
+
+            reads = self.reads(op).union(*[info[1] for info in infos])
+            size = 1 + sum(info[2] for info in infos)
+            work = self.cardinality(op) + sum(info[3] for info in infos)
+            if infos:
+                key = (op_id, frozenset((r, versions[r]) for r in reads))
+                occurrences.setdefault(key, []).append(
+                    (statement, op, parent, size, work))
+            return op_id, reads, size, work
+
+        for i, statement in enumerate(expr.args):
+            visit(statement, None, i)
+            for name in self.writes(statement):
+                versions[name] += 1
+
+        taken = set(op.name for op in expr.walk()
+                    if isinstance(op, (algebra.StoreTemp, algebra.AppendTemp,
+                                       algebra.ScanTemp)))
+        # operators that were moved or replaced
+        covered = set()
+        # statement -> StoreTemps to insert before it
+        stores = collections.defaultdict(list)
+        for occs in sorted(occurrences.values(), key=lambda occs: -occs[0][3]):
+            occs = [occ for occ in occs if id(occ[1]) not in covered]
+            if len(occs) < 2:
+                continue
+            first, op, _, _, work = occs[0]
+            card = self.cardinality(op)
+            if (len(occs) - 1) * work <= (len(occs) + 1) * card:
+                continue
+
+            name = self.temp_name(taken)
+            sch = op.scheme()
+            for statement, occ, parent, _, _ in occs:
+                covered.update(id(o) for o in occ.walk())
+                scan = algebra.ScanTemp(name, sch)
+                scan.analyzed_num_tuples = card
+                if parent is None:
+                    expr.args[statement] = scan
+                else:
+                    parent.apply(lambda c: scan if c is occ else c)
+            stores[first].append(algebra.StoreTemp(name, op))
+
+        if not stores:
+            return expr
+
+        args = []
+        for i, statement in enumerate(expr.args):
+            args.extend(stores[i])
+            args.append(statement)
+        expr.args = args
+        return expr
+
+    def __str__(self):
+        return "Common subplans => StoreTemp, ScanTemp"
+
+
 # logical groups of catalog transparent rules
 # 1. this must be applied first
 remove_trivial_sequences = [RemoveTrivialSequences()]
@@ -843,14 +1281,11 @@ push_project = [
 
 # 5. push apply
 push_apply = [
-    # These really ought to be run until convergence.
-    # For now, run twice and finish with PushApply.
-    PushApply(),
-    RemoveUnusedColumns(),
-    PushApply(),
-    RemoveUnusedColumns(),
-    PushApply(),
-    RemoveNoOpApply(),
+    FixpointGroup([
+        PushApply(),
+        RemoveUnusedColumns(),
+        RemoveNoOpApply(),
+    ])
 ]
 
 
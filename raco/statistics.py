@@ -0,0 +1,335 @@
+"""Column statistics and the selectivity estimates derived from them.
+
+A Catalog may describe the columns of a relation with ColumnStatistics:
+the number of distinct values, the minimum and maximum values, an
+equi-depth histogram and the most common values. The interpreter attaches
+them to the Scan of the relation, and operators look them up through
+Operator.column_statistics() to estimate the selectivity of their
+predicates in num_tuples().
+
+Without statistics, predicates fall back to the System R defaults: 1/10 for
+an equality and 1/3 for a range comparison.
+
+The output of a multiway join is bounded by the AGM bound (Atserias, Grohe
+and Marx, "Size bounds and query plans for relational joins"), computed
+from a fractional edge cover of its join variables by linear programming.
+"""
+
+import bisect
+import collections
+import math
+import numbers
+
+from raco import expression
+
+# System R default selectivities
+DEFAULT_EQ_SELECTIVITY = 0.1
+DEFAULT_RANGE_SELECTIVITY = 1.0 / 3
+DEFAULT_SELECTIVITY = 0.1
+
+# The opposite of each comparison, to put the column on the left
+flipped_comparisons = {expression.EQ: expression.EQ,
+                       expression.NEQ: expression.NEQ,
+                       expression.LT: expression.GT,
+                       expression.LTEQ: expression.GTEQ,
+                       expression.GT: expression.LT,
+                       expression.GTEQ: expression.LTEQ}
+
+
+def is_number(value):
+    return (isinstance(value, numbers.Real) and
+            not isinstance(value, bool))
+
+
+class ColumnStatistics(object):
+    """Statistics of the values of a column.
+
+    histogram is a list of k + 1 bounds of an equi-depth histogram with k
+    buckets: each bucket holds 1/k of the values, which lie between its two
+    bounds. most_common is a list of (value, fraction of the tuples) pairs
+    of the most common values.
+    """
+
+    def __init__(self, num_distinct, min_value=None, max_value=None,
+                 histogram=None, most_common=None):
+        self.num_distinct = num_distinct
+        self.min_value = min_value
+        self.max_value = max_value
+        self.histogram = histogram or []
+        self.most_common = most_common or []
+
+    @classmethod
+    def from_values(cls, values, num_buckets=10, num_most_common=5):
+        """Compute the statistics of a column from its values."""
+        values = sorted(values)
+        if not values:
+            return cls(0)
+
+        counts = collections.Counter(values)
+        most_common = [(v, float(c) / len(values))
+                       for v, c in counts.most_common(num_most_common)
+                       if c > 1]
+
+        num_buckets = min(num_buckets, len(values))
+        histogram = [values[(len(values) - 1) * i // num_buckets]
+                     for i in range(num_buckets + 1)]
+
+        return cls(len(counts), values[0], values[-1], histogram,
+                   most_common)
+
+    @classmethod
+    def from_dict(cls, d):
+        """Read statistics written by to_dict()."""
+        return cls(d['distinct'], d.get('min'), d.get('max'),
+                   d.get('histogram'),
+                   [tuple(mcv) for mcv in d.get('most_common', [])])
+
+    def to_dict(self):
+        return {'distinct': self.num_distinct,
+                'min': self.min_value,
+                'max': self.max_value,
+                'histogram': list(self.histogram),
+                'most_common': [list(mcv) for mcv in self.most_common]}
+
+    def __eq__(self, other):
+        return (isinstance(other, ColumnStatistics) and
+                self.to_dict() == other.to_dict())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "{op}({nd!r}, {mn!r}, {mx!r}, {h!r}, {mc!r})".format(
+            op=self.__class__.__name__, nd=self.num_distinct,
+            mn=self.min_value, mx=self.max_value, h=self.histogram,
+            mc=self.most_common)
+
+    def out_of_range(self, value):
+        try:
+            return ((self.min_value is not None and value < self.min_value)
+                    or (self.max_value is not None and
+                        value > self.max_value))
+        except TypeError:
+            return False
+
+    def equal_fraction(self, value):
+        """The estimated fraction of tuples whose value is value."""
+        if self.num_distinct == 0 or self.out_of_range(value):
+            return 0.0
+        for v, fraction in self.most_common:
+            if v == value:
+                return fraction
+        # the other values share the tuples not taken by the common values
+        rest = 1.0 - sum(f for _, f in self.most_common)
+        others = self.num_distinct - len(self.most_common)
+        if others <= 0:
+            return 0.0
+        return max(rest, 0.0) / others
+
+    def less_fraction(self, value, inclusive=False):
+        """The estimated fraction of tuples whose value is less than value
+        (or equal to it, if inclusive)."""
+        if self.num_distinct == 0:
+            return 0.0
+        equal = self.equal_fraction(value)
+        try:
+            below = self._below_fraction(value)
+        except TypeError:
+            # values that do not compare
+            return DEFAULT_RANGE_SELECTIVITY
+        below = min(max(below, 0.0), 1.0 - equal)
+        return below + equal if inclusive else below
+
+    def _below_fraction(self, value):
+        bounds = self.histogram
+        if len(bounds) < 2:
+            if not (is_number(self.min_value) and is_number(self.max_value)
+                    and is_number(value)):
+                return DEFAULT_RANGE_SELECTIVITY
+            bounds = [self.min_value, self.max_value]
+
+        if value <= bounds[0]:
+            return 0.0
+        if value > bounds[-1]:
+            return 1.0
+        buckets = len(bounds) - 1
+        # the bucket that holds value: bounds[i] < value <= bounds[i + 1]
+        i = bisect.bisect_left(bounds, value) - 1
+        low, high = bounds[i], bounds[i + 1]
+        if is_number(low) and is_number(high) and is_number(value):
+            within = float(value - low) / (high - low) if high > low else 0.0
+        else:
+            within = 0.5
+        return (i + within) / buckets
+
+    def range_fraction(self, comparison, value):
+        """The estimated fraction of tuples whose value compares to value
+        with comparison, one of LT, LTEQ, GT, GTEQ."""
+        if comparison is expression.LT:
+            return self.less_fraction(value)
+        if comparison is expression.LTEQ:
+            return self.less_fraction(value, inclusive=True)
+        if comparison is expression.GT:
+            return 1.0 - self.less_fraction(value, inclusive=True)
+        assert comparison is expression.GTEQ
+        return 1.0 - self.less_fraction(value)
+
+
+def column_position(sexpr, scheme):
+    """The position of the column an expression reads, or None if the
+    expression is not a column reference."""
+    if isinstance(sexpr, expression.UnnamedAttributeRef):
+        return sexpr.position
+    if isinstance(sexpr, expression.NamedAttributeRef):
+        return scheme.asdict.get(sexpr.name, (None,))[0]
+    return None
+
+
+def literal_value(sexpr):
+    if isinstance(sexpr, expression.Literal):
+        return sexpr.value
+    return None
+
+
+def predicate_selectivity(sexpr, scheme, column_statistics):
+    """Estimate the fraction of tuples that satisfy a predicate.
+
+    :param sexpr: a boolean expression over scheme
+    :param column_statistics: a function that returns the ColumnStatistics
+    of a column, given its position in scheme, or None
+    :returns: a pair (selectivity, whether statistics were used)
+    """
+    if isinstance(sexpr, expression.AND):
+        left, lstats = predicate_selectivity(sexpr.left, scheme,
+                                             column_statistics)
+        right, rstats = predicate_selectivity(sexpr.right, scheme,
+                                              column_statistics)
+        return left * right, lstats or rstats
+    if isinstance(sexpr, expression.OR):
+        left, lstats = predicate_selectivity(sexpr.left, scheme,
+                                             column_statistics)
+        right, rstats = predicate_selectivity(sexpr.right, scheme,
+                                              column_statistics)
+        return left + right - left * right, lstats or rstats
+    if isinstance(sexpr, expression.NOT):
+        sel, stats = predicate_selectivity(sexpr.input, scheme,
+                                           column_statistics)
+        return 1.0 - sel, stats
+    if type(sexpr) not in flipped_comparisons:
+        return DEFAULT_SELECTIVITY, False
+
+    comparison = type(sexpr)
+    left = column_position(sexpr.left, scheme)
+    right = column_position(sexpr.right, scheme)
+    if left is None and right is not None:
+        comparison = flipped_comparisons[comparison]
+        left, right = right, left
+        value = literal_value(sexpr.left)
+    else:
+        value = literal_value(sexpr.right)
+    default = (DEFAULT_EQ_SELECTIVITY
+               if comparison in (expression.EQ, expression.NEQ)
+               else DEFAULT_RANGE_SELECTIVITY)
+    if comparison is expression.NEQ:
+        sel, stats = predicate_selectivity(
+            expression.EQ(sexpr.left, sexpr.right), scheme,
+            column_statistics)
+        return 1.0 - sel, stats
+
+    lstats = column_statistics(left) if left is not None else None
+    if right is not None:
+        # a comparison of two columns, e.g., an equijoin condition
+        rstats = column_statistics(right)
+        if comparison is not expression.EQ:
+            return default, False
+        distinct = [s.num_distinct for s in (lstats, rstats)
+                    if s is not None]
+        if not distinct:
+            return default, False
+        return 1.0 / max(max(distinct), 1), True
+
+    if lstats is None or value is None:
+        return default, False
+    if comparison is expression.EQ:
+        return lstats.equal_fraction(value), True
+    return lstats.range_fraction(comparison, value), True
+
+
+def selectivity(condition, scheme, column_statistics):
+    """Estimate the fraction of tuples that satisfy a condition, or return
+    None if there are no statistics on the columns it reads."""
+    sel, stats = predicate_selectivity(condition, scheme, column_statistics)
+    return sel if stats else None
+
+
+def simplex(c, A, b):
+    """Maximize c.y subject to A y <= b and y >= 0, where b >= 0.
+
+    A small dense tableau simplex, for the linear programs of the AGM bound.
+    Bland's rule prevents cycling. Returns the pair (optimal value, y), or
+    (inf, None) if the program is unbounded.
+    """
+    assert all(v >= 0 for v in b)
+    num_rows, num_cols = len(A), len(c)
+    # the tableau of A | I | b, the slack variables form the initial basis
+    rows = [[float(v) for v in A[i]] +
+            [1.0 if j == i else 0.0 for j in range(num_rows)] +
+            [float(b[i])] for i in range(num_rows)]
+    # the reduced costs, with the negated objective value last
+    costs = [float(v) for v in c] + [0.0] * (num_rows + 1)
+    basis = [num_cols + i for i in range(num_rows)]
+    eps = 1e-9
+
+    while True:
+        entering = next((j for j in range(num_cols + num_rows)
+                         if costs[j] > eps), None)
+        if entering is None:
+            break
+        # the ratio test, ties broken by the smallest basic variable
+        leaving, best = None, None
+        for i, row in enumerate(rows):
+            if row[entering] > eps:
+                ratio = row[-1] / row[entering]
+                if (leaving is None or ratio < best - eps or
+                        (ratio < best + eps and
+                         basis[i] < basis[leaving])):
+                    leaving, best = i, ratio
+        if leaving is None:
+            return float('inf'), None
+
+        pivot = rows[leaving]
+        factor = pivot[entering]
+        pivot[:] = [v / factor for v in pivot]
+        for row in rows + [costs]:
+            if row is not pivot and abs(row[entering]) > eps:
+                factor = row[entering]
+                row[:] = [v - factor * p for v, p in zip(row, pivot)]
+        basis[leaving] = entering
+
+    y = [0.0] * num_cols
+    for i, var in enumerate(basis):
+        if var < num_cols:
+            y[var] = rows[i][-1]
+    return -costs[-1], y
+
+
+def agm_bound(sizes, relations):
+    """The AGM bound on the number of tuples of a natural join.
+
+    :param sizes: the number of tuples of each relation
+    :param relations: for each relation, the set of the variables (any
+    hashable values) of its columns
+    :returns: the bound, a float
+
+    The bound is the minimum of prod(sizes[j] ** x[j]) over the fractional
+    edge covers x of the variables. Its logarithm is the optimum of a linear
+    program, computed here through its dual: the maximum of sum(y[v]) such
+    that sum(y[v] for v in relations[j]) <= log(sizes[j]) and y >= 0.
+    """
+    if any(size <= 0 for size in sizes):
+        return 0.0
+    variables = sorted(set().union(*relations))
+    A = [[1 if v in rel else 0 for v in variables] for rel in relations]
+    b = [math.log(max(size, 1)) for size in sizes]
+    log_bound, _ = simplex([1] * len(variables), A, b)
+    return math.exp(log_bound)
@@ -0,0 +1,214 @@
+import collections
+import unittest
+
+import raco.fakedb
+from raco.algebra import Scan, Select, Join, Apply, Shuffle, Store
+from raco.dbconn import DBConnection
+from raco.expression import *
+from raco.relation_key import RelationKey
+from raco.statistics import (ColumnStatistics, selectivity, simplex,
+                             agm_bound, DEFAULT_EQ_SELECTIVITY)
+import raco.scheme as scheme
+from raco import types
+
+"""Test column statistics and the selectivity estimates based on them."""
+
+
+class ColumnStatisticsTest(unittest.TestCase):
+
+    # 0..99, with 50 appearing 101 times
+    values = range(100) + [50] * 100
+
+    def setUp(self):
+        self.stats = ColumnStatistics.from_values(self.values)
+
+    def test_from_values(self):
+        stats = self.stats
+        self.assertEqual(stats.num_distinct, 100)
+        self.assertEqual(stats.min_value, 0)
+        self.assertEqual(stats.max_value, 99)
+        self.assertEqual(len(stats.histogram), 11)
+        self.assertEqual(stats.histogram[0], 0)
+        self.assertEqual(stats.histogram[-1], 99)
+        self.assertEqual(stats.most_common, [(50, 101.0 / 200)])
+
+    def test_empty(self):
+        stats = ColumnStatistics.from_values([])
+        self.assertEqual(stats.num_distinct, 0)
+        self.assertEqual(stats.equal_fraction(1), 0.0)
+        self.assertEqual(stats.less_fraction(1), 0.0)
+
+    def test_dict_round_trip(self):
+        self.assertEqual(ColumnStatistics.from_dict(self.stats.to_dict()),
+                         self.stats)
+
+    def test_equal_fraction(self):
+        self.assertAlmostEqual(self.stats.equal_fraction(50), 101.0 / 200)
+        # the other 99 values share the remaining 99 tuples
+        self.assertAlmostEqual(self.stats.equal_fraction(7), 1.0 / 200)
+        self.assertEqual(self.stats.equal_fraction(1000), 0.0)
+        self.assertEqual(self.stats.equal_fraction(-1), 0.0)
+
+    def test_range_fraction(self):
+        def actual(pred):
+            return float(sum(1 for v in self.values if pred(v))) / \
+                len(self.values)
+
+        for bound in [0, 10, 49, 50, 51, 75, 99]:
+            self.assertAlmostEqual(self.stats.range_fraction(LT, bound),
+                                   actual(lambda v: v < bound), delta=0.1)
+            self.assertAlmostEqual(self.stats.range_fraction(GTEQ, bound),
+                                   actual(lambda v: v >= bound), delta=0.1)
+        self.assertEqual(self.stats.range_fraction(LT, -5), 0.0)
+        self.assertEqual(self.stats.range_fraction(GT, 500), 0.0)
+
+    def test_strings(self):
+        stats = ColumnStatistics.from_values(['a', 'b', 'b', 'c'])
+        self.assertEqual(stats.equal_fraction('b'), 0.5)
+        self.assertEqual(stats.range_fraction(LT, 'a'), 0.0)
+        self.assertEqual(stats.range_fraction(GT, 'c'), 0.0)
+        self.assertEqual(stats.range_fraction(LTEQ, 'c'), 1.0)
+
+
+class SelectivityTest(unittest.TestCase):
+
+    schema = scheme.Scheme([("a", types.LONG_TYPE), ("b", types.LONG_TYPE)])
+
+    def setUp(self):
+        self.stats = [ColumnStatistics.from_values(range(100)), None]
+
+    def selectivity(self, condition):
+        return selectivity(condition, self.schema,
+                           lambda position: self.stats[position])
+
+    def test_no_statistics(self):
+        self.assertIsNone(self.selectivity(
+            EQ(UnnamedAttributeRef(1), NumericLiteral(3))))
+
+    def test_comparisons(self):
+        a = NamedAttributeRef("a")
+        self.assertAlmostEqual(self.selectivity(EQ(a, NumericLiteral(3))),
+                               0.01)
+        self.assertAlmostEqual(self.selectivity(NEQ(a, NumericLiteral(3))),
+                               0.99)
+        self.assertAlmostEqual(self.selectivity(LT(a, NumericLiteral(25))),
+                               0.25, delta=0.02)
+        # the column is on the right
+        self.assertAlmostEqual(self.selectivity(LT(NumericLiteral(25), a)),
+                               0.74, delta=0.02)
+
+    def test_conjunctions(self):
+        a = UnnamedAttributeRef(0)
+        b = UnnamedAttributeRef(1)
+        low = GTEQ(a, NumericLiteral(20))
+        high = LT(a, NumericLiteral(40))
+        self.assertAlmostEqual(self.selectivity(AND(low, high)),
+                               0.8 * 0.4, delta=0.02)
+        # the predicates of a disjunction are assumed independent
+        top = GTEQ(a, NumericLiteral(80))
+        self.assertAlmostEqual(self.selectivity(OR(NOT(low), top)),
+                               0.2 + 0.2 - 0.2 * 0.2, delta=0.02)
+        # the predicate on b uses the default
+        self.assertAlmostEqual(
+            self.selectivity(AND(EQ(a, NumericLiteral(1)),
+                                 EQ(b, NumericLiteral(1)))),
+            0.01 * DEFAULT_EQ_SELECTIVITY)
+
+
+class AGMBoundTest(unittest.TestCase):
+
+    def test_simplex(self):
+        # max 3x + 2y st x + y <= 4, x <= 3
+        value, y = simplex([3, 2], [[1, 1], [1, 0]], [4, 3])
+        self.assertAlmostEqual(value, 11)
+        self.assertEqual(y, [3, 1])
+        # degenerate: max x + y st x + y <= 0
+        self.assertEqual(simplex([1, 1], [[1, 1]], [0])[0], 0)
+        # unbounded: max x st -x <= 1
+        self.assertEqual(simplex([1], [[-1]], [1]), (float('inf'), None))
+
+    def test_agm_bound(self):
+        triangle = [{'x', 'y'}, {'y', 'z'}, {'z', 'x'}]
+        self.assertAlmostEqual(agm_bound([100, 100, 100], triangle), 1000)
+        self.assertAlmostEqual(agm_bound([4, 9, 25], triangle), 2 * 3 * 5)
+        # the join on x of R(x) and S(x) is bounded by the smaller one
+        self.assertAlmostEqual(agm_bound([100, 10], [{'x'}, {'x'}]), 10)
+        # the chain R(x,y), S(y,z) is bounded by the cross product
+        self.assertAlmostEqual(
+            agm_bound([100, 100], [{'x', 'y'}, {'y', 'z'}]), 10000)
+        self.assertEqual(agm_bound([0, 100], [{'x'}, {'x'}]), 0)
+
+
+class EstimateTest(unittest.TestCase):
+
+    schema = scheme.Scheme([("a", types.LONG_TYPE), ("b", types.LONG_TYPE)])
+
+    def setUp(self):
+        self.db = raco.fakedb.FakeDatabase()
+        # R: a in 0..999, b in 0..9; S: a in 0..99
+        self.r_key = RelationKey.from_string("public:adhoc:R")
+        self.s_key = RelationKey.from_string("public:adhoc:S")
+        self.db.ingest(self.r_key, collections.Counter(
+            (i, i % 10) for i in range(1000)), self.schema)
+        self.db.ingest(self.s_key, collections.Counter(
+            (i, 0) for i in range(100)), self.schema)
+
+    def scan(self, key):
+        sch = self.db.get_scheme(key)
+        return Scan(key, sch, self.db.num_tuples(key),
+                    statistics=[self.db.column_statistics(key, name)
+                                for name in sch.get_names()])
+
+    def test_fakedb_statistics(self):
+        stats = self.db.column_statistics(self.r_key, "b")
+        self.assertEqual(stats.num_distinct, 10)
+        self.assertEqual((stats.min_value, stats.max_value), (0, 9))
+        self.assertIsNone(self.db.column_statistics(self.r_key, "c"))
+
+    def test_fakedb_statistics_cached(self):
+        sqlite_db = raco.fakedb.FakeDatabase(table_store=DBConnection)
+        sqlite_db.ingest(self.s_key, collections.Counter(
+            (i, 0) for i in range(100)), self.schema)
+        for db in [self.db, sqlite_db]:
+            db.ingest(self.r_key, collections.Counter(
+                (i, i % 10) for i in range(1000)), self.schema)
+            stats = db.column_statistics(self.r_key, "b")
+            # computed once per version of the relation
+            self.assertIs(db.column_statistics(self.r_key, "b"), stats)
+
+            db.ingest(self.r_key, collections.Counter(
+                (i, i % 5) for i in range(10)), self.schema)
+            self.assertEqual(
+                db.column_statistics(self.r_key, "b").num_distinct, 5)
+
+            db.evaluate(Store(self.r_key, Scan(self.s_key, self.schema)))
+            self.assertEqual(
+                db.column_statistics(self.r_key, "b").num_distinct, 1)
+
+    def test_select_estimate(self):
+        select = Select(LT(UnnamedAttributeRef(0), NumericLiteral(100)),
+                        self.scan(self.r_key))
+        self.assertAlmostEqual(select.num_tuples(), 100, delta=10)
+
+        select = Select(EQ(UnnamedAttributeRef(1), NumericLiteral(3)),
+                        Shuffle(self.scan(self.r_key),
+                                [UnnamedAttributeRef(0)]))
+        self.assertEqual(select.num_tuples(), 100)
+
+        # without statistics
+        select = Select(LT(UnnamedAttributeRef(0), NumericLiteral(100)),
+                        Scan(self.r_key, self.schema, 1000))
+        self.assertEqual(select.num_tuples(), 500)
+
+    def test_join_estimate(self):
+        # an equijoin on a key returns one tuple per tuple of S
+        join = Join(EQ(UnnamedAttributeRef(0), UnnamedAttributeRef(2)),
+                    self.scan(self.r_key), self.scan(self.s_key))
+        self.assertEqual(join.num_tuples(), 100)
+
+        # the statistics follow the columns through an Apply
+        apply = Apply([("x", UnnamedAttributeRef(1)),
+                       ("y", UnnamedAttributeRef(0))], self.scan(self.s_key))
+        join = Join(EQ(UnnamedAttributeRef(0), UnnamedAttributeRef(3)),
+                    self.scan(self.r_key), apply)
+        self.assertEqual(join.num_tuples(), 100)
@@ -0,0 +1,490 @@
+"""Evaluate relational operators on batches of columns with NumPy.
+
+The FakeDatabase evaluates operators one tuple at a time. When it is created
+with vectorized=True, Select, Apply and GroupBy instead evaluate their input
+as a Batch -- one NumPy array per attribute -- and compute expressions and
+aggregates with array operations. Operators and expressions that cannot be
+vectorized (e.g., joins, stateful applies and Python UDFs) are evaluated
+tuple-at-a-time, and their output is converted to a batch when a vectorized
+operator consumes it. So are operators whose integer results may overflow
+int64, which the row executor promotes to Python longs.
+"""
+
+import itertools
+import operator
+
+from raco import types
+from raco.expression import (Literal, NamedAttributeRef, UnnamedAttributeRef,
+                             PLUS, MINUS, TIMES, DIVIDE, IDIVIDE, MOD, NEG,
+                             CAST, Case, NOT, AND, OR, EQ, NEQ, LT, GT, LTEQ,
+                             GTEQ, WORKERID, ABS, CEIL, COS, FLOOR, LOG, SIN,
+                             SQRT, TAN, POW, LESSER, GREATER, COUNTALL, COUNT,
+                             SUM, AVG, MIN, MAX, compile_expression)
+
+# Optional raco dependency: numpy
+# Without it, FakeDatabase(vectorized=True) raises an ImportError
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class NotVectorizable(Exception):
+    """Raised when an expression cannot be evaluated on arrays."""
+    pass
+
+
+# Integer results whose magnitude, estimated in floating point, reaches this
+# bound may have overflowed int64. The row executor computes them instead,
+# since it promotes them to Python longs. The margin below 2 ** 63 covers
+# the rounding of the estimate of a sum.
+INT_LIMIT = 2.0 ** 62
+
+
+def check_int_range(estimate):
+    if np.any(np.abs(estimate) >= INT_LIMIT):
+        raise NotVectorizable()
+
+
+def checked(func):
+    """Wrap an arithmetic function so that it raises NotVectorizable when
+    an integer result may have overflowed."""
+    def wrapped(*args):
+        result = func(*args)
+        if is_integral(result):
+            check_int_range(func(*[np.asarray(a, dtype=np.float64)
+                                   for a in args]))
+        return result
+    return wrapped
+
+
+def check_nonzero(divisor):
+    if np.any(np.asarray(divisor) == 0):
+        raise ZeroDivisionError("division by zero")
+
+
+def is_integral(value):
+    return np.asarray(value).dtype.kind in 'iub'
+
+
+def check_numeric(value):
+    if np.asarray(value).dtype.kind not in 'iubf':
+        raise NotVectorizable()
+
+
+def divide(left, right):
+    check_nonzero(right)
+    return np.true_divide(np.asarray(left, dtype=np.float64), right)
+
+
+def idivide(left, right):
+    check_numeric(left)
+    check_numeric(right)
+    check_nonzero(right)
+    if is_integral(left) and is_integral(right):
+        return checked(np.floor_divide)(left, right)
+    quotient = np.trunc(np.true_divide(left, right))
+    check_int_range(quotient)
+    return quotient.astype(np.int64)
+
+
+def mod(left, right):
+    check_numeric(left)
+    check_numeric(right)
+    check_nonzero(right)
+    return np.mod(left, right).astype(np.int64)
+
+
+def power(left, right):
+    if is_integral(left) and is_integral(right) and np.any(
+            np.asarray(right) < 0):
+        left = np.asarray(left, dtype=np.float64)
+    return np.power(left, right)
+
+
+def float_function(name, domain=None):
+    """Return a NumPy version of a function from the math module."""
+    def func(value):
+        value = np.asarray(value, dtype=np.float64)
+        if domain is not None and not np.all(domain(value)):
+            raise ValueError("math domain error")
+        return getattr(np, name)(value)
+    return func
+
+
+unary_functions = {NEG: checked(lambda v: -1 * v),
+                   ABS: checked(lambda v: np.abs(v)),
+                   CEIL: float_function('ceil'),
+                   COS: float_function('cos'),
+                   FLOOR: float_function('floor'),
+                   LOG: float_function('log', lambda v: v > 0),
+                   SIN: float_function('sin'),
+                   SQRT: float_function('sqrt', lambda v: v >= 0),
+                   TAN: float_function('tan')}
+
+binary_functions = {PLUS: checked(operator.add),
+                    MINUS: checked(operator.sub),
+                    TIMES: checked(operator.mul),
+                    DIVIDE: divide,
+                    IDIVIDE: idivide,
+                    MOD: mod,
+                    EQ: operator.eq,
+                    NEQ: operator.ne,
+                    LT: operator.lt,
+                    GT: operator.gt,
+                    LTEQ: operator.le,
+                    GTEQ: operator.ge,
+                    POW: checked(power),
+                    LESSER: lambda l, r: np.minimum(l, r),
+                    GREATER: lambda l, r: np.maximum(l, r)}
+
+vectorized_expressions = (set(unary_functions) | set(binary_functions) |
+                          {NamedAttributeRef, UnnamedAttributeRef, CAST, Case,
+                           NOT, AND, OR, WORKERID})
+
+vectorized_aggregates = {COUNTALL, COUNT, SUM, AVG, MIN, MAX}
+
+
+def is_vectorizable(expr):
+    """Can the expression be evaluated on arrays?"""
+    return all(isinstance(e, Literal) or type(e) in vectorized_expressions
+               for e in expr.walk())
+
+
+def object_column(values):
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+def to_column(values, _type):
+    """Convert a list of values of a raco type to an array.
+
+    Values are kept in an object array unless they are represented exactly
+    by the NumPy type corresponding to the raco type."""
+    if _type in (types.LONG_TYPE, types.INT_TYPE):
+        kinds = 'i'
+    elif _type in (types.DOUBLE_TYPE, types.FLOAT_TYPE):
+        kinds = 'f'
+    elif _type == types.BOOLEAN_TYPE:
+        kinds = 'b'
+    else:
+        return object_column(values)
+
+    column = np.array(values)
+    if column.dtype.kind not in kinds or column.ndim != 1:
+        return object_column(values)
+    return column
+
+
+def as_column(value, size):
+    """Broadcast the result of an expression to an array."""
+    if isinstance(value, np.ndarray) and value.ndim == 1:
+        return value
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, basestring):
+        return object_column([value] * size)
+    return np.array([value] * size)
+
+
+def truth(value, size):
+    """Return a boolean array with the truth value of each element."""
+    if not isinstance(value, np.ndarray):
+        return np.repeat(bool(value), size)
+    if value.dtype.kind == 'b':
+        return value
+    if value.dtype.kind in 'iuf':
+        return value != 0
+    return np.array([bool(v) for v in value], dtype=bool)
+
+
+class Batch(object):
+    """A bag of tuples stored as one array per attribute."""
+
+    def __init__(self, columns, size):
+        self.columns = columns
+        self.size = size
+
+    @staticmethod
+    def from_tuples(tuples, scheme):
+        tuples = list(tuples)
+        if not tuples:
+            return Batch([np.empty(0, dtype=object) for _ in scheme], 0)
+        # Tuples may have more values than attributes in the scheme, e.g.
+        # the output of CalculateSamplingDistribution.
+        _types = scheme.get_types()
+        _types += [None] * (len(tuples[0]) - len(_types))
+        return Batch([to_column(list(values), _type)
+                      for values, _type in zip(zip(*tuples), _types)],
+                     len(tuples))
+
+    def take(self, indices):
+        return Batch([c[indices] for c in self.columns], len(indices))
+
+    def tuples(self):
+        if not self.columns:
+            return itertools.repeat((), self.size)
+        return itertools.izip(*[c.tolist() for c in self.columns])
+
+
+def evaluate_expression(expr, batch, scheme):
+    """Evaluate an expression on each tuple of a batch.
+
+    :return: An array with one value per tuple, or a scalar if the value of
+    the expression is the same for every tuple.
+    """
+    if isinstance(expr, Literal):
+        return expr.value
+
+    _type = type(expr)
+    if _type in (NamedAttributeRef, UnnamedAttributeRef):
+        return batch.columns[expr.get_position(scheme)]
+    if _type == WORKERID:
+        return 0
+    if _type in unary_functions:
+        return unary_functions[_type](
+            evaluate_expression(expr.input, batch, scheme))
+    if _type in binary_functions:
+        return binary_functions[_type](
+            evaluate_expression(expr.left, batch, scheme),
+            evaluate_expression(expr.right, batch, scheme))
+    if _type == NOT:
+        return ~truth(evaluate_expression(expr.input, batch, scheme),
+                      batch.size)
+    if _type in (AND, OR):
+        # Like Python, evaluate the right operand only for the tuples on
+        # which the result depends on it
+        left = truth(evaluate_expression(expr.left, batch, scheme),
+                     batch.size)
+        result = left.copy()
+        indices = np.flatnonzero(left if _type == AND else ~left)
+        right = evaluate_expression(expr.right, batch.take(indices), scheme)
+        result[indices] = truth(right, len(indices))
+        return result
+    if _type == CAST:
+        return cast(expr, evaluate_expression(expr.input, batch, scheme))
+    if _type == Case:
+        return case(expr, batch, scheme)
+    raise NotVectorizable(expr)
+
+
+def cast(expr, value):
+    _type = expr.typeof(None, None)
+    pytype = types.reverse_python_type_map[_type]
+    if not isinstance(value, np.ndarray):
+        return pytype(value)
+    if value.dtype.kind in 'iubf':
+        if _type in (types.LONG_TYPE, types.INT_TYPE):
+            if value.dtype.kind == 'f':
+                check_int_range(value)
+            return value.astype(np.int64)
+        if _type in (types.DOUBLE_TYPE, types.FLOAT_TYPE):
+            return value.astype(np.float64)
+    return object_column([pytype(v) for v in value.tolist()])
+
+
+def case(expr, batch, scheme):
+    # Evaluate each result only on the tuples that select it
+    result = np.empty(batch.size, dtype=object)
+    remaining = np.arange(batch.size)
+    for test_expr, result_expr in expr.when_tuples:
+        test = truth(evaluate_expression(
+            test_expr, batch.take(remaining), scheme), len(remaining))
+        selected = remaining[test]
+        value = evaluate_expression(result_expr, batch.take(selected), scheme)
+        result[selected] = value.item() if isinstance(
+            value, np.generic) else value
+        remaining = remaining[~test]
+    value = evaluate_expression(expr.else_expr, batch.take(remaining), scheme)
+    result[remaining] = value.item() if isinstance(
+        value, np.generic) else value
+    return result
+
+
+def group_ids(key_columns, size):
+    """Number the distinct combinations of key values from 0."""
+    ids = np.zeros(size, dtype=np.int64)
+    for column in key_columns:
+        values, inverse = np.unique(column, return_inverse=True)
+        _, ids = np.unique(ids * len(values) + inverse, return_inverse=True)
+    return ids
+
+
+def reduce_groups(agg, values, starts, sizes):
+    """Compute an aggregate of the sorted values of each group."""
+    _type = type(agg)
+    if _type == COUNTALL:
+        return sizes
+    if values.dtype.kind == 'O' and any(v is None for v in values):
+        if _type == COUNT:
+            not_null = np.array([v is not None for v in values], dtype=int)
+            return np.add.reduceat(not_null, starts)
+        raise NotVectorizable(agg)
+    if _type == COUNT:
+        return sizes
+    if _type == MIN:
+        return np.minimum.reduceat(values, starts)
+    if _type == MAX:
+        return np.maximum.reduceat(values, starts)
+    if values.dtype.kind == 'b':
+        values = values.astype(np.int64)
+    sums = np.add.reduceat(values, starts)
+    if is_integral(sums):
+        check_int_range(np.add.reduceat(values.astype(np.float64), starts))
+    if _type == SUM:
+        return sums
+    assert _type == AVG
+    if sums.dtype.kind in 'iub':
+        # Python 2 integer division, as in AVG.finalize_state
+        return np.floor_divide(sums, sizes)
+    if sums.dtype.kind == 'f':
+        return np.true_divide(sums, sizes)
+    return object_column([s / c for s, c in zip(sums, sizes)])
+
+
+class VectorizedExecutor(object):
+    """Evaluate operators of a FakeDatabase on batches of columns."""
+
+    # Operators evaluated on batches when their output is requested
+    vectorized_operators = {'select', 'myriaselect', 'apply', 'myriaapply',
+                            'groupby', 'myriagroupby'}
+
+    # Operators that produce batches for vectorized operators
+    batch_operators = vectorized_operators | {'scan', 'myriascan', 'scantemp',
+                                              'myriascantemp'}
+
+    def __init__(self, db):
+        if np is None:
+            raise ImportError("Vectorized evaluation requires numpy")
+        self.db = db
+
+    def evaluate(self, op):
+        """Evaluate an operator on batches.
+
+        :return: A Batch with the output of the operator, or None if the
+        operator is not vectorized.
+        """
+        name = op.opname().lower()
+        if name not in self.vectorized_operators:
+            return None
+        return getattr(self, name)(op)
+
+    def batch(self, op):
+        """Return the output of an operator as a Batch."""
+        if id(op) in self.db.materialized:
+            # A loop-invariant subplan that the database keeps
+            return Batch.from_tuples(self.db.evaluate(op), op.scheme())
+        name = op.opname().lower()
+        if name in self.batch_operators:
+            batch = getattr(self, name)(op)
+            if batch is not None:
+                return batch
+        return Batch.from_tuples(self.db.evaluate_rows(op), op.scheme())
+
+    def scan_columns(self, store, key, scheme):
+        if not hasattr(store, 'get_columns'):
+            return None
+        size = store.num_tuples(key)
+        columns = []
+        for column, _type in zip(store.get_columns(key), scheme.get_types()):
+            if not isinstance(column, list) and size > 0:
+                # Copy, since the column may grow after the scan
+                columns.append(
+                    np.frombuffer(column, dtype=column.typecode).copy())
+            else:
+                columns.append(to_column(list(column), _type))
+        return Batch(columns, size)
+
+    def scan(self, op):
+        return self.scan_columns(self.db.tables, op.relation_key, op.scheme())
+
+    def scantemp(self, op):
+        return self.scan_columns(self.db.temp_tables, op.name, op.scheme())
+
+    def select(self, op):
+        if not is_vectorizable(op.condition):
+            return None
+        child = self.batch(op.input)
+        try:
+            keep = truth(evaluate_expression(op.condition, child, op.scheme()),
+                         child.size)
+            return child.take(np.flatnonzero(keep))
+        except NotVectorizable:
+            condition = compile_expression(op.condition, op.scheme())
+            return Batch.from_tuples(
+                itertools.ifilter(condition, child.tuples()), op.scheme())
+
+    def apply(self, op):
+        emitters = [expr for (_, expr) in op.emitters]
+        if not all(is_vectorizable(expr) for expr in emitters):
+            return None
+        child = self.batch(op.input)
+        scheme = op.input.scheme()
+        try:
+            columns = [as_column(evaluate_expression(expr, child, scheme),
+                                 child.size) for expr in emitters]
+            return Batch(columns, child.size)
+        except NotVectorizable:
+            return Batch.from_tuples(
+                self.db.apply_rows(op, child.tuples()), op.scheme())
+
+    def groupby(self, op):
+        if not all(type(agg) in vectorized_aggregates and
+                   (agg.get_input() is None or
+                    is_vectorizable(agg.get_input()))
+                   for agg in op.aggregate_list):
+            return None
+        if not all(is_vectorizable(expr) for expr in op.grouping_list):
+            return None
+
+        child = self.batch(op.input)
+        scheme = op.input.scheme()
+        try:
+            return self.group_batch(op, child, scheme)
+        except NotVectorizable:
+            return Batch.from_tuples(
+                self.db.groupby_rows(op, child.tuples()), op.scheme())
+
+    def group_batch(self, op, child, scheme):
+        if child.size == 0:
+            if op.grouping_list:
+                return Batch.from_tuples([], op.scheme())
+            # A single group with the value of each aggregate over no tuples
+            return Batch.from_tuples(
+                [tuple(agg.finalize_state(agg.init_state())
+                       for agg in op.aggregate_list)], op.scheme())
+
+        keys = [as_column(evaluate_expression(expr, child, scheme),
+                          child.size) for expr in op.grouping_list]
+        ids = group_ids(keys, child.size)
+        order = np.argsort(ids, kind='mergesort')
+        sorted_ids = ids[order]
+        starts = np.flatnonzero(
+            np.concatenate(([True], sorted_ids[1:] != sorted_ids[:-1])))
+        sizes = np.diff(np.append(starts, child.size))
+
+        columns = [key[order[starts]] for key in keys]
+        for agg in op.aggregate_list:
+            values = None
+            if agg.get_input() is not None:
+                values = as_column(
+                    evaluate_expression(agg.get_input(), child, scheme),
+                    child.size)[order]
+            columns.append(reduce_groups(agg, values, starts, sizes))
+        return Batch(columns, len(starts))
+
+    def myriascan(self, op):
+        return self.scan(op)
+
+    def myriascantemp(self, op):
+        return self.scantemp(op)
+
+    def myriaselect(self, op):
+        return self.select(op)
+
+    def myriaapply(self, op):
+        return self.apply(op)
+
+    def myriagroupby(self, op):
+        return self.groupby(op)
@@ -0,0 +1,138 @@
+import collections
+import unittest
+
+import raco.fakedb
+from raco.algebra import Scan, Select, Apply, GroupBy, Join
+from raco.expression import *
+from raco.fake_data import FakeData
+from raco.myrial import query_tests
+from raco.relation_key import RelationKey
+from raco.vectorized import Batch, is_vectorizable
+import raco.scheme as scheme
+import raco.types as types
+
+"""Test the vectorized evaluation of operators in the FakeDatabase."""
+
+
+class VectorizedTest(unittest.TestCase, FakeData):
+
+    def setUp(self):
+        self.row_db = raco.fakedb.FakeDatabase()
+        self.db = raco.fakedb.FakeDatabase(vectorized=True)
+        for db in [self.row_db, self.db]:
+            db.ingest(FakeData.emp_key, FakeData.emp_table,
+                      FakeData.emp_schema)
+
+    def emp(self):
+        return Scan(RelationKey.from_string(FakeData.emp_key),
+                    FakeData.emp_schema)
+
+    def check(self, op):
+        expected = self.row_db.evaluate_to_bag(op)
+        self.assertTrue(self.db.vectorized_executor.evaluate(op) is not None)
+        self.assertEquals(self.db.evaluate_to_bag(op), expected)
+
+    def test_select(self):
+        salary = NamedAttributeRef("salary")
+        self.check(Select(AND(GT(salary, NumericLiteral(5000)),
+                              NEQ(NamedAttributeRef("dept_id"),
+                                  NumericLiteral(3))), self.emp()))
+
+    def test_apply(self):
+        salary = NamedAttributeRef("salary")
+        ident = NamedAttributeRef("id")
+        self.check(Apply([("a", PLUS(salary, NumericLiteral(1))),
+                          ("b", DIVIDE(salary, ident)),
+                          ("c", IDIVIDE(salary, NumericLiteral(7))),
+                          ("d", MOD(ident, NumericLiteral(3))),
+                          ("e", SQRT(salary)),
+                          ("f", StringLiteral("x")),
+                          ("g", NamedAttributeRef("name")),
+                          ("h", CAST(types.STRING_TYPE, ident))],
+                         self.emp()))
+
+    def test_lazy_evaluation(self):
+        # The division is only evaluated where the divisor is not zero
+        dept_id = MINUS(NamedAttributeRef("dept_id"), NumericLiteral(1))
+        case = Case([(EQ(dept_id, NumericLiteral(0)), NumericLiteral(0))],
+                    IDIVIDE(NamedAttributeRef("salary"), dept_id))
+        self.check(Apply([("x", case)], self.emp()))
+
+        cond = AND(NEQ(dept_id, NumericLiteral(0)),
+                   GT(IDIVIDE(NumericLiteral(10), dept_id), NumericLiteral(5)))
+        self.check(Select(cond, self.emp()))
+
+        with self.assertRaises(ZeroDivisionError):
+            self.db.evaluate_to_bag(
+                Apply([("x", DIVIDE(NumericLiteral(1), dept_id))],
+                      self.emp()))
+
+    def test_group_by(self):
+        salary = NamedAttributeRef("salary")
+        dept_id = NamedAttributeRef("dept_id")
+        aggs = [COUNTALL(), COUNT(salary), SUM(salary), AVG(salary),
+                MIN(NamedAttributeRef("name")), MAX(salary)]
+        self.check(GroupBy([dept_id], aggs, self.emp()))
+        self.check(GroupBy([dept_id, GT(salary, NumericLiteral(5000))],
+                           aggs, self.emp()))
+        self.check(GroupBy([], [SUM(salary), AVG(salary)], self.emp()))
+
+    def test_group_by_empty_input(self):
+        empty = Select(EQ(NamedAttributeRef("id"), NumericLiteral(0)),
+                       self.emp())
+        salary = NamedAttributeRef("salary")
+        self.check(GroupBy([], [COUNTALL(), SUM(salary)], empty))
+        self.check(GroupBy([NamedAttributeRef("dept_id")], [SUM(salary)],
+                           empty))
+
+    def test_row_at_a_time_input(self):
+        # Joins are evaluated one tuple at a time
+        join = Join(EQ(UnnamedAttributeRef(1), UnnamedAttributeRef(4)),
+                    self.emp(), self.emp())
+        self.check(GroupBy([UnnamedAttributeRef(0)], [COUNTALL()], join))
+
+    def test_integer_overflow(self):
+        # Results that do not fit in int64 are Python longs, as in the row
+        # executor
+        schema = scheme.Scheme([("a", types.LONG_TYPE)])
+        key = RelationKey.from_string("public:adhoc:big")
+        for db in [self.row_db, self.db]:
+            db.ingest(key, collections.Counter([(2 ** 62,), (2 ** 62,),
+                                                (-2 ** 63,), (3,)]), schema)
+        big = Scan(key, schema)
+        a = NamedAttributeRef("a")
+        self.check(GroupBy([], [SUM(a), AVG(a)], big))
+        self.check(GroupBy([EQ(a, NumericLiteral(3))], [SUM(a)], big))
+        self.check(Apply([("x", PLUS(a, a)), ("y", TIMES(a, a)),
+                          ("z", NEG(a)), ("w", ABS(a)),
+                          ("v", IDIVIDE(a, NumericLiteral(-1)))], big))
+        self.check(Select(GT(MINUS(a, NumericLiteral(2 ** 62)),
+                             NumericLiteral(0)), big))
+        self.assertIn((2 ** 63,), self.db.evaluate_to_bag(
+            Apply([("x", PLUS(a, a))], big)))
+
+    def test_not_vectorizable(self):
+        udf = PYUDF("f", types.LONG_TYPE, NamedAttributeRef("id"),
+                    source="lambda x: x * 2")
+        self.assertFalse(is_vectorizable(udf))
+        op = Apply([("x", udf)], self.emp())
+        self.assertTrue(self.db.vectorized_executor.evaluate(op) is None)
+        self.assertEquals(
+            self.db.evaluate_to_bag(op),
+            collections.Counter((t[0] * 2,) for t in FakeData.emp_table))
+
+    def test_batch_from_tuples(self):
+        schema = FakeData.emp_schema
+        batch = Batch.from_tuples([(1, 2, "a", 2 ** 70), (2, 3, "b", 1)],
+                                  schema)
+        self.assertEquals(batch.columns[0].dtype.kind, 'i')
+        self.assertEquals(batch.columns[3].dtype.kind, 'O')
+        self.assertEquals(list(batch.tuples()),
+                          [(1, 2, "a", 2 ** 70), (2, 3, "b", 1)])
+
+
+class VectorizedQueryTests(query_tests.TestQueryFunctions):
+    """Run the query tests with Select, Apply and GroupBy vectorized."""
+
+    def create_db(self):
+        return raco.fakedb.FakeDatabase(vectorized=True)